@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 from flask_cors import CORS
 import pandas as pd
 import numpy as np
@@ -16,6 +16,13 @@ from modules.stacking_ensemble import StackingEnsembleService
 from modules.auto_ml import AutoMLService
 from modules.visualization import VisualizationService
 from modules.report import ReportService
+from modules.dataset_registry import DatasetRegistry
+from modules.preprocessing import PipelineStore
+from modules.profiler import DataProfiler
+from modules.jobs import JobManager, DatasetHandle
+from modules.executor import core_budget
+from modules.fit_cache import FitCache
+from modules.model_registry import ModelRegistry
 
 app = Flask(__name__)
 # 增强CORS配置，允许所有头信息和方法
@@ -27,6 +34,11 @@ app.config['DATA_FOLDER'] = 'data'
 app.config['MODELS_FOLDER'] = 'models'
 app.config['REPORTS_FOLDER'] = 'reports'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max upload
+app.config['DATASET_MEMORY_BUDGET'] = 2 * 1024 * 1024 * 1024  # 数据集注册表内存预算 2GB
+app.config['MAX_CONCURRENT_JOBS'] = int(os.environ.get('MAX_CONCURRENT_JOBS', 2))  # 同时运行的训练任务数
+app.config['TRAINING_CORES'] = int(os.environ.get('TRAINING_CORES') or os.cpu_count() or 1)  # 训练可用的CPU核心总数
+app.config['FIT_CACHE_BYTES'] = int(os.environ.get('FIT_CACHE_BYTES', 1024 * 1024 * 1024))  # 拟合结果缓存的磁盘上限 1GB
+app.config['MODEL_MEMORY_BUDGET'] = int(os.environ.get('MODEL_MEMORY_BUDGET', 1024 * 1024 * 1024))  # 驻留内存的模型上限 1GB
 
 # Create necessary directories
 for folder in [app.config['UPLOAD_FOLDER'], app.config['DATA_FOLDER'], 
@@ -34,23 +46,178 @@ for folder in [app.config['UPLOAD_FOLDER'], app.config['DATA_FOLDER'],
     os.makedirs(folder, exist_ok=True)
 
 # Initialize services
-data_service = DataProcessingService()
-ml_service = MachineLearningService()
-stacking_service = StackingEnsembleService()
-automl_service = AutoMLService()
+# 数据处理和报表服务共享同一个列统计缓存
+data_profiler = DataProfiler()
+data_service = DataProcessingService(profiler=data_profiler)
+# 机器学习、Stacking和AutoML服务共享同一个磁盘拟合结果缓存
+fit_cache = FitCache(os.path.join(app.config['MODELS_FOLDER'], 'fit_cache'), app.config['FIT_CACHE_BYTES'])
+ml_service = MachineLearningService(fit_cache=fit_cache)
+stacking_service = StackingEnsembleService(fit_cache=fit_cache)
+automl_service = AutoMLService(fit_cache=fit_cache)
 viz_service = VisualizationService()
-report_service = ReportService()
+report_service = ReportService(profiler=data_profiler)
+dataset_registry = DatasetRegistry(
+    os.path.join(app.config['DATA_FOLDER'], 'registry'),
+    app.config['DATASET_MEMORY_BUDGET']
+)
+# 模型保存在models目录中，启动时只索引元数据，预测时按需加载
+model_registry = ModelRegistry(app.config['MODELS_FOLDER'], app.config['MODEL_MEMORY_BUDGET'])
+# 同步训练共用进程内的核心预算；异步任务平分核心，每个任务子进程只使用自己的份额
+core_budget.configure(app.config['TRAINING_CORES'])
+job_manager = JobManager(
+    os.path.join(app.config['DATA_FOLDER'], 'jobs'),
+    max_concurrent=app.config['MAX_CONCURRENT_JOBS'],
+    cores=app.config['TRAINING_CORES']
+)
 
 # Global state storage (in production, use Redis or database)
+# 数据集本身保存在dataset_registry中，模型保存在model_registry中，这里只记录当前默认的数据集ID和模型ID
 app_state = {
-    'train_data': None,
-    'test_data': None,
-    'models': {},
+    'train_dataset_id': None,
+    'test_dataset_id': None,
     'current_model': None,
     'preprocessing_params': {},
+    # 派生数据集ID -> 生成该数据集的已拟合预处理流水线，与数据集注册表一起保存在磁盘上
+    'pipelines': PipelineStore(os.path.join(app.config['DATA_FOLDER'], 'registry', 'pipelines')),
     'training_history': []
 }
 
+def _resolve_dataset_id(data_type='train', dataset_id=None):
+    """未指定数据集ID时使用当前的训练/测试数据集ID"""
+    return dataset_id or app_state.get(f'{data_type}_dataset_id')
+
+def _get_dataset(data_type='train', dataset_id=None):
+    """按数据集ID获取DataFrame，未指定ID时使用当前的训练/测试数据集"""
+    dataset_id = _resolve_dataset_id(data_type, dataset_id)
+    if not dataset_id:
+        return None
+    return dataset_registry.get(dataset_id)
+
+def _register_datasets(result, **meta):
+    """将服务返回的DataFrame注册到数据集注册表，并设为当前数据集"""
+    for data_type in ('train', 'test'):
+        dataset_id = result.get(f'{data_type}_dataset_id')
+        if dataset_id is None:
+            continue
+        if result.get(f'{data_type}_data') is not None:
+            dataset_meta = dict(meta, **result.get(f'{data_type}_meta', {}))
+            dataset_registry.put(dataset_id, result[f'{data_type}_data'], kind=data_type, **dataset_meta)
+        if result.get(f'{data_type}_pipeline') is not None:
+            # 追加得到的数据集沿用基础数据集的预处理流水线
+            app_state['pipelines'][dataset_id] = result[f'{data_type}_pipeline']
+        app_state[f'{data_type}_dataset_id'] = dataset_id
+
+def _attach_preprocessing(result, dataset_id):
+    """记录模型的训练数据集，并将生成该数据集的预处理流水线随模型一起保存"""
+    pipeline = app_state['pipelines'].get(dataset_id)
+    if result['model'].get('parent_model_id'):
+        # 继续训练得到的新版本沿用原模型的预处理流水线
+        pipeline = result['model'].get('preprocessing')
+    result['model']['dataset_id'] = dataset_id
+    result['model']['preprocessing'] = pipeline
+    if 'model_info' in result:
+        result['model_info']['preprocessing'] = pipeline.to_dict() if pipeline is not None else None
+
+def _applied_pipeline_id(dataset_id):
+    """数据集已经应用过的预处理流水线ID"""
+    info = dataset_registry.info(dataset_id) if dataset_id else None
+    return (info or {}).get('pipeline_id')
+
+def _ensure_columns(data_type, dataset_id, columns):
+    """投影数据集缺少需要的列时，按相同的行过滤和抽样从源文件补读这些列，注册为新的数据集"""
+    data = dataset_registry.get(dataset_id)
+    info = dataset_registry.info(dataset_id) or {}
+    projection = info.get('projection')
+    missing = [col for col in columns if col not in data.columns]
+    if not missing or not projection or projection.get('columns') is None:
+        return dataset_id, data
+    
+    projection = dict(projection, columns=projection['columns'] + missing)
+    projected_id = data_service.projected_id(info['source_id'], projection)
+    if projected_id not in dataset_registry:
+        print(f"数据集 {dataset_id} 缺少列 {missing}，从源文件补读")
+        projected_data = data_service.load_source(info['source_path'], projection)
+        dataset_registry.put(projected_id, projected_data, kind=info.get('kind', data_type), source=info.get('source'),
+                             **data_service.projection_meta(info['source_id'], info['source_path'], projection))
+    return projected_id, dataset_registry.get(projected_id)
+
+def _model_input_columns(model_info, include_targets=False):
+    """模型预测所需的列: 特征列和预处理流水线用到的列"""
+    columns = list(model_info['feature_columns'])
+    if include_targets:
+        columns += model_info['target_columns']
+    pipeline = model_info.get('preprocessing')
+    while pipeline is not None:
+        columns += getattr(pipeline, 'numeric_columns', [])
+        pipeline = pipeline.previous
+    return list(dict.fromkeys(columns))
+
+def _training_columns(params):
+    """显式指定特征列时训练所需的列"""
+    if not params.get('feature_columns'):
+        return []
+    return list(dict.fromkeys(params['feature_columns'] + params.get('target_columns', [])))
+
+def _dataset_handle(dataset_id):
+    """将数据集写成列式文件，返回可传给训练子进程的引用"""
+    if not dataset_id or dataset_id not in dataset_registry:
+        return None
+    dataset_registry.get(dataset_id)
+    return DatasetHandle(dataset_registry.persist(dataset_id))
+
+def _store_trained_model(result, dataset_id, model_type, label, metrics_key='metrics'):
+    """记录训练好的模型和训练历史并保存模型文件，返回JSON可序列化的结果"""
+    if not result['success']:
+        print(f"{label}训练失败: {result.get('message', '未知错误')}")
+        return result
+    
+    model_id = result['model_id']
+    _attach_preprocessing(result, dataset_id)
+    app_state['current_model'] = model_id
+    app_state['training_history'].append({
+        'timestamp': datetime.now().isoformat(),
+        'model_type': model_type,
+        'model_id': model_id,
+        'metrics': result.get(metrics_key, {})
+    })
+    print(f"{label}训练成功: {model_id}")
+    
+    # 注册完整的模型信息（包含模型对象）并保存到文件系统，保存失败时模型仍保留在内存中
+    try:
+        model_file_path = model_registry.put(model_id, result['model'])
+        print(f"{label}已保存到: {model_file_path}")
+    except Exception as e:
+        print(f"{label}保存异常: {str(e)}")
+    
+    # 创建JSON可序列化的响应（移除模型对象）
+    json_result = result.copy()
+    if 'model' in json_result:
+        del json_result['model']  # 移除不可序列化的模型对象
+    return json_result
+
+def _submit_training(kind, func, args, dataset_id, model_type, label, metrics_key='metrics'):
+    """提交异步训练任务，任务完成后按与同步训练相同的方式保存模型"""
+    job_id = job_manager.submit(
+        kind,
+        func,
+        args,
+        on_done=lambda result: _store_trained_model(result, dataset_id, model_type, label, metrics_key),
+        meta={'dataset_id': dataset_id, 'model_type': model_type}
+    )
+    return jsonify({
+        'success': True,
+        'message': '训练任务已提交',
+        'job_id': job_id,
+        'state': job_manager.QUEUED
+    }), 202
+
+def _dataset_ids():
+    """当前训练/测试数据集ID，用于接口响应"""
+    return {
+        'train_dataset_id': app_state.get('train_dataset_id'),
+        'test_dataset_id': app_state.get('test_dataset_id')
+    }
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -60,20 +227,17 @@ def health_check():
 def get_system_status():
     """Get system status including data loading status and model information"""
     try:
-        # 计算数据状态
-        train_data_loaded = app_state['train_data'] is not None
-        test_data_loaded = app_state['test_data'] is not None
+        # 计算数据状态（从注册表元数据读取，不加载数据本身）
+        train_info = dataset_registry.info(app_state['train_dataset_id']) if app_state['train_dataset_id'] else None
+        test_info = dataset_registry.info(app_state['test_dataset_id']) if app_state['test_dataset_id'] else None
+        train_data_loaded = train_info is not None
+        test_data_loaded = test_info is not None
         
-        train_data_shape = None
-        test_data_shape = None
-        
-        if train_data_loaded:
-            train_data_shape = list(app_state['train_data'].shape)
-        if test_data_loaded:
-            test_data_shape = list(app_state['test_data'].shape)
+        train_data_shape = train_info['shape'] if train_data_loaded else None
+        test_data_shape = test_info['shape'] if test_data_loaded else None
         
         # 计算模型状态
-        trained_models = len(app_state['models'])
+        trained_models = len(model_registry)
         current_model = app_state.get('current_model')
         training_history = len(app_state.get('training_history', []))
         
@@ -82,6 +246,11 @@ def get_system_status():
             'test_data_loaded': test_data_loaded,
             'train_data_shape': train_data_shape,
             'test_data_shape': test_data_shape,
+            'train_dataset_id': app_state['train_dataset_id'],
+            'test_dataset_id': app_state['test_dataset_id'],
+            'datasets_in_memory_bytes': dataset_registry.memory_usage(),
+            'fit_cache': fit_cache.stats(),
+            'models_in_memory_bytes': model_registry.memory_usage(),
             'trained_models': trained_models,
             'current_model': current_model,
             'training_history': training_history
@@ -94,20 +263,25 @@ def get_system_status():
 # Data Processing endpoints
 @app.route('/api/data/load-default', methods=['POST'])
 def load_default_data():
-    """Load default training and testing data"""
+    """Load default training and testing data
+    
+    可选JSON参数columns/filters/sample_frac只加载需要的列和行。
+    """
     try:
-        result = data_service.load_default_data()
+        try:
+            projection = data_service.normalize_projection(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        result = data_service.load_default_data(registry=dataset_registry, projection=projection)
         if result['success']:
-            # 存储DataFrame到app_state
-            if 'train_data' in result:
-                app_state['train_data'] = result['train_data']
-            if 'test_data' in result:
-                app_state['test_data'] = result['test_data']
+            # 注册DataFrame到数据集注册表
+            _register_datasets(result, source='default')
             
             # 从result中移除DataFrame对象，只返回消息
             response = {
                 'success': result['success'],
-                'message': result['message']
+                'message': result['message'],
+                **_dataset_ids()
             }
         else:
             response = result
@@ -118,21 +292,41 @@ def load_default_data():
 
 @app.route('/api/data/upload', methods=['POST'])
 def upload_data():
-    """Upload custom dataset"""
+    """Upload custom dataset
+    
+    表单字段mode=append时将上传的行追加到当前数据集，默认替换。表单字段columns/filters
+    (JSON)和sample_frac只解析需要的列和行。
+    """
     try:
         files = request.files
-        result = data_service.upload_data(files)
+        try:
+            projection = data_service.normalize_projection({
+                key: json.loads(request.form[key]) if key in ('columns', 'filters') else request.form[key]
+                for key in ('columns', 'filters', 'sample_frac', 'random_state') if request.form.get(key)
+            })
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        result = data_service.upload_data(
+            files,
+            registry=dataset_registry,
+            mode=request.form.get('mode', 'replace'),
+            base_dataset_ids={data_type: app_state[f'{data_type}_dataset_id'] for data_type in ('train', 'test')},
+            pipelines=app_state['pipelines'],
+            projection=projection
+        )
         if result['success']:
-            # 存储DataFrame到app_state
-            if 'train_data' in result:
-                app_state['train_data'] = result['train_data']
-            if 'test_data' in result:
-                app_state['test_data'] = result['test_data']
+            # 注册DataFrame到数据集注册表
+            _register_datasets(result, source='upload')
             
-            # 从result中移除DataFrame对象，只返回消息
+            # 从result中移除DataFrame对象，只返回消息和内存统计
             response = {
                 'success': result['success'],
-                'message': result['message']
+                'message': result['message'],
+                **_dataset_ids(),
+                'memory': {
+                    data_type: result[f'{data_type}_memory']
+                    for data_type in ('train', 'test') if f'{data_type}_memory' in result
+                }
             }
         else:
             response = result
@@ -145,9 +339,13 @@ def upload_data():
 def preview_data():
     """Get data preview and statistics"""
     try:
+        train_dataset_id = _resolve_dataset_id('train', request.args.get('dataset_id'))
+        test_dataset_id = _resolve_dataset_id('test', request.args.get('test_dataset_id'))
         result = data_service.get_data_preview(
-            app_state['train_data'], 
-            app_state['test_data']
+            _get_dataset('train', train_dataset_id),
+            _get_dataset('test', test_dataset_id),
+            train_version=train_dataset_id,
+            test_version=test_dataset_id
         )
         return jsonify(result)
     except Exception as e:
@@ -170,23 +368,48 @@ def preprocess_data():
         
         print(f"接收到预处理参数: {params}")
         
-        result = data_service.preprocess_data(
-            app_state['train_data'], 
-            app_state['test_data'], 
-            params
-        )
+        # 预处理结果是派生数据集，ID由父数据集ID和预处理参数决定，相同的预处理直接复用
+        train_parent_id = params.get('dataset_id') or app_state['train_dataset_id']
+        test_parent_id = params.get('test_dataset_id') or app_state['test_dataset_id']
+        preprocess_params = {k: v for k, v in params.items() if k not in ('dataset_id', 'test_dataset_id')}
+        derived_ids = {}
+        if train_parent_id:
+            derived_ids['train_dataset_id'] = DatasetRegistry.derive_id(train_parent_id, preprocess_params)
+        if test_parent_id:
+            derived_ids['test_dataset_id'] = DatasetRegistry.derive_id(
+                test_parent_id, {'params': preprocess_params, 'fit_on': train_parent_id}
+            )
+        
+        # 流水线缺失(例如在保存流水线之前生成的派生数据集)时重新预处理，保证模型能带上流水线
+        if derived_ids and all(dataset_id in dataset_registry and dataset_id in app_state['pipelines']
+                               for dataset_id in derived_ids.values()):
+            print("预处理结果已存在，直接复用")
+            result = {'success': True, 'message': '数据预处理完成', **derived_ids}
+        else:
+            result = data_service.preprocess_data(
+                _get_dataset('train', train_parent_id),
+                _get_dataset('test', test_parent_id),
+                params,
+                previous_pipeline=app_state['pipelines'].get(train_parent_id)
+            )
+            result.update(derived_ids)
+            if result['success']:
+                pipeline = result['pipeline']
+                for dataset_id in derived_ids.values():
+                    app_state['pipelines'][dataset_id] = pipeline
+                # 注册派生DataFrame到数据集注册表
+                _register_datasets(result, source='preprocess', preprocessing_params=preprocess_params,
+                                   pipeline_id=pipeline.pipeline_id)
         if result['success']:
-            # 存储DataFrame到app_state
-            if 'train_data' in result:
-                app_state['train_data'] = result['train_data']
-            if 'test_data' in result:
-                app_state['test_data'] = result['test_data']
+            for data_type, dataset_id in derived_ids.items():
+                app_state[data_type] = dataset_id
             app_state['preprocessing_params'] = params
             
             # 从result中移除DataFrame对象，只返回消息
             response = {
                 'success': result['success'],
-                'message': result['message']
+                'message': result['message'],
+                **_dataset_ids()
             }
         else:
             response = result
@@ -198,25 +421,39 @@ def preprocess_data():
 
 @app.route('/api/data/download/<data_type>/<file_format>', methods=['GET'])
 def download_data(data_type, file_format):
-    """Download data in specified format"""
+    """Download data in specified format (csv/xlsx/parquet, csv支持?compression=gzip)"""
     try:
-        data = app_state.get(f'{data_type}_data')
+        data = _get_dataset(data_type, request.args.get('dataset_id'))
         if data is None:
             return jsonify({'error': f'No {data_type} data available'}), 404
             
-        result = data_service.convert_data_for_download(data, file_format)
+        result = data_service.stream_data_for_download(
+            data, file_format, compression=request.args.get('compression')
+        )
         if result['success']:
-            return send_file(
-                io.BytesIO(result['data']),
-                as_attachment=True,
-                download_name=f'{data_type}_data.{file_format}',
-                mimetype=result['mimetype']
-            )
+            # 以生成器分块返回，不在内存中拼接完整文件
+            response = Response(result['stream'], mimetype=result['mimetype'])
+            response.headers['Content-Disposition'] = f"attachment; filename={data_type}_data.{result['extension']}"
+            return response
         else:
             return jsonify(result), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/data/datasets', methods=['GET'])
+def list_datasets():
+    """List registered datasets"""
+    try:
+        datasets = dataset_registry.list_datasets()
+        return jsonify({
+            'success': True,
+            'datasets': datasets,
+            'total_count': len(datasets),
+            **_dataset_ids()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 # Machine Learning endpoints
 @app.route('/api/ml/models', methods=['GET'])
 def get_available_models():
@@ -244,7 +481,11 @@ def train_model():
             
         print(f"收到训练请求参数: {params}")
         
-        if app_state['train_data'] is None:
+        dataset_id = params.get('dataset_id') or app_state['train_dataset_id']
+        train_data = _get_dataset('train', dataset_id)
+        if train_data is not None:
+            dataset_id, train_data = _ensure_columns('train', dataset_id, _training_columns(params))
+        if train_data is None:
             print("训练失败: 没有训练数据")
             return jsonify({'success': False, 'message': 'No training data available'}), 400
             
@@ -256,46 +497,19 @@ def train_model():
             print("训练失败: 未指定目标列")
             return jsonify({'success': False, 'message': 'Target columns not specified'}), 400
         
-        print(f"训练数据形状: {app_state['train_data'].shape}")
+        print(f"训练数据形状: {train_data.shape}")
         print(f"选择的模型: {params.get('model_type')}")
         print(f"目标列: {params.get('target_columns')}")
         
+        if params.get('async'):
+            return _submit_training('ml', ml_service.train_model, [_dataset_handle(dataset_id), params],
+                                    dataset_id, params.get('model_type'), '模型')
+        
         result = ml_service.train_model(
-            app_state['train_data'],
+            train_data,
             params
         )
-        
-        if result['success']:
-            model_id = result['model_id']
-            # 存储完整的模型信息到app_state（包含模型对象）
-            app_state['models'][model_id] = result['model']
-            app_state['current_model'] = model_id
-            app_state['training_history'].append({
-                'timestamp': datetime.now().isoformat(),
-                'model_type': params.get('model_type'),
-                'model_id': model_id,
-                'metrics': result.get('metrics', {})
-            })
-            print(f"模型训练成功: {model_id}")
-            
-            # 保存模型到文件系统
-            try:
-                model_file_path = os.path.join(app.config['MODELS_FOLDER'], f'{model_id}.pkl')
-                save_result = ml_service.save_model(result['model'], model_file_path)
-                if save_result['success']:
-                    print(f"模型已保存到: {model_file_path}")
-                else:
-                    print(f"模型保存失败: {save_result['message']}")
-            except Exception as e:
-                print(f"模型保存异常: {str(e)}")
-            
-            # 创建JSON可序列化的响应（移除模型对象）
-            json_result = result.copy()
-            if 'model' in json_result:
-                del json_result['model']  # 移除不可序列化的模型对象
-        else:
-            print(f"模型训练失败: {result.get('message', '未知错误')}")
-            json_result = result
+        json_result = _store_trained_model(result, dataset_id, params.get('model_type'), '模型')
         
         return jsonify(json_result)
     except Exception as e:
@@ -305,6 +519,48 @@ def train_model():
         print(traceback.format_exc())
         return jsonify({'success': False, 'message': error_msg}), 500
 
+@app.route('/api/ml/continue', methods=['POST'])
+def continue_training():
+    """Continue training an existing model as a new model version"""
+    print("======= 收到继续训练请求 =======")
+    try:
+        params = request.get_json()
+        if params is None:
+            return jsonify({'success': False, 'message': 'Invalid JSON data'}), 400
+        print(f"收到继续训练请求参数: {params}")
+        
+        model_id = params.get('model_id') or app_state.get('current_model')
+        if not model_id or model_id not in model_registry:
+            return jsonify({'success': False, 'message': 'No trained model available'}), 400
+        base_model = model_registry.get(model_id)
+        
+        dataset_id = params.get('dataset_id') or app_state['train_dataset_id']
+        train_data = _get_dataset('train', dataset_id)
+        if train_data is None:
+            print("继续训练失败: 没有训练数据")
+            return jsonify({'success': False, 'message': 'No training data available'}), 400
+        dataset_id, train_data = _ensure_columns('train', dataset_id,
+                                                 _model_input_columns(base_model, include_targets=True))
+        params['model_id'] = model_id
+        params['applied_pipeline_id'] = _applied_pipeline_id(dataset_id)
+        model_type = base_model.get('model_type')
+        
+        if params.get('async'):
+            return _submit_training('ml', ml_service.continue_training,
+                                    [base_model, _dataset_handle(dataset_id), params],
+                                    dataset_id, model_type, '继续训练模型')
+        
+        result = ml_service.continue_training(base_model, train_data, params)
+        json_result = _store_trained_model(result, dataset_id, model_type, '继续训练模型')
+        
+        return jsonify(json_result)
+    except Exception as e:
+        import traceback
+        error_msg = str(e)
+        print(f"继续训练异常: {error_msg}")
+        print(traceback.format_exc())
+        return jsonify({'success': False, 'message': error_msg}), 500
+
 @app.route('/api/ml/predict', methods=['POST'])
 def predict():
     """Make predictions with trained model"""
@@ -312,15 +568,20 @@ def predict():
         params = request.get_json()
         model_id = params.get('model_id') or app_state.get('current_model')
         
-        if not model_id or model_id not in app_state['models']:
+        if not model_id or model_id not in model_registry:
             return jsonify({'success': False, 'message': 'No trained model available'}), 400
             
-        test_data = app_state.get('test_data')
+        test_dataset_id = _resolve_dataset_id('test', params.get('dataset_id'))
+        test_data = _get_dataset('test', test_dataset_id)
         if test_data is None:
             return jsonify({'success': False, 'message': 'No test data available'}), 400
+        model_info = model_registry.get(model_id)
+        required_columns = _model_input_columns(model_info)
+        test_dataset_id, test_data = _ensure_columns('test', test_dataset_id, required_columns)
+        params['applied_pipeline_id'] = _applied_pipeline_id(test_dataset_id)
             
         result = ml_service.predict(
-            app_state['models'][model_id],
+            model_info,
             test_data,
             params
         )
@@ -336,12 +597,21 @@ def evaluate_model():
         params = request.get_json()
         model_id = params.get('model_id') or app_state.get('current_model')
         
-        if not model_id or model_id not in app_state['models']:
+        if not model_id or model_id not in model_registry:
             return jsonify({'success': False, 'message': 'No trained model available'}), 400
             
+        test_dataset_id = _resolve_dataset_id('test', params.get('dataset_id'))
+        test_data = _get_dataset('test', test_dataset_id)
+        if test_data is None:
+            return jsonify({'success': False, 'message': 'No test data available'}), 400
+        model_info = model_registry.get(model_id)
+        required_columns = _model_input_columns(model_info, include_targets=True)
+        test_dataset_id, test_data = _ensure_columns('test', test_dataset_id, required_columns)
+        params['applied_pipeline_id'] = _applied_pipeline_id(test_dataset_id)
+            
         result = ml_service.evaluate_model(
-            app_state['models'][model_id],
-            app_state['test_data'],
+            model_info,
+            test_data,
             params
         )
         
@@ -362,46 +632,24 @@ def train_stacking():
         params = request.get_json()
         print(f"收到Stacking训练请求参数: {params}")
         
-        if app_state['train_data'] is None:
+        dataset_id = params.get('dataset_id') or app_state['train_dataset_id']
+        train_data = _get_dataset('train', dataset_id)
+        if train_data is not None:
+            dataset_id, train_data = _ensure_columns('train', dataset_id, _training_columns(params))
+        if train_data is None:
             print("Stacking训练失败: 没有训练数据")
             return jsonify({'success': False, 'message': 'No training data available'}), 400
             
+        if params.get('async'):
+            return _submit_training('stacking', stacking_service.train_stacking_ensemble,
+                                    [_dataset_handle(dataset_id), params],
+                                    dataset_id, 'StackingEnsemble', 'Stacking模型')
+        
         result = stacking_service.train_stacking_ensemble(
-            app_state['train_data'],
+            train_data,
             params
         )
-        
-        if result['success']:
-            model_id = result['model_id']
-            # 存储完整的模型信息到app_state（包含模型对象）
-            app_state['models'][model_id] = result['model']
-            app_state['current_model'] = model_id
-            app_state['training_history'].append({
-                'timestamp': datetime.now().isoformat(),
-                'model_type': 'StackingEnsemble',
-                'model_id': model_id,
-                'metrics': result.get('metrics', {})
-            })
-            print(f"Stacking模型训练成功: {model_id}")
-            
-            # 保存模型到文件系统
-            try:
-                model_file_path = os.path.join(app.config['MODELS_FOLDER'], f'{model_id}.pkl')
-                save_result = ml_service.save_model(result['model'], model_file_path)
-                if save_result['success']:
-                    print(f"Stacking模型已保存到: {model_file_path}")
-                else:
-                    print(f"Stacking模型保存失败: {save_result['message']}")
-            except Exception as e:
-                print(f"Stacking模型保存异常: {str(e)}")
-            
-            # 创建JSON可序列化的响应（移除模型对象）
-            json_result = result.copy()
-            if 'model' in json_result:
-                del json_result['model']  # 移除不可序列化的模型对象
-        else:
-            print(f"Stacking模型训练失败: {result.get('message', '未知错误')}")
-            json_result = result
+        json_result = _store_trained_model(result, dataset_id, 'StackingEnsemble', 'Stacking模型')
         
         return jsonify(json_result)
     except Exception as e:
@@ -424,49 +672,28 @@ def run_automl():
             
         print(f"收到AutoML请求参数: {params}")
         
-        if app_state['train_data'] is None:
+        dataset_id = params.get('dataset_id') or app_state['train_dataset_id']
+        train_data = _get_dataset('train', dataset_id)
+        if train_data is not None:
+            dataset_id, train_data = _ensure_columns('train', dataset_id, _training_columns(params))
+        if train_data is None:
             print("AutoML失败: 没有训练数据")
             return jsonify({'success': False, 'message': 'No training data available'}), 400
             
-        print(f"AutoML训练数据形状: {app_state['train_data'].shape}")
+        print(f"AutoML训练数据形状: {train_data.shape}")
+        
+        if params.get('async'):
+            test_dataset_id = _resolve_dataset_id('test', params.get('test_dataset_id'))
+            return _submit_training('automl', automl_service.run_automl,
+                                    [_dataset_handle(dataset_id), _dataset_handle(test_dataset_id), params],
+                                    dataset_id, 'AutoML', 'AutoML模型', metrics_key='results')
         
         result = automl_service.run_automl(
-            app_state['train_data'],
-            app_state.get('test_data'),
+            train_data,
+            _get_dataset('test', params.get('test_dataset_id')),
             params
         )
-        
-        if result['success']:
-            model_id = result['model_id']
-            # 存储完整的模型信息到app_state（包含模型对象）
-            app_state['models'][model_id] = result['model']
-            app_state['current_model'] = model_id
-            app_state['training_history'].append({
-                'timestamp': datetime.now().isoformat(),
-                'model_type': 'AutoML',
-                'model_id': model_id,
-                'metrics': result.get('results', {})
-            })
-            print(f"AutoML训练成功: {model_id}")
-            
-            # 保存模型到文件系统
-            try:
-                model_file_path = os.path.join(app.config['MODELS_FOLDER'], f'{model_id}.pkl')
-                save_result = ml_service.save_model(result['model'], model_file_path)
-                if save_result['success']:
-                    print(f"AutoML模型已保存到: {model_file_path}")
-                else:
-                    print(f"AutoML模型保存失败: {save_result['message']}")
-            except Exception as e:
-                print(f"AutoML模型保存异常: {str(e)}")
-            
-            # 创建JSON可序列化的响应（移除模型对象）
-            json_result = result.copy()
-            if 'model' in json_result:
-                del json_result['model']  # 移除不可序列化的模型对象
-        else:
-            print(f"AutoML训练失败: {result.get('message', '未知错误')}")
-            json_result = result
+        json_result = _store_trained_model(result, dataset_id, 'AutoML', 'AutoML模型', metrics_key='results')
         
         return jsonify(json_result)
     except Exception as e:
@@ -482,7 +709,7 @@ def generate_data_visualization():
     """Generate data visualization"""
     try:
         params = request.get_json()
-        data = app_state.get(f"{params.get('data_type', 'train')}_data")
+        data = _get_dataset(params.get('data_type', 'train'), params.get('dataset_id'))
         
         if data is None:
             return jsonify({'success': False, 'message': 'No data available'}), 400
@@ -499,12 +726,12 @@ def generate_model_visualization():
         params = request.get_json()
         model_id = params.get('model_id') or app_state.get('current_model')
         
-        if not model_id or model_id not in app_state['models']:
+        if not model_id or model_id not in model_registry:
             return jsonify({'success': False, 'message': 'No trained model available'}), 400
             
         result = viz_service.generate_model_visualization(
-            app_state['models'][model_id],
-            app_state['train_data'],
+            model_registry.get(model_id),
+            _get_dataset('train', params.get('dataset_id')),
             params
         )
         return jsonify(result)
@@ -527,20 +754,24 @@ def generate_report():
         if selected_models and len(selected_models) > 0:
             # 使用第一个选择的模型
             model_id = selected_models[0]
-            model_info = app_state['models'].get(model_id)
+            model_info = model_registry.get(model_id)
         elif app_state.get('current_model'):
             # 使用当前模型
             model_id = app_state.get('current_model')
-            model_info = app_state['models'].get(model_id)
+            model_info = model_registry.get(model_id)
         
         print(f"使用模型: {model_id}")
         
+        train_dataset_id = _resolve_dataset_id('train', params.get('dataset_id'))
+        test_dataset_id = _resolve_dataset_id('test', params.get('test_dataset_id'))
         result = report_service.generate_report(
-            app_state['train_data'],
-            app_state['test_data'],
+            _get_dataset('train', train_dataset_id),
+            _get_dataset('test', test_dataset_id),
             model_info,
             app_state['training_history'],
-            params
+            params,
+            train_version=train_dataset_id,
+            test_version=test_dataset_id
         )
         
         return jsonify(result)
@@ -636,6 +867,16 @@ def options_ml_train():
     response.headers.add('Access-Control-Max-Age', '3600')
     return response
 
+# 特别处理继续训练OPTIONS请求
+@app.route('/api/ml/continue', methods=['OPTIONS'])
+def options_ml_continue():
+    response = app.make_default_options_response()
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization, Accept')
+    response.headers.add('Access-Control-Allow-Methods', 'POST, OPTIONS')
+    response.headers.add('Access-Control-Max-Age', '3600')
+    return response
+
 # 特别处理模型预测OPTIONS请求
 @app.route('/api/ml/predict', methods=['OPTIONS'])
 def options_ml_predict():
@@ -681,15 +922,17 @@ def options_automl_run():
 def get_models_list():
     """Get list of trained models"""
     try:
+        # 由注册表索引生成，不加载模型
         models_list = []
-        for model_id, model_info in app_state['models'].items():
+        for entry in model_registry.list_models():
             models_list.append({
-                'id': model_id,
-                'name': model_info.get('model_name', 'Unknown Model'),
-                'type': model_info.get('model_type', 'Unknown'),
-                'training_time': model_info.get('training_time', ''),
-                'feature_count': len(model_info.get('feature_columns', [])),
-                'target_count': len(model_info.get('target_columns', []))
+                'id': entry['model_id'],
+                'name': entry.get('model_name') or 'Unknown Model',
+                'type': entry.get('model_type') or 'Unknown',
+                'training_time': entry.get('training_time') or '',
+                'feature_count': len(entry.get('feature_columns') or []),
+                'target_count': len(entry.get('target_columns') or []),
+                'in_memory': entry['in_memory']
             })
         
         return jsonify({
@@ -704,15 +947,15 @@ def get_models_list():
 def download_model(model_id):
     """Download trained model file"""
     try:
-        if model_id not in app_state['models']:
+        if model_id not in model_registry:
             return jsonify({'error': 'Model not found'}), 404
             
-        model_file_path = os.path.join(app.config['MODELS_FOLDER'], f'{model_id}.pkl')
+        model_file_path = model_registry.model_path(model_id)
         if not os.path.exists(model_file_path):
             return jsonify({'error': 'Model file not found'}), 404
             
-        model_info = app_state['models'][model_id]
-        filename = f"{model_info.get('model_name', 'model')}_{model_id[:8]}.pkl"
+        model_info = model_registry.info(model_id)
+        filename = f"{model_info.get('model_name') or 'model'}_{model_id[:8]}.pkl"
         
         return send_file(
             model_file_path,
@@ -723,6 +966,60 @@ def download_model(model_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Job endpoints
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """List asynchronous training jobs"""
+    return jsonify({'success': True, 'jobs': job_manager.list_jobs()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get asynchronous training job status and result"""
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'message': f'任务不存在: {job_id}'}), 404
+    return jsonify({'success': True, 'job': status})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Stream training progress events of a job as Server-Sent Events
+    
+    每个事件的id为事件编号，断线重连时根据Last-Event-ID从下一条事件继续推送，任务结束后关闭连接。
+    """
+    if job_manager.status(job_id) is None:
+        return jsonify({'success': False, 'message': f'任务不存在: {job_id}'}), 404
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('since'))
+    since = int(last_event_id) + 1 if last_event_id not in (None, '') else 0
+    
+    def generate(since):
+        while True:
+            events, finished = job_manager.wait_events(job_id, since)
+            if events is None:
+                return
+            for event_id, event in events:
+                yield f"id: {event_id}\nevent: progress\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+                since = event_id + 1
+            if finished and not events:
+                yield f"event: end\ndata: {json.dumps(job_manager.status(job_id), ensure_ascii=False, default=str)}\n\n"
+                return
+            if not events:
+                # 保持连接，避免代理因空闲超时断开
+                yield ": keep-alive\n\n"
+    
+    response = Response(generate(since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running training job"""
+    if job_manager.status(job_id) is None:
+        return jsonify({'success': False, 'message': f'任务不存在: {job_id}'}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({'success': False, 'message': '任务已结束，无法取消'}), 409
+    return jsonify({'success': True, 'message': '任务已取消'})
+
 # Reports list endpoint
 @app.route('/api/reports/list', methods=['GET'])
 def get_reports_list():
@@ -1,19 +1,49 @@
 import pandas as pd
 import numpy as np
+import time
 import uuid
+from functools import partial
 from datetime import datetime
-from sklearn.model_selection import GridSearchCV, RandomizedSearchCV
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.svm import SVR
 from sklearn.neural_network import MLPRegressor
-from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import xgboost as xgb
+from .shared_features import SharedFeatureStore, feature_dtype
+from .estimators import ApproximateSVR, large_data_model
+from .executor import core_budget, limit_n_jobs
+from .folds import FoldEngine
+from .scheduler import FitScheduler
+from .halving import SEARCH_SPACES, SuccessiveHalvingSearch
+from .tpe import TPE_SPACES, TPESearchCV
+from .progress import ProgressReporter
+from .fit_cache import FitCache
+from .sampling import sampler
 import warnings
 warnings.filterwarnings('ignore')
 
+
+def root_mean_squared_error(y_true, y_pred):
+    """RMSE(sklearn 1.4之前没有root_mean_squared_error)，定义为模块级函数以便传给工作进程"""
+    return np.sqrt(mean_squared_error(y_true, y_pred))
+
+
 class AutoMLService:
-    def __init__(self):
+    # 由折外预测计算的评分: scoring -> (指标函数, 是否越大越好)
+    FOLD_METRICS = {
+        'neg_mean_squared_error': (mean_squared_error, False),
+        'neg_root_mean_squared_error': (root_mean_squared_error, False),
+        'rmse': (root_mean_squared_error, False),
+        'neg_mean_absolute_error': (mean_absolute_error, False),
+        'r2': (r2_score, True)
+    }
+    
+    def __init__(self, fit_cache=None):
+        # 拟合结果缓存，与机器学习、Stacking服务共用
+        self.fit_cache = fit_cache or FitCache()
+        
         # 快速模式配置（参数较少）
         self.fast_models_config = {
             'LinearRegression': {
@@ -36,6 +66,13 @@ class AutoMLService:
                     'learning_rate': [0.1]
                 }
             },
+            'HistGradientBoosting': {
+                'model': HistGradientBoostingRegressor,
+                'params': {
+                    'max_iter': [100],
+                    'learning_rate': [0.1]
+                }
+            },
             'XGBoost': {
                 'model': xgb.XGBRegressor,
                 'params': {
@@ -53,6 +90,13 @@ class AutoMLService:
                     'kernel': ['rbf']
                 }
             },
+            'ApproximateSVR': {
+                'model': ApproximateSVR,
+                'params': {
+                    'C': [1],
+                    'gamma': ['scale']
+                }
+            },
             'MLP': {
                 'model': MLPRegressor,
                 'params': {
@@ -88,6 +132,14 @@ class AutoMLService:
                     'max_depth': [3, 5]
                 }
             },
+            'HistGradientBoosting': {
+                'model': HistGradientBoostingRegressor,
+                'params': {
+                    'max_iter': [100, 300],
+                    'learning_rate': [0.05, 0.1],
+                    'max_leaf_nodes': [31, 63]
+                }
+            },
             'XGBoost': {
                 'model': xgb.XGBRegressor,
                 'params': {
@@ -105,6 +157,14 @@ class AutoMLService:
                     'kernel': ['rbf']
                 }
             },
+            'ApproximateSVR': {
+                'model': ApproximateSVR,
+                'params': {
+                    'C': [1, 10],
+                    'gamma': ['scale'],
+                    'n_components': [300, 1000]
+                }
+            },
             'MLP': {
                 'model': MLPRegressor,
                 'params': {
@@ -135,12 +195,13 @@ class AutoMLService:
                         'n_jobs': [-1]
                     }
                 },
-                'GradientBoosting': {
-                    'model': GradientBoostingRegressor,
+                # 精确分裂的GBR由直方图梯度提升代替，不再限制树数，由自身的提前停止决定
+                'HistGradientBoosting': {
+                    'model': HistGradientBoostingRegressor,
                     'params': {
-                        'n_estimators': [30],
-                        'learning_rate': [0.15],
-                        'max_depth': [4]
+                        'max_iter': [500],
+                        'learning_rate': [0.1],
+                        'early_stopping': [True]
                     }
                 },
                 'XGBoost': {
@@ -153,13 +214,13 @@ class AutoMLService:
                         'tree_method': ['hist']
                     }
                 },
-                'SVR': {
-                    'model': SVR,
+                # SVR由近似核SVR代替，训练时间与行数成线性关系
+                'ApproximateSVR': {
+                    'model': ApproximateSVR,
                     'params': {
                         'C': [1],
                         'gamma': ['scale'],
-                        'kernel': ['rbf'],
-                        'cache_size': [1000]
+                        'n_components': [500]
                     }
                 },
                 'MLP': {
@@ -199,6 +260,14 @@ class AutoMLService:
                         'max_depth': [5]
                     }
                 },
+                'HistGradientBoosting': {
+                    'model': HistGradientBoostingRegressor,
+                    'params': {
+                        'max_iter': [300],
+                        'learning_rate': [0.1],
+                        'early_stopping': [True]
+                    }
+                },
                 'XGBoost': {
                     'model': xgb.XGBRegressor,
                     'params': {
@@ -209,12 +278,12 @@ class AutoMLService:
                         'tree_method': ['hist']
                     }
                 },
-                'SVR': {
-                    'model': SVR,
+                'ApproximateSVR': {
+                    'model': ApproximateSVR,
                     'params': {
                         'C': [1],
                         'gamma': ['scale'],
-                        'kernel': ['rbf']
+                        'n_components': [500]
                     }
                 },
                 'MLP': {
@@ -231,12 +300,21 @@ class AutoMLService:
             # 小数据集：使用快速配置
             return self.fast_models_config
     
-    def run_automl(self, train_data, test_data, params):
-        """Run automated machine learning"""
+    def run_automl(self, train_data, test_data, params, reporter=None):
+        """Run automated machine learning
+        
+        训练特征在开始时转换一次并写入内存映射文件，所有目标列、所有候选模型的搜索共享该只读视图。
+        各 目标列 x 候选模型 的搜索由FitScheduler调度，所有拟合从便宜到昂贵在同一个进程池中执行，
+        params['time_budget'](秒)为整个AutoML的截止时间。
+        reporter为ProgressReporter，用于发送结构化的进度事件。
+        """
+        reporter = reporter or ProgressReporter()
+        store = SharedFeatureStore()
         try:
             # Prepare data
             target_columns = params.get('target_columns', train_data.columns[-3:].tolist())
-            feature_columns = [col for col in train_data.columns if col not in target_columns]
+            # 未指定特征列时使用目标列以外的所有列
+            feature_columns = params.get('feature_columns') or [col for col in train_data.columns if col not in target_columns]
             
             X_train = train_data[feature_columns]
             y_train = train_data[target_columns]
@@ -246,167 +324,161 @@ class AutoMLService:
             print(f"AutoML训练数据大小: {data_size}")
             
             # AutoML configuration
-            search_method = params.get('search_method', 'grid')  # 'grid' or 'random'
+            search_method = params.get('search_method', 'grid')  # 'grid', 'random', 'halving' or 'tpe'
             cv_folds = params.get('cv_folds', 5)
             scoring = params.get('scoring', 'neg_mean_squared_error')
+            if scoring not in self.FOLD_METRICS:
+                raise ValueError(f"不支持的评分方式: {scoring}，可选: {list(self.FOLD_METRICS)}")
             training_mode = params.get('training_mode', 'fast')  # 'fast' or 'thorough'
-            max_iter = params.get('max_iter', 50)  # for RandomizedSearchCV
+            max_iter = params.get('max_iter', 50)  # 随机搜索的候选参数组数上限
+            time_budget = float(params.get('time_budget') or 0)  # 整个AutoML的时间预算(秒)，0为不限
             
-            # 根据数据大小动态调整参数
-            if data_size > 15000:
-                cv_folds = min(cv_folds, 3)
-                max_iter = min(max_iter, 20)
-                training_mode = 'fast'
-                print(f"大数据集检测，优化参数: CV折数={cv_folds}, 最大迭代={max_iter}")
-            
-            if training_mode == 'fast' or data_size > 10000:
-                models_config = self._get_optimized_automl_config(data_size)
-                print(f"使用优化快速模式训练")
-            else:
+            if search_method in ('halving', 'tpe'):
+                # 逐次减半/TPE按预算搜索，不再按数据量缩小参数网格或采样
+                budget = {
+                    'max_fits': int(params.get('max_fits', 100)),  # 逐次减半: 每个 目标列 x 模型 的拟合次数预算
+                    'factor': int(params.get('halving_factor', 3)),
+                    'n_trials': int(params.get('n_trials', 30))  # TPE: 每个 目标列 x 模型 的试验次数上限
+                }
                 models_config = self.models_config
-                print(f"使用完整模式训练")
+                print(f"使用{search_method}搜索，预算: {budget}")
+            else:
+                budget = None
+                # 根据数据大小动态调整参数
+                if data_size > 15000:
+                    cv_folds = min(cv_folds, 3)
+                    max_iter = min(max_iter, 20)
+                    training_mode = 'fast'
+                    print(f"大数据集检测，优化参数: CV折数={cv_folds}, 最大迭代={max_iter}")
+                
+                if training_mode == 'fast' or data_size > 10000:
+                    models_config = self._get_optimized_automl_config(data_size)
+                    print(f"使用优化快速模式训练")
+                else:
+                    models_config = self.models_config
+                    print(f"使用完整模式训练")
                 
             models_to_try = params.get('models', list(models_config.keys()))
+            # 大数据集上GBR改用直方图梯度提升，SVR改用近似核SVR
+            models_to_try = [large_data_model(name, data_size) for name in models_to_try]
             
             # 去重并排序，确保没有重复训练
             models_to_try = list(set(models_to_try))
             models_to_try.sort()  # 保持一致的训练顺序
             
-            print(f"将要训练的模型: {models_to_try}")
+            # 每个目标列上的每个候选模型算一步
+            candidate_models = [name for name in models_to_try if name in models_config]
+            reporter.set_total(len(target_columns) * len(candidate_models))
+            reporter.emit('start', f"将要训练的模型: {models_to_try}", n_targets=len(target_columns))
+            
+            # 所有搜索共享同一个连续的只读特征矩阵，测试特征也只转换一次
+            dtype = feature_dtype(*[models_config[name]['model'] for name in models_to_try if name in models_config])
+            X_train = store.share(X_train, dtype, 'X_train')
+            X_test = test_data[feature_columns].to_numpy(dtype=dtype) if test_data is not None else None
             
             results = {}
             best_models = {}
             
-            for target_col in target_columns:
+            # 每个 目标列 x 候选模型 的搜索加入同一个调度器，所有 候选参数 x 折 的拟合按成本从低到高
+            # 在一个进程池中执行，每个搜索完成后立即在全部训练数据上拟合最优参数
+            metric, greater_is_better = self.FOLD_METRICS[scoring]
+            deadline = time.time() + time_budget if time_budget > 0 else None
+            scheduler = FitScheduler(deadline=deadline, store=store)
+            model_results = {}
+            sampled_targets = {}  # 在分层样本上搜索的目标列 -> (全部训练目标值, 测试目标值, 样本行数)
+            
+            def on_model_done(target_col, model_name, model_result):
+                model_results[(target_col, model_name)] = model_result
+                target_index = target_columns.index(target_col) + 1
+                # 目标列当前的排行榜，便宜的模型先完成，排行榜随训练逐步补全
+                leaderboard = sorted(
+                    [{'model': name, 'cv_score': result['cv_score']}
+                     for (target, name), result in model_results.items() if target == target_col and 'error' not in result],
+                    key=lambda entry: entry['cv_score']
+                )
+                if 'error' in model_result:
+                    reporter.emit('model_done', f"  {model_name}: 训练失败 - {model_result['error']}", advance=True,
+                                  model=model_name, target=target_col, target_index=target_index,
+                                  n_targets=len(target_columns), error=model_result['error'], leaderboard=leaderboard)
+                else:
+                    reporter.emit('model_done', f"  {model_name}: CV Score = {model_result['cv_score']:.4f}", advance=True,
+                                  model=model_name, target=target_col, target_index=target_index,
+                                  n_targets=len(target_columns), score=model_result['cv_score'], leaderboard=leaderboard)
+            
+            for target_index, target_col in enumerate(target_columns, start=1):
                 y_target = y_train[target_col] if len(target_columns) > 1 else y_train.iloc[:, 0]
-                target_results = {}
-                best_score = float('-inf')
-                best_model_info = None
+                y_test_target = test_data[target_col] if test_data is not None and target_col in test_data.columns else None
                 
-                print(f"正在为目标 {target_col} 运行AutoML...")
+                reporter.emit('target', f"正在为目标 {target_col} 运行AutoML...",
+                              target=target_col, target_index=target_index, n_targets=len(target_columns))
                 
-                # 对大数据集进行采样以加速训练
-                if data_size > 15000:
-                    # 使用采样数据进行超参数搜索
-                    sample_size = min(10000, data_size // 2)
-                    sample_indices = np.random.choice(len(X_train), sample_size, replace=False)
-                    X_sample = X_train.iloc[sample_indices]
+                # 对大数据集按目标值分层采样以加速搜索(逐次减半/TPE搜索自行按行数分配资源，不采样)，
+                # 最优模型最后在全部训练数据上再拟合一次
+                sample_size = data_size
+                if budget is None and data_size > 15000:
+                    sample_size = self._search_sample_size(models_config, candidate_models, search_method, max_iter,
+                                                           cv_folds, X_train, y_target,
+                                                           time_budget / len(target_columns))
+                if sample_size < data_size:
+                    # 分层抽样索引按数据内容缓存，相同设置再次运行时可以命中拟合缓存
+                    sample_indices = sampler.indices(y_target, sample_size)
+                    X_sample = store.share(X_train[sample_indices], dtype, 'X_sample')
                     y_sample = y_target.iloc[sample_indices]
-                    print(f"  大数据集采样训练: 使用{sample_size}样本进行超参数搜索")
+                    sampled_targets[target_col] = (y_target, y_test_target, sample_size)
+                    print(f"  大数据集分层采样: 使用{sample_size}样本进行超参数搜索")
                 else:
                     X_sample = X_train
                     y_sample = y_target
+                y_values = np.asarray(y_sample, dtype=np.float64)
+                cache_context = {'feature_columns': feature_columns, 'target_columns': [target_col]}
                 
-                for model_name in models_to_try:
-                    if model_name not in models_config:
-                        continue
+                for model_name in candidate_models:
+                    # 有截止时间时搜索结果取决于其他模型占用的时间，不缓存
+                    search_key = None
+                    if deadline is None:
+                        search_key = self.fit_cache.key('automl_search', search_method, model_name, models_config[model_name],
+                                                        budget, max_iter, cv_folds, scoring, X_sample, y_values,
+                                                        cache_context)
+                    on_search_done = partial(
+                        self._on_search_done, scheduler, model_name, models_config[model_name]['model'], cv_folds,
+                        X_sample, y_sample, X_test, y_test_target, y_values, cache_context,
+                        partial(on_model_done, target_col, model_name)
+                    )
+                    outcome = self.fit_cache.get(search_key) if search_key is not None else None
+                    if outcome is not None:
+                        on_search_done(outcome, None)
+                    else:
+                        steps = self._search_steps(models_config[model_name], model_name, search_method, X_sample,
+                                                   y_values, cv_folds, metric, greater_is_better, max_iter, budget, deadline)
+                        scheduler.add_search(steps, partial(self._cache_outcome, search_key, on_search_done))
+            
+            scheduler.run()
+            
+            # 在样本上搜索的目标列: 只把最优模型在全部训练数据上再拟合一次
+            for target_col, (y_target, y_test_target, sample_size) in sampled_targets.items():
+                scored = [(model_results[(target_col, name)]['cv_score'], name) for name in candidate_models
+                          if 'error' not in model_results[(target_col, name)]]
+                if scored:
+                    self._refit_winner(scheduler, model_results, target_col, min(scored)[1], models_config, X_train,
+                                       y_target, X_test, y_test_target, sample_size, feature_columns, reporter)
+            scheduler.run()
+            
+            for target_col in target_columns:
+                target_results = {}
+                best_score = float('-inf')
+                best_model_info = None
+                for model_name in candidate_models:
+                    model_result = model_results[(target_col, model_name)]
+                    target_results[model_name] = model_result
                     
-                    try:
-                        model_config = models_config[model_name]
-                        base_model = model_config['model']()
-                        param_grid = model_config['params']
-                        
-                        # 动态调整并行度
-                        n_jobs_setting = 1 if data_size > 15000 else -1
-                        
-                        # Choose search method
-                        if search_method == 'random':
-                            search = RandomizedSearchCV(
-                                base_model,
-                                param_grid,
-                                n_iter=min(max_iter, 15),  # 进一步限制迭代次数
-                                cv=cv_folds,
-                                scoring=scoring,
-                                n_jobs=n_jobs_setting,
-                                random_state=42,
-                                verbose=0
-                            )
-                        else:
-                            search = GridSearchCV(
-                                base_model,
-                                param_grid,
-                                cv=cv_folds,
-                                scoring=scoring,
-                                n_jobs=n_jobs_setting,
-                                verbose=0
-                            )
-                        
-                        # Fit the search on sample data
-                        search.fit(X_sample, y_sample)
-                        
-                        # Get best results
-                        best_estimator = search.best_estimator_
-                        best_params = search.best_params_
-                        best_cv_score = search.best_score_
-                        
-                        # 如果使用了采样，在全数据上重新训练最佳模型
-                        if data_size > 15000 and len(X_sample) < len(X_train):
-                            print(f"    在全数据上重新训练{model_name}...")
-                            # 创建新的模型实例并用最佳参数训练
-                            final_model = model_config['model'](**best_params)
-                            final_model.fit(X_train, y_target)
-                            best_estimator = final_model
-                        
-                        # Make predictions for evaluation - 对大数据集采样评估
-                        if data_size > 20000:
-                            # 使用采样数据评估性能，避免内存问题
-                            eval_size = min(5000, data_size // 4)
-                            eval_indices = np.random.choice(len(X_train), eval_size, replace=False)
-                            X_eval = X_train.iloc[eval_indices]
-                            y_eval = y_target.iloc[eval_indices]
-                            y_train_pred = best_estimator.predict(X_eval)
-                            train_r2 = r2_score(y_eval, y_train_pred)
-                            train_mse = mean_squared_error(y_eval, y_train_pred)
-                            print(f"    使用{eval_size}样本评估性能")
-                        else:
-                            y_train_pred = best_estimator.predict(X_train)
-                            train_r2 = r2_score(y_target, y_train_pred)
-                            train_mse = mean_squared_error(y_target, y_train_pred)
-                        
-                        model_result = {
+                    # Track best model
+                    if 'error' not in model_result and -model_result['cv_score'] > best_score:
+                        best_score = -model_result['cv_score']
+                        best_model_info = {
                             'model_name': model_name,
-                            'best_params': best_params,
-                            'cv_score': float(-best_cv_score),  # Convert back to positive
-                            'train_r2': float(train_r2),
-                            'train_mse': float(train_mse),
-                            'train_rmse': float(np.sqrt(train_mse)),
-                            'model': best_estimator
-                        }
-                        
-                        # Test evaluation if test data is available
-                        if test_data is not None:
-                            X_test = test_data[feature_columns]
-                            if target_col in test_data.columns:
-                                y_test_target = test_data[target_col]
-                                y_test_pred = best_estimator.predict(X_test)
-                                test_r2 = r2_score(y_test_target, y_test_pred)
-                                test_mse = mean_squared_error(y_test_target, y_test_pred)
-                                
-                                model_result.update({
-                                    'test_r2': float(test_r2),
-                                    'test_mse': float(test_mse),
-                                    'test_rmse': float(np.sqrt(test_mse))
-                                })
-                        
-                        target_results[model_name] = model_result
-                        
-                        # Track best model
-                        if best_cv_score > best_score:
-                            best_score = best_cv_score
-                            best_model_info = {
-                                'model_name': model_name,
-                                'model': best_estimator,
-                                'params': best_params,
-                                'score': best_cv_score
-                            }
-                        
-                        print(f"  {model_name}: CV Score = {-best_cv_score:.4f}")
-                        
-                    except Exception as e:
-                        print(f"  {model_name}: 训练失败 - {str(e)}")
-                        target_results[model_name] = {
-                            'error': str(e),
-                            'status': 'failed'
+                            'model': model_result['model'],
+                            'params': model_result['best_params'],
+                            'score': best_score
                         }
                 
                 results[target_col] = {
@@ -419,6 +491,7 @@ class AutoMLService:
             
             # Generate model ID
             model_id = str(uuid.uuid4())
+            reporter.emit('done', f"AutoML模型{model_id}训练完成")
             
             # Prepare final model info (包含模型对象，用于app_state存储)
             final_model_info_storage = {
@@ -429,7 +502,10 @@ class AutoMLService:
                 'target_columns': target_columns,
                 'automl_config': {
                     'search_method': search_method,
+                    'budget': budget,
+                    'time_budget': time_budget or None,
                     'cv_folds': cv_folds,
+                    'search_sample_targets': list(sampled_targets),
                     'models_tried': models_to_try,
                     'scoring': scoring
                 },
@@ -446,7 +522,10 @@ class AutoMLService:
                 'target_columns': target_columns,
                 'automl_config': {
                     'search_method': search_method,
+                    'budget': budget,
+                    'time_budget': time_budget or None,
                     'cv_folds': cv_folds,
+                    'search_sample_targets': list(sampled_targets),
                     'models_tried': models_to_try,
                     'scoring': scoring
                 },
@@ -499,6 +578,173 @@ class AutoMLService:
             
         except Exception as e:
             return {'success': False, 'message': f'AutoML运行失败: {str(e)}'}
+        finally:
+            store.close()
+    
+    def _search_steps(self, model_config, model_name, search_method, X, y, cv_folds, metric, greater_is_better,
+                      max_iter, budget, deadline):
+        """返回一个 目标列 x 候选模型 的搜索步骤生成器(协议见folds.run_steps)"""
+        if search_method == 'halving':
+            search = SuccessiveHalvingSearch(
+                model_config['model'],
+                SEARCH_SPACES[model_name],
+                cv_folds=cv_folds,
+                factor=budget['factor'],
+                max_fits=budget['max_fits'],
+                deadline=deadline,
+                metric=metric,
+                greater_is_better=greater_is_better
+            )
+            return search.steps(X, y)
+        if search_method == 'tpe':
+            search = TPESearchCV(
+                model_config['model'](),
+                TPE_SPACES[model_name],
+                n_trials=budget['n_trials'],
+                time_budget=max(deadline - time.time(), 0) if deadline is not None else None,
+                cv=cv_folds,
+                metric=metric,
+                greater_is_better=greater_is_better,
+                refit=False
+            )
+            # 每批试验数使 试验数 x 折数 大致填满可用核心
+            return search.steps(X, y, batch_size=max(1, int(np.ceil(core_budget.total / cv_folds))))
+        
+        candidates = self._grid_candidates(model_config, search_method, max_iter)
+        return self._candidate_steps(model_config['model'], candidates, X, y, cv_folds, metric, greater_is_better)
+    
+    def _grid_candidates(self, model_config, search_method, max_iter):
+        """网格/随机搜索的候选参数列表"""
+        # Choose search method
+        if search_method == 'random':
+            return list(ParameterSampler(model_config['params'], n_iter=min(max_iter, 15), random_state=42))  # 进一步限制迭代次数
+        return list(ParameterGrid(model_config['params']))
+    
+    def _candidate_steps(self, model_class, candidates, X, y, cv_folds, metric, greater_is_better):
+        """网格/随机搜索的步骤生成器: 所有候选参数一步提交，每组参数得到一份折外预测"""
+        engine = FoldEngine(n_splits=cv_folds)
+        oof_predictions = yield engine, [model_class(**candidate) for candidate in candidates], X, y
+        evaluated = [(params, oof, engine.fold_scores(y, oof, metric))
+                     for params, oof in zip(candidates, oof_predictions) if oof is not None]
+        if not evaluated:
+            raise ValueError('没有完成评估的候选参数')
+        # 与sklearn的scoring一致: 分数越大越好
+        mean_scores = [scores.mean() if greater_is_better else -scores.mean() for _, _, scores in evaluated]
+        best_index = int(np.argmax(mean_scores))
+        best_params, best_oof, best_fold_scores = evaluated[best_index]
+        return {
+            'best_params': best_params,
+            'best_score': float(mean_scores[best_index]),
+            'fold_scores': best_fold_scores,
+            'oof': best_oof
+        }
+    
+    def _cache_outcome(self, search_key, on_search_done, outcome, error):
+        """搜索成功结束时写入拟合缓存，再交给on_search_done"""
+        if error is None and search_key is not None:
+            self.fit_cache.put(search_key, outcome)
+        on_search_done(outcome, error)
+    
+    def _search_sample_size(self, models_config, candidate_models, search_method, max_iter, cv_folds, X_train,
+                            y_target, time_budget):
+        """网格/随机搜索使用的分层样本行数
+        
+        不限时间时沿用固定上限min(10000, 行数/2)。有时间预算时，把每个目标列预算的一半留给搜索，
+        按各候选模型第一组参数的试拟合耗时外推，取能在预算内完成 候选参数 x 折 全部拟合的最大行数。
+        """
+        data_size = len(X_train)
+        if time_budget <= 0:
+            return min(10000, data_size // 2)
+        
+        estimators = []
+        for model_name in candidate_models:
+            candidates = self._grid_candidates(models_config[model_name], search_method, max_iter)
+            estimator = limit_n_jobs(models_config[model_name]['model'](**candidates[0]), 1)
+            estimators.append((estimator, len(candidates) * cv_folds))
+        return sampler.size_for_budget(estimators, X_train, y_target, time_budget * 0.5, n_workers=core_budget.total,
+                                       min_size=min(1000, data_size))
+    
+    def _refit_winner(self, scheduler, model_results, target_col, model_name, models_config, X_train, y_target,
+                      X_test, y_test_target, search_rows, feature_columns, reporter):
+        """把目标列在样本上选出的最优模型在全部训练数据上再拟合，完成后替换其模型和训练/测试指标"""
+        model_result = model_results[(target_col, model_name)]
+        model_result['search_rows'] = search_rows
+        reporter.emit('refit', f"  {target_col}: 在全部{len(X_train)}行训练数据上重新拟合最优模型{model_name}",
+                      model=model_name, target=target_col)
+        
+        def on_refit(output, refit_error):
+            if refit_error is not None:
+                # 全量拟合失败时保留样本上拟合的模型
+                print(f"  {model_name}全量拟合失败，保留样本上的模型: {refit_error}")
+                return
+            model_result.update(output)
+            model_result['refit_on_full_data'] = True
+        
+        self._submit_refit(scheduler, models_config[model_name]['model'](**model_result['best_params']), X_train,
+                           y_target, X_test, y_test_target,
+                           {'feature_columns': feature_columns, 'target_columns': [target_col]}, on_refit)
+    
+    def _on_search_done(self, scheduler, model_name, model_class, cv_folds, X_train, y_target, X_test, y_test_target,
+                        y_values, cache_context, on_model_done, outcome, error):
+        """搜索结束后把最优参数的拟合加入调度器；失败时直接报告包含error的结果
+        
+        每组候选参数只做一次K折拟合，排行榜的CV分数、标准差和R²都由最优参数的折外预测计算，
+        最优参数只在搜索数据(X_train, y_target)上再拟合一次；搜索使用分层样本时，
+        run_automl()只把各目标列的最优模型在全部训练数据上再拟合一次。拟合与FitCache.fit()使用相同的键，
+        其他服务用相同数据和参数拟合过的模型直接复用，只在worker中计算指标。
+        """
+        if error is not None:
+            message = str(error)
+            if scheduler.deadline is not None and time.time() > scheduler.deadline:
+                message += ' (已超过时间预算)'
+            on_model_done({'error': message, 'status': 'failed'})
+            return
+        
+        model_result = {
+            'model_name': model_name,
+            'best_params': outcome['best_params'],
+            'cv_score': float(-outcome['best_score']),  # Convert back to positive
+            'cv_std': float(outcome['fold_scores'].std()),
+            'cv_r2': float(r2_score(outcome.get('y', y_values), outcome['oof']))
+        }
+        if 'rungs' in outcome:
+            model_result['search'] = {key: outcome[key] for key in ('rungs', 'n_fits', 'stopped_early')}
+        elif 'trials' in outcome:
+            model_result['search'] = {'trials': outcome['trials'], 'n_fits': len(outcome['trials']) * cv_folds}
+        
+        def on_refit(output, refit_error):
+            if refit_error is not None:
+                on_model_done({'error': str(refit_error), 'status': 'failed'})
+                return
+            model_result.update(output)
+            on_model_done(model_result)
+        
+        self._submit_refit(scheduler, model_class(**outcome['best_params']), X_train, y_target, X_test, y_test_target,
+                           cache_context, on_refit)
+    
+    def _submit_refit(self, scheduler, estimator, X_train, y_target, X_test, y_test_target, cache_context, on_done):
+        """把estimator在(X_train, y_target)上的拟合和指标计算加入调度器，完成后调用on_done(输出, 错误)"""
+        # Make predictions for evaluation - 对大数据集分层采样评估
+        eval_indices = None
+        if len(X_train) > 20000:
+            # 使用采样数据评估性能，避免内存问题
+            eval_indices = sampler.indices(y_target, min(5000, len(X_train) // 4))
+        
+        estimator = limit_n_jobs(estimator, 1)
+        fit_key = self.fit_cache.fit_key(estimator, X_train, y_target, **cache_context)
+        fitted = self.fit_cache.get(fit_key)
+        
+        def on_refit(output, refit_error):
+            if refit_error is None and fitted is None:
+                self.fit_cache.put(fit_key, output['model'])
+            on_done(output, refit_error)
+        
+        scheduler.submit(
+            _refit_and_evaluate,
+            (fitted if fitted is not None else estimator, X_train, np.asarray(y_target), X_test,
+             np.asarray(y_test_target) if y_test_target is not None else None, eval_indices, fitted is None),
+            estimator, len(X_train), X_train.shape[1], on_refit
+        )
     
     def model_comparison_report(self, results):
         """Generate model comparison report"""
@@ -514,6 +760,7 @@ class AutoMLService:
                             'target': target_col,
                             'model': model_name,
                             'cv_score': model_result.get('cv_score', 0),
+                            'cv_r2': model_result.get('cv_r2', 'N/A'),
                             'train_r2': model_result.get('train_r2', 0),
                             'train_rmse': model_result.get('train_rmse', 0),
                             'test_r2': model_result.get('test_r2', 'N/A'),
@@ -565,4 +812,41 @@ class AutoMLService:
                     'targets_count': len(scores)
                 }
         
-        return best_model 
\ No newline at end of file
+        return best_model 
+
+
+def _refit_and_evaluate(estimator, X_train, y_target, X_test, y_test_target, eval_indices, refit=True):
+    """在全部训练数据上拟合最优参数并计算训练集/测试集指标，在调度器的worker中执行
+
+    refit=False时estimator是拟合缓存中已拟合的模型，只计算指标。
+    """
+    if refit:
+        estimator.fit(X_train, y_target)
+    
+    if eval_indices is not None:
+        y_train_pred = estimator.predict(X_train[eval_indices])
+        y_eval = y_target[eval_indices]
+        print(f"    使用{len(eval_indices)}样本评估性能")
+    else:
+        y_train_pred = estimator.predict(X_train)
+        y_eval = y_target
+    train_mse = mean_squared_error(y_eval, y_train_pred)
+    
+    result = {
+        'train_r2': float(r2_score(y_eval, y_train_pred)),
+        'train_mse': float(train_mse),
+        'train_rmse': float(np.sqrt(train_mse)),
+        'model': estimator
+    }
+    
+    # Test evaluation if test data is available
+    if y_test_target is not None:
+        y_test_pred = estimator.predict(X_test)
+        test_mse = mean_squared_error(y_test_target, y_test_pred)
+        result.update({
+            'test_r2': float(r2_score(y_test_target, y_test_pred)),
+            'test_mse': float(test_mse),
+            'test_rmse': float(np.sqrt(test_mse))
+        })
+    
+    return result
@@ -0,0 +1,169 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import shutil
+import uuid
+import hashlib
+from pathlib import Path
+
+
+class ColumnarCache:
+    """列式磁盘缓存: 每列保存为一个 .npy 文件，数值列以内存映射方式读取"""
+
+    META_FILE = 'meta.json'
+    FORMAT_VERSION = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+
+    def read(self, source_path, reader, columns=None):
+        """Load source_path through the cache, rebuilding it when the source changes
+
+        columns不为None时只加载其中存在的列，缓存命中时其余列的文件不会被打开。
+        """
+        source_path = Path(source_path)
+        key = self._source_key(source_path)
+        entry_dir = self._entry_dir(source_path)
+
+        if self.is_fresh(entry_dir, key):
+            try:
+                return self.read_frame(entry_dir, columns=columns)
+            except Exception as e:
+                print(f"读取列式缓存失败，重新构建: {e}")
+
+        df = reader(source_path)
+        try:
+            self.write_frame(df, entry_dir, key=key)
+        except Exception as e:
+            print(f"写入列式缓存失败: {e}")
+        if columns is not None:
+            df = df[[col for col in df.columns if col in set(columns)]]
+        return df
+
+    @classmethod
+    def is_fresh(cls, entry_dir, key):
+        """Check whether a cache entry matches the given source key"""
+        meta = cls._read_meta(entry_dir)
+        return meta is not None and meta.get('key') == key
+
+    @classmethod
+    def write_frame(cls, df, entry_dir, key=None):
+        """Write a DataFrame as one .npy file per column (atomic replace)"""
+        entry_dir = Path(entry_dir)
+        entry_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = entry_dir.parent / f'.{entry_dir.name}.{uuid.uuid4().hex}.tmp'
+        tmp_dir.mkdir()
+
+        try:
+            columns = []
+            for i, col in enumerate(df.columns):
+                series = df[col]
+                file_name = f'col_{i:05d}.npy'
+                column_meta = {'name': cls._encode_name(col), 'file': file_name}
+
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    # 类别列: 编码和类别分开保存
+                    column_meta['kind'] = 'category'
+                    column_meta['categories_file'] = f'cat_{i:05d}.npy'
+                    column_meta['ordered'] = bool(series.cat.ordered)
+                    np.save(tmp_dir / file_name, series.cat.codes.to_numpy())
+                    np.save(tmp_dir / column_meta['categories_file'],
+                            series.cat.categories.to_numpy(dtype=object), allow_pickle=True)
+                elif series.dtype.kind in 'biufcmM' and isinstance(series.dtype, np.dtype):
+                    column_meta['kind'] = 'numpy'
+                    np.save(tmp_dir / file_name, series.to_numpy())
+                else:
+                    column_meta['kind'] = 'object'
+                    np.save(tmp_dir / file_name, series.to_numpy(dtype=object), allow_pickle=True)
+
+                columns.append(column_meta)
+
+            meta = {
+                'format_version': cls.FORMAT_VERSION,
+                'key': key,
+                'n_rows': int(len(df)),
+                'columns': columns
+            }
+            with open(tmp_dir / cls.META_FILE, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+            if entry_dir.exists():
+                shutil.rmtree(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+        finally:
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def read_frame(cls, entry_dir, columns=None):
+        """Read a cached DataFrame; numeric columns are copy-on-write memory maps
+
+        columns不为None时只读取其中存在的列。
+        """
+        entry_dir = Path(entry_dir)
+        meta = cls._read_meta(entry_dir)
+        if meta is None:
+            raise FileNotFoundError(f'缓存不存在: {entry_dir}')
+        wanted = set(columns) if columns is not None else None
+
+        data = {}
+        names = []
+        for column_meta in meta['columns']:
+            name = column_meta['name']
+            if wanted is not None and name not in wanted:
+                continue
+            path = entry_dir / column_meta['file']
+            kind = column_meta['kind']
+
+            if kind == 'numpy':
+                # mmap_mode='c': 按需分页读取，写入时只复制到私有内存，不会改动缓存文件
+                values = np.load(path, mmap_mode='c')
+            elif kind == 'category':
+                codes = np.load(path)
+                categories = np.load(entry_dir / column_meta['categories_file'], allow_pickle=True)
+                values = pd.Categorical.from_codes(codes, categories=categories,
+                                                   ordered=column_meta.get('ordered', False))
+            else:
+                values = np.load(path, allow_pickle=True)
+
+            data[len(names)] = values
+            names.append(name)
+
+        df = pd.DataFrame(data, index=pd.RangeIndex(meta['n_rows']), copy=False)
+        df.columns = names
+        return df
+
+    def _entry_dir(self, source_path):
+        path_hash = hashlib.sha1(str(source_path.resolve()).encode('utf-8')).hexdigest()[:10]
+        return self.cache_dir / f'{source_path.stem}_{path_hash}'
+
+    @staticmethod
+    def _source_key(source_path):
+        stat = source_path.stat()
+        return {
+            'path': str(source_path.resolve()),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size
+        }
+
+    @classmethod
+    def _read_meta(cls, entry_dir):
+        meta_path = Path(entry_dir) / cls.META_FILE
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('format_version') != cls.FORMAT_VERSION:
+            return None
+        return meta
+
+    @staticmethod
+    def _encode_name(name):
+        # JSON只能保存字符串/数字列名，其他类型转为字符串
+        if isinstance(name, (str, int, float, bool)) or name is None:
+            return name
+        return str(name)
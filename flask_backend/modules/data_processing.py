@@ -1,273 +1,564 @@
 import pandas as pd
 import numpy as np
-import io
 import os
+import zlib
+import operator
+import tempfile
 from pathlib import Path
-from sklearn.preprocessing import StandardScaler, MinMaxScaler
-from sklearn.impute import SimpleImputer
+from .columnar_cache import ColumnarCache
+from .dataset_registry import DatasetRegistry, hash_stream, hash_file
+from .profiler import DataProfiler
+from .preprocessing import PreprocessingPipeline
 import warnings
 warnings.filterwarnings('ignore')
 
 class DataProcessingService:
-    def __init__(self):
+    # 行过滤支持的比较运算
+    FILTER_OPS = {
+        '==': operator.eq,
+        '!=': operator.ne,
+        '>': operator.gt,
+        '>=': operator.ge,
+        '<': operator.lt,
+        '<=': operator.le,
+        'in': lambda series, values: series.isin(values),
+        'not in': lambda series, values: ~series.isin(values)
+    }
+    
+    def __init__(self, profiler=None):
         self.train_data_path = Path("data/train_data.xlsx")
         self.test_data_path = Path("data/test_data.xlsx")
+        # 默认数据的列式缓存，源文件变化(路径/修改时间/大小)时自动重建
+        self.data_cache = ColumnarCache(Path("data/.cache"))
+        # 投影上传的源文件保存目录
+        self.upload_dir = Path("uploads")
+        # 上传文件流式读取的块大小，以及转换为category的唯一值比例阈值
+        self.upload_chunk_rows = 50000
+        self.category_ratio_threshold = 0.5
+        # 下载时每次编码的行数
+        self.download_chunk_rows = 20000
+        # 列统计计算器，可与报表服务共享以复用缓存
+        self.profiler = profiler or DataProfiler()
     
-    def load_default_data(self):
-        """Load the default training and testing data"""
+    def load_default_data(self, registry=None, projection=None):
+        """Load the default training and testing data
+        
+        传入数据集注册表时，内容哈希已注册的文件不再重复解析。projection为
+        normalize_projection()的结果，指定时只从列式缓存中读取需要的列，再按行过滤和抽样。
+        """
         try:
             result = {'success': True, 'message': ''}
             
-            if self.train_data_path.exists():
-                train_data = pd.read_excel(self.train_data_path)
-                result['train_data'] = train_data  # 这个会在app.py中存储到app_state
-                result['message'] += f"训练数据加载成功: {train_data.shape[0]} 行, {train_data.shape[1]} 列. "
-            else:
-                result['message'] += f"未找到默认训练数据文件: {self.train_data_path}. "
+            for data_type, label, path in (('train', '训练数据', self.train_data_path),
+                                           ('test', '测试数据', self.test_data_path)):
+                if not path.exists():
+                    result['message'] += f"未找到默认{label}文件: {path}. "
+                    continue
                 
-            if self.test_data_path.exists():
-                test_data = pd.read_excel(self.test_data_path)
-                result['test_data'] = test_data  # 这个会在app.py中存储到app_state
-                result['message'] += f"测试数据加载成功: {test_data.shape[0]} 行, {test_data.shape[1]} 列. "
-            else:
-                result['message'] += f"未找到默认测试数据文件: {self.test_data_path}. "
+                file_hash = hash_file(path)
+                dataset_id = self.projected_id(file_hash, projection)
+                result[f'{data_type}_dataset_id'] = dataset_id
+                if projection is not None:
+                    result[f'{data_type}_meta'] = self.projection_meta(file_hash, path, projection)
+                if registry is not None and dataset_id in registry:
+                    shape = registry.info(dataset_id)['shape']
+                else:
+                    data = self.load_source(path, projection)
+                    result[f'{data_type}_data'] = data  # 这个会在app.py中注册到数据集注册表
+                    shape = data.shape
+                result['message'] += f"{label}加载成功: {shape[0]} 行, {shape[1]} 列. "
                 
             return result
         except Exception as e:
             return {'success': False, 'message': f'加载数据时出错: {str(e)}'}
     
-    def upload_data(self, files):
-        """Upload custom dataset"""
+    def normalize_projection(self, params):
+        """从请求参数中提取列投影(columns)、行过滤(filters)和抽样比例(sample_frac)
+        
+        filters为 [{'column': 列名, 'op': 比较运算, 'value': 值}, ...]，多个条件同时满足。
+        三者都未指定时返回None，表示读取完整数据。
+        """
+        params = params or {}
+        columns = params.get('columns') or None
+        filters = params.get('filters') or []
+        sample_frac = params.get('sample_frac')
+        if sample_frac is not None:
+            sample_frac = float(sample_frac)
+            if not 0 < sample_frac <= 1:
+                raise ValueError(f'抽样比例必须在(0, 1]之间: {sample_frac}')
+            if sample_frac == 1:
+                sample_frac = None
+        for condition in filters:
+            if condition.get('op') not in self.FILTER_OPS or 'column' not in condition:
+                raise ValueError(f'无效的行过滤条件: {condition}')
+        
+        if columns is None and not filters and sample_frac is None:
+            return None
+        return {
+            'columns': list(columns) if columns is not None else None,
+            'filters': list(filters),
+            'sample_frac': sample_frac,
+            'random_state': int(params.get('random_state', 42))
+        }
+    
+    def load_source(self, source_path, projection=None):
+        """按投影设置读取源文件: 默认数据经过列式缓存，上传文件按块流式读取"""
+        source_path = Path(source_path)
+        if source_path in (self.train_data_path, self.test_data_path):
+            data = self.data_cache.read(source_path, pd.read_excel, columns=self._read_columns(projection))
+            return self._apply_projection(data, projection)
+        
+        with open(source_path, 'rb') as f:
+            data, _ = self._read_file_stream(f, source_path.name, projection)
+        return data
+    
+    def projected_id(self, file_hash, projection):
+        """投影数据集的ID由文件哈希和投影参数派生，不同投影设置得到不同的数据集"""
+        if projection is None:
+            return file_hash
+        return DatasetRegistry.derive_id(file_hash, {'projection': projection})
+    
+    def projection_meta(self, file_hash, source_path, projection):
+        """投影数据集的元数据，记录源文件以便之后补读缺少的列"""
+        return {
+            'source_id': file_hash,
+            'source_path': str(source_path),
+            'projection': projection
+        }
+    
+    def _read_columns(self, projection):
+        """需要从源文件读取的列: 投影列加上行过滤用到的列"""
+        if projection is None or projection['columns'] is None:
+            return None
+        columns = list(projection['columns'])
+        for condition in projection['filters']:
+            if condition['column'] not in columns:
+                columns.append(condition['column'])
+        return columns
+    
+    def _apply_projection(self, chunk, projection, chunk_index=0):
+        """对一个数据块依次应用行过滤、抽样和列投影"""
+        if projection is None:
+            return chunk
+        
+        if projection['filters']:
+            mask = np.ones(len(chunk), dtype=bool)
+            for condition in projection['filters']:
+                if condition['column'] not in chunk.columns:
+                    raise ValueError(f"行过滤条件中的列不存在: {condition['column']}")
+                compare = self.FILTER_OPS[condition['op']]
+                mask &= np.asarray(compare(chunk[condition['column']], condition.get('value')), dtype=bool)
+            chunk = chunk[mask]
+        
+        if projection['sample_frac'] is not None:
+            # 每个数据块使用固定的随机种子，重新读取时得到相同的行
+            chunk = chunk.sample(frac=projection['sample_frac'],
+                                 random_state=projection['random_state'] + chunk_index).sort_index()
+        
+        if projection['columns'] is not None:
+            wanted = set(projection['columns'])
+            chunk = chunk[[col for col in chunk.columns if col in wanted]]
+        return chunk
+    
+    def upload_data(self, files, registry=None, mode='replace', base_dataset_ids=None, pipelines=None,
+                    projection=None):
+        """Upload custom dataset
+        
+        上传文件以内容哈希作为数据集ID，已注册过的相同文件直接复用，不再解析。
+        mode='append'时将上传的行追加到base_dataset_ids指定的现有数据集：校验列结构后
+        只解析新增的行，基础数据集经过预处理时对新行重放同一条流水线(pipelines为
+        数据集ID -> 流水线)，列统计在原有结果上增量合并，不重新扫描历史数据。
+        projection指定时只解析需要的列，并按块做行过滤和抽样；源文件保存到上传目录，
+        之后需要投影外的列时可以重新读取。
+        """
         result = {'success': True, 'message': ''}
         
         try:
-            if 'train_file' in files:
-                train_file = files['train_file']
-                if train_file.filename.endswith('.csv'):
-                    train_data = pd.read_csv(train_file)
-                else:
-                    train_data = pd.read_excel(train_file)
-                
-                result['train_data'] = train_data
-                result['message'] += f"训练数据上传成功: {train_data.shape[0]} 行, {train_data.shape[1]} 列. "
+            if mode not in ('replace', 'append'):
+                return {'success': False, 'message': f'不支持的上传模式: {mode}'}
             
-            if 'test_file' in files:
-                test_file = files['test_file']
-                if test_file.filename.endswith('.csv'):
-                    test_data = pd.read_csv(test_file)
-                else:
-                    test_data = pd.read_excel(test_file)
+            for data_type, label in (('train', '训练数据'), ('test', '测试数据')):
+                if f'{data_type}_file' not in files:
+                    continue
+                file = files[f'{data_type}_file']
+                file_hash = hash_stream(file.stream)
                 
-                result['test_data'] = test_data
-                result['message'] += f"测试数据上传成功: {test_data.shape[0]} 行, {test_data.shape[1]} 列. "
+                if mode == 'append':
+                    base_id = (base_dataset_ids or {}).get(data_type)
+                    base_data = registry.get(base_id) if registry is not None and base_id else None
+                    if base_data is None:
+                        return {'success': False, 'message': f'没有可追加的{label}，请先加载或上传完整数据'}
+                    
+                    dataset_id = registry.derive_id(base_id, {'append': file_hash, 'projection': projection})
+                    result[f'{data_type}_dataset_id'] = dataset_id
+                    pipeline = (pipelines or {}).get(base_id)
+                    result[f'{data_type}_meta'] = {
+                        'parent_id': base_id,
+                        'pipeline_id': pipeline.pipeline_id if pipeline is not None else None
+                    }
+                    result[f'{data_type}_pipeline'] = pipeline
+                    if dataset_id in registry:
+                        shape = registry.info(dataset_id)['shape']
+                        result['message'] += f"{label}已追加过该文件，直接复用: {shape[0]} 行, {shape[1]} 列. "
+                        continue
+                    
+                    # 只读取现有数据集中的列
+                    base_columns = list(base_data.columns)
+                    if projection is not None:
+                        append_projection = dict(projection, columns=base_columns)
+                    else:
+                        append_projection = self.normalize_projection({'columns': base_columns})
+                    new_rows, memory = self._read_uploaded_file(file, append_projection)
+                    self._validate_append_schema(base_data, new_rows)
+                    if pipeline is not None:
+                        # 新增的是原始数据，需要先经过生成基础数据集的整条预处理链
+                        new_rows = pipeline.replay(new_rows)
+                    data = self._append_rows(base_data, new_rows)
+                    self.profiler.extend(base_data, base_id, new_rows, dataset_id,
+                                         dtypes={col: str(dtype) for col, dtype in data.dtypes.items()})
+                    
+                    result[f'{data_type}_data'] = data
+                    result[f'{data_type}_memory'] = memory
+                    result['message'] += f"{label}追加成功: 新增 {len(new_rows)} 行, 共 {data.shape[0]} 行, {data.shape[1]} 列. "
+                    continue
+                
+                dataset_id = self.projected_id(file_hash, projection)
+                result[f'{data_type}_dataset_id'] = dataset_id
+                if projection is not None:
+                    source_path = self._save_upload_source(file, file_hash)
+                    result[f'{data_type}_meta'] = self.projection_meta(file_hash, source_path, projection)
+                if registry is not None and dataset_id in registry:
+                    shape = registry.info(dataset_id)['shape']
+                    result['message'] += f"{label}已存在，直接复用: {shape[0]} 行, {shape[1]} 列. "
+                else:
+                    data, memory = self._read_uploaded_file(file, projection)
+                    
+                    result[f'{data_type}_data'] = data
+                    result[f'{data_type}_memory'] = memory
+                    result['message'] += f"{label}上传成功: {data.shape[0]} 行, {data.shape[1]} 列. "
                 
             return result
         except Exception as e:
             return {'success': False, 'message': f'上传数据时出错: {str(e)}'}
     
-    def get_data_preview(self, train_data, test_data):
-        """Get data preview and statistics"""
+    def _validate_append_schema(self, base_data, new_rows):
+        """追加的数据必须与现有数据集列名一致，且原本为数值的列仍为数值"""
+        base_columns = [str(col) for col in base_data.columns]
+        new_columns = [str(col) for col in new_rows.columns]
+        missing = [col for col in base_columns if col not in new_columns]
+        extra = [col for col in new_columns if col not in base_columns]
+        if missing or extra:
+            raise ValueError(f'追加数据的列与现有数据集不一致: 缺少 {missing}, 多出 {extra}')
+        
+        mismatched = [
+            col for col in base_data.columns
+            if pd.api.types.is_numeric_dtype(base_data[col].dtype)
+            and not pd.api.types.is_numeric_dtype(new_rows[col].dtype)
+            and new_rows[col].notna().any()
+        ]
+        if mismatched:
+            raise ValueError(f'追加数据中以下数值列包含非数值内容: {mismatched}')
+    
+    def _append_rows(self, base_data, new_rows):
+        """按现有数据集的列顺序和类型合并新行，不修改现有数据集"""
+        base_parts = {}
+        new_parts = {}
+        for col in base_data.columns:
+            base_col = base_data[col]
+            new_col = new_rows[col]
+            if isinstance(base_col.dtype, pd.CategoricalDtype):
+                # 合并类别集合以保持category类型
+                added = pd.Index(new_col.dropna().unique()).difference(base_col.cat.categories)
+                if len(added):
+                    base_col = base_col.cat.add_categories(added)
+                new_col = pd.Categorical(new_col, categories=base_col.cat.categories)
+            elif base_col.dtype.kind == 'f':
+                new_col = new_col.astype(base_col.dtype)
+            base_parts[col] = base_col
+            new_parts[col] = new_col
+        
+        return pd.concat([pd.DataFrame(base_parts), pd.DataFrame(new_parts, index=new_rows.index)],
+                         ignore_index=True)
+    
+    def _read_uploaded_file(self, file, projection=None):
+        """流式读取上传文件，按块压缩数据类型，返回 (DataFrame, 内存统计)"""
+        return self._read_file_stream(getattr(file, 'stream', file), file.filename, projection)
+    
+    def _read_file_stream(self, stream, filename, projection=None):
+        """按块读取CSV/Excel文件流，每块先投影再压缩数据类型"""
+        read_columns = self._read_columns(projection)
+        usecols = (lambda col: col in set(read_columns)) if read_columns is not None else None
+        lower_name = filename.lower()
+        
+        if lower_name.endswith('.csv'):
+            chunks = pd.read_csv(stream, chunksize=self.upload_chunk_rows, usecols=usecols)
+        elif lower_name.endswith(('.xlsx', '.xlsm')):
+            chunks = self._iter_xlsx_chunks(stream, read_columns)
+        else:
+            # 旧版.xls等格式无法流式读取，整体读取后再压缩
+            chunks = [pd.read_excel(stream, usecols=usecols)]
+        
+        bytes_before = 0
+        compact_chunks = []
+        for chunk_index, chunk in enumerate(chunks):
+            bytes_before += int(chunk.memory_usage(deep=True).sum())
+            chunk = self._apply_projection(chunk, projection, chunk_index)
+            compact_chunks.append(self._downcast_frame(chunk))
+            del chunk
+        
+        data = self._concat_compact_chunks(compact_chunks)
+        bytes_after = int(data.memory_usage(deep=True).sum())
+        print(f"上传文件 {filename}: 内存 {bytes_before / 1024 / 1024:.1f}MB -> {bytes_after / 1024 / 1024:.1f}MB")
+        
+        return data, {'bytes_before': bytes_before, 'bytes_after': bytes_after}
+    
+    def _save_upload_source(self, file, file_hash):
+        """保存投影上传的源文件，返回保存路径"""
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        source_path = self.upload_dir / f'{file_hash}{Path(file.filename).suffix.lower()}'
+        if not source_path.exists():
+            stream = getattr(file, 'stream', file)
+            with open(source_path, 'wb') as f:
+                for block in iter(lambda: stream.read(1024 * 1024), b''):
+                    f.write(block)
+            stream.seek(0)
+        return source_path
+    
+    def _iter_xlsx_chunks(self, stream, columns=None):
+        """使用openpyxl只读模式逐行迭代工作表，避免整个工作簿驻留内存
+        
+        columns不为None时只保留表头在其中的列。
+        """
+        from openpyxl import load_workbook
+        
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                yield pd.DataFrame()
+                return
+            names = [name if name is not None else f'Unnamed: {i}' for i, name in enumerate(header)]
+            wanted = set(columns) if columns is not None else None
+            positions = [i for i, name in enumerate(names) if wanted is None or name in wanted]
+            columns = [names[i] for i in positions]
+            
+            batch = []
+            yielded = False
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                if wanted is None:
+                    batch.append(row[:len(columns)])
+                else:
+                    batch.append(tuple(row[i] if i < len(row) else None for i in positions))
+                if len(batch) >= self.upload_chunk_rows:
+                    yield pd.DataFrame.from_records(batch, columns=columns).infer_objects()
+                    batch = []
+                    yielded = True
+            if batch or not yielded:
+                yield pd.DataFrame.from_records(batch, columns=columns).infer_objects()
+        finally:
+            workbook.close()
+    
+    def _downcast_frame(self, df):
+        """按列压缩数据类型: float64->float32, int64->最小整数类型, 低基数字符串->category"""
+        for col in df.columns:
+            series = df[col]
+            kind = series.dtype.kind
+            if kind == 'f' and series.dtype.itemsize > 4:
+                df[col] = series.astype(np.float32)
+            elif kind in 'iu':
+                df[col] = pd.to_numeric(series, downcast='integer' if kind == 'i' else 'unsigned')
+            elif series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+                n_unique = series.nunique(dropna=True)
+                if len(series) > 0 and n_unique <= max(1, len(series) * self.category_ratio_threshold):
+                    df[col] = series.astype('category')
+        return df
+    
+    def _concat_compact_chunks(self, chunks):
+        """合并压缩后的数据块，统一各块的类别集合以保持category类型"""
+        if not chunks:
+            return pd.DataFrame()
+        if len(chunks) == 1:
+            return chunks[0]
+        
+        for col in chunks[0].columns:
+            is_category = [isinstance(chunk[col].dtype, pd.CategoricalDtype) for chunk in chunks]
+            if all(is_category):
+                categories = pd.api.types.union_categoricals([chunk[col] for chunk in chunks]).categories
+                for chunk in chunks:
+                    chunk[col] = pd.Categorical(chunk[col], categories=categories)
+            elif any(is_category):
+                # 只有部分块是低基数，按整列重新判断
+                for chunk in chunks:
+                    chunk[col] = chunk[col].astype(object)
+        
+        data = pd.concat(chunks, ignore_index=True)
+        chunks.clear()
+        # 各块推断的整数宽度可能不同，合并后再压缩一次
+        return self._downcast_frame(data)
+    
+    def get_data_preview(self, train_data, test_data, train_version=None, test_version=None):
+        """Get data preview and statistics
+        
+        train_version/test_version为数据集版本号(dataset_id)，用于复用已缓存的列统计。
+        """
         result = {'success': True}
         
         try:
             if train_data is not None:
-                # 获取数值列
-                numeric_columns = train_data.select_dtypes(include=[np.number]).columns.tolist()
-                
-                result['train_preview'] = {
-                    'shape': list(train_data.shape),
-                    'head': train_data.head(10).to_dict('records'),
-                    'columns': train_data.columns.tolist(),
-                    'numeric_columns': numeric_columns,
-                    'dtypes': {col: str(dtype) for col, dtype in train_data.dtypes.items()},
-                    'description': train_data.describe().fillna(0).to_dict(),
-                    'missing_values': {col: int(count) for col, count in train_data.isnull().sum().items()},
-                    'missing_percentage': {col: float(pct) for col, pct in (train_data.isnull().sum() / len(train_data) * 100).items()}
-                }
+                result['train_preview'] = self._build_preview(train_data, train_version)
             
             if test_data is not None:
-                # 获取数值列
-                numeric_columns = test_data.select_dtypes(include=[np.number]).columns.tolist()
-                
-                result['test_preview'] = {
-                    'shape': list(test_data.shape),
-                    'head': test_data.head(10).to_dict('records'),
-                    'columns': test_data.columns.tolist(),
-                    'numeric_columns': numeric_columns,
-                    'dtypes': {col: str(dtype) for col, dtype in test_data.dtypes.items()},
-                    'description': test_data.describe().fillna(0).to_dict(),
-                    'missing_values': {col: int(count) for col, count in test_data.isnull().sum().items()},
-                    'missing_percentage': {col: float(pct) for col, pct in (test_data.isnull().sum() / len(test_data) * 100).items()}
-                }
+                result['test_preview'] = self._build_preview(test_data, test_version)
             
             return result
         except Exception as e:
             return {'success': False, 'message': f'获取数据预览时出错: {str(e)}'}
     
-    def preprocess_data(self, train_data, test_data, params):
-        """Apply data preprocessing"""
+    def _build_preview(self, data, version):
+        """根据列统计生成预览信息"""
+        profile = self.profiler.profile(data, version)
+        n_rows = max(profile['n_rows'], 1)
+        
+        return {
+            'shape': list(data.shape),
+            'head': data.head(10).to_dict('records'),
+            'columns': profile['columns'],
+            'numeric_columns': profile['numeric_columns'],
+            'dtypes': profile['dtypes'],
+            'description': {
+                col: {name: (0.0 if np.isnan(value) else value) for name, value in stats.items()}
+                for col, stats in profile['description'].items()
+            },
+            'missing_values': profile['missing_values'],
+            'missing_percentage': {col: float(count / n_rows * 100) for col, count in profile['missing_values'].items()}
+        }
+    
+    def preprocess_data(self, train_data, test_data, params, previous_pipeline=None):
+        """Apply data preprocessing
+        
+        在训练数据上拟合预处理流水线(没有训练数据时在测试数据上拟合)，再用同一组参数
+        变换训练和测试数据。拟合好的流水线随结果返回，供模型预测新数据时复用。
+        """
         try:
             result = {'success': True, 'message': '数据预处理完成'}
             
-            # Copy data to avoid modifying original
-            if train_data is not None:
-                processed_train = train_data.copy()
-            else:
-                processed_train = None
-                
-            if test_data is not None:
-                processed_test = test_data.copy()
-            else:
-                processed_test = None
-            
-            preprocess_methods = params.get('methods', [])
-            
-            # Handle missing values
-            if '填充缺失值' in preprocess_methods:
-                fill_method = params.get('fill_method', '均值填充')
-                fixed_value = params.get('fixed_value', 0.0)
-                
-                if processed_train is not None:
-                    processed_train = self._fill_missing_values(processed_train, fill_method, fixed_value)
-                if processed_test is not None:
-                    processed_test = self._fill_missing_values(processed_test, fill_method, fixed_value)
-            
-            # Feature standardization
-            if '特征标准化' in preprocess_methods:
-                if processed_train is not None and processed_test is not None:
-                    processed_train, processed_test = self._standardize_features(processed_train, processed_test)
-                elif processed_train is not None:
-                    processed_train = self._standardize_features(processed_train)
-            
-            # Feature normalization
-            if '特征归一化' in preprocess_methods:
-                if processed_train is not None and processed_test is not None:
-                    processed_train, processed_test = self._normalize_features(processed_train, processed_test)
-                elif processed_train is not None:
-                    processed_train = self._normalize_features(processed_train)
+            pipeline = PreprocessingPipeline.from_params(params, previous=previous_pipeline)
+            fit_data = train_data if train_data is not None else test_data
+            if fit_data is None:
+                return {'success': False, 'message': '没有可预处理的数据'}
             
-            # Outlier handling
-            if '异常值处理' in preprocess_methods:
-                outlier_method = params.get('outlier_method', 'IQR')
-                if processed_train is not None:
-                    processed_train = self._handle_outliers(processed_train, outlier_method)
-                if processed_test is not None:
-                    processed_test = self._handle_outliers(processed_test, outlier_method)
-            
-            result['train_data'] = processed_train
-            result['test_data'] = processed_test
+            # 传入的数据已经过上一次的流水线，这里只应用本次拟合的步骤
+            pipeline.fit(fit_data)
+            for key, data in (('train_data', train_data), ('test_data', test_data)):
+                result[key] = pipeline.transform(data, filter_rows=True, include_previous=False) if data is not None else None
             
+            result['pipeline'] = pipeline
             return result
         except Exception as e:
             return {'success': False, 'message': f'数据预处理时出错: {str(e)}'}
     
-    def convert_data_for_download(self, data, file_format):
-        """Convert data for download"""
+    def stream_data_for_download(self, data, file_format, compression=None):
+        """Convert data for download as a stream of byte chunks
+        
+        CSV按行块编码输出(可选gzip压缩)；xlsx使用openpyxl只写模式、parquet按行组写入临时文件，
+        再分块读出，内存占用与数据大小无关。
+        """
         try:
             if file_format == 'csv':
-                output = io.StringIO()
-                data.to_csv(output, index=False, encoding='utf-8-sig')
-                return {
-                    'success': True,
-                    'data': output.getvalue().encode('utf-8-sig'),
-                    'mimetype': 'text/csv'
-                }
+                stream = self._iter_csv_chunks(data)
+                mimetype = 'text/csv'
+                extension = 'csv'
+                if compression == 'gzip':
+                    stream = self._gzip_chunks(stream)
+                    mimetype = 'application/gzip'
+                    extension = 'csv.gz'
             elif file_format == 'xlsx':
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    data.to_excel(writer, index=False)
-                return {
-                    'success': True,
-                    'data': output.getvalue(),
-                    'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                }
+                stream = self._iter_file_chunks(self._write_xlsx, data, '.xlsx')
+                mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                extension = 'xlsx'
+            elif file_format == 'parquet':
+                stream = self._iter_file_chunks(self._write_parquet, data, '.parquet')
+                mimetype = 'application/vnd.apache.parquet'
+                extension = 'parquet'
             else:
                 return {'success': False, 'message': '不支持的文件格式'}
+            
+            return {
+                'success': True,
+                'stream': stream,
+                'mimetype': mimetype,
+                'extension': extension
+            }
         except Exception as e:
             return {'success': False, 'message': f'转换数据时出错: {str(e)}'}
     
-    def _fill_missing_values(self, df, method, fixed_value=None):
-        """Fill missing values in dataframe"""
-        numeric_columns = df.select_dtypes(include=[np.number]).columns
-        
-        if method == '均值填充':
-            df[numeric_columns] = df[numeric_columns].fillna(df[numeric_columns].mean())
-        elif method == '中位数填充':
-            df[numeric_columns] = df[numeric_columns].fillna(df[numeric_columns].median())
-        elif method == '众数填充':
-            for col in numeric_columns:
-                mode_value = df[col].mode()
-                if not mode_value.empty:
-                    df[col] = df[col].fillna(mode_value[0])
-        elif method == '固定值填充':
-            df[numeric_columns] = df[numeric_columns].fillna(fixed_value)
-        
-        # Fill non-numeric columns with mode
-        non_numeric_columns = df.select_dtypes(exclude=[np.number]).columns
-        for col in non_numeric_columns:
-            mode_value = df[col].mode()
-            if not mode_value.empty:
-                df[col] = df[col].fillna(mode_value[0])
-        
-        return df
+    def _iter_csv_chunks(self, data):
+        """逐块生成UTF-8(带BOM)编码的CSV内容"""
+        yield '\ufeff'.encode('utf-8')
+        if len(data) == 0:
+            yield data.to_csv(index=False).encode('utf-8')
+            return
+        for start in range(0, len(data), self.download_chunk_rows):
+            chunk = data.iloc[start:start + self.download_chunk_rows]
+            yield chunk.to_csv(index=False, header=(start == 0)).encode('utf-8')
     
-    def _standardize_features(self, train_df, test_df=None):
-        """Standardize features using StandardScaler"""
-        # Only standardize numeric columns
-        numeric_columns = train_df.select_dtypes(include=[np.number]).columns
-        
-        scaler = StandardScaler()
-        train_scaled = train_df.copy()
-        train_scaled[numeric_columns] = scaler.fit_transform(train_df[numeric_columns])
-        
-        if test_df is not None:
-            test_scaled = test_df.copy()
-            test_scaled[numeric_columns] = scaler.transform(test_df[numeric_columns])
-            return train_scaled, test_scaled
-        else:
-            return train_scaled
+    def _gzip_chunks(self, chunks):
+        """对字节块流进行gzip压缩"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
     
-    def _normalize_features(self, train_df, test_df=None):
-        """Normalize features using MinMaxScaler"""
-        # Only normalize numeric columns
-        numeric_columns = train_df.select_dtypes(include=[np.number]).columns
-        
-        scaler = MinMaxScaler()
-        train_normalized = train_df.copy()
-        train_normalized[numeric_columns] = scaler.fit_transform(train_df[numeric_columns])
-        
-        if test_df is not None:
-            test_normalized = test_df.copy()
-            test_normalized[numeric_columns] = scaler.transform(test_df[numeric_columns])
-            return train_normalized, test_normalized
-        else:
-            return train_normalized
+    def _iter_file_chunks(self, writer, data, suffix, chunk_size=1024 * 1024):
+        """将数据写入临时文件后分块读出，读取结束(或客户端断开)后删除临时文件"""
+        fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            writer(data, tmp_path)
+            with open(tmp_path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            os.remove(tmp_path)
     
-    def _handle_outliers(self, df, method):
-        """Handle outliers in dataframe"""
-        numeric_columns = df.select_dtypes(include=[np.number]).columns
-        df_cleaned = df.copy()
-        
-        if method == 'IQR':
-            for col in numeric_columns:
-                Q1 = df[col].quantile(0.25)
-                Q3 = df[col].quantile(0.75)
-                IQR = Q3 - Q1
-                lower_bound = Q1 - 1.5 * IQR
-                upper_bound = Q3 + 1.5 * IQR
-                
-                # Cap outliers
-                df_cleaned[col] = df_cleaned[col].clip(lower=lower_bound, upper=upper_bound)
-        
-        elif method == 'Z-Score':
-            for col in numeric_columns:
-                z_scores = np.abs((df[col] - df[col].mean()) / df[col].std())
-                df_cleaned = df_cleaned[z_scores < 3]
+    def _write_xlsx(self, data, path):
+        """使用openpyxl只写模式逐行写入，内存占用恒定"""
+        from openpyxl import Workbook
         
-        elif method == 'Percentile':
-            for col in numeric_columns:
-                lower_bound = df[col].quantile(0.05)
-                upper_bound = df[col].quantile(0.95)
-                df_cleaned[col] = df_cleaned[col].clip(lower=lower_bound, upper=upper_bound)
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+        worksheet.append([str(col) for col in data.columns])
+        for start in range(0, len(data), self.download_chunk_rows):
+            chunk = data.iloc[start:start + self.download_chunk_rows].astype(object)
+            # 缺失值写为空单元格
+            chunk = chunk.where(chunk.notna(), None)
+            for row in chunk.itertuples(index=False, name=None):
+                worksheet.append(row)
+        workbook.save(path)
+    
+    def _write_parquet(self, data, path):
+        """按行组写入parquet文件，避免一次性转换整个DataFrame"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
         
-        return df_cleaned 
\ No newline at end of file
+        writer = None
+        try:
+            for start in range(0, max(len(data), 1), self.download_chunk_rows):
+                chunk = data.iloc[start:start + self.download_chunk_rows]
+                if writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer = pq.ParquetWriter(path, table.schema)
+                else:
+                    table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
@@ -0,0 +1,153 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from .columnar_cache import ColumnarCache
+
+
+def hash_stream(stream, chunk_size=1024 * 1024):
+    """计算文件流内容的SHA-256哈希，读取后将流指针复位"""
+    digest = hashlib.sha256()
+    start = stream.tell() if hasattr(stream, 'tell') else 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+    stream.seek(start)
+    return digest.hexdigest()[:32]
+
+
+def hash_file(path):
+    """计算磁盘文件内容的哈希"""
+    with open(path, 'rb') as f:
+        return hash_stream(f)
+
+
+class DatasetRegistry:
+    """内容寻址的数据集注册表
+
+    数据集以内容哈希为ID，重复上传同一文件直接复用已有数据集。内存中的数据集按LRU
+    顺序管理，总占用超过内存预算时将最久未使用的数据集溢写为列式文件，下次访问时再
+    以内存映射方式惰性加载。
+    """
+
+    INFO_SUFFIX = '.json'
+
+    def __init__(self, storage_dir, memory_budget):
+        self.storage_dir = Path(storage_dir)
+        self.memory_budget = memory_budget
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self._frames = OrderedDict()  # dataset_id -> DataFrame，按最近使用排序
+        self._entries = {}  # dataset_id -> 元数据
+        self._lock = threading.RLock()
+        self._load_index()
+
+    @staticmethod
+    def derive_id(parent_id, params):
+        """由父数据集ID和变换参数得到派生数据集的ID"""
+        payload = json.dumps({'parent': parent_id, 'params': params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    def __contains__(self, dataset_id):
+        with self._lock:
+            return dataset_id in self._entries
+
+    def put(self, dataset_id, data, **meta):
+        """注册数据集，返回数据集ID"""
+        with self._lock:
+            nbytes = int(data.memory_usage(deep=True).sum())
+            entry = self._entries.get(dataset_id, {})
+            entry.update(meta)
+            entry.update({
+                'dataset_id': dataset_id,
+                'shape': list(data.shape),
+                'columns': [str(col) for col in data.columns],
+                'nbytes': nbytes,
+                'created_at': entry.get('created_at', datetime.now().isoformat()),
+                'spilled': False
+            })
+            self._entries[dataset_id] = entry
+            self._frames[dataset_id] = data
+            self._frames.move_to_end(dataset_id)
+            self._enforce_budget()
+            return dataset_id
+
+    def get(self, dataset_id):
+        """获取数据集，已溢写到磁盘的数据集按需重新加载；不存在时返回None"""
+        with self._lock:
+            if dataset_id not in self._entries:
+                return None
+            if dataset_id in self._frames:
+                self._frames.move_to_end(dataset_id)
+                return self._frames[dataset_id]
+
+            print(f"从磁盘加载数据集: {dataset_id}")
+            data = ColumnarCache.read_frame(self._data_dir(dataset_id))
+            self._entries[dataset_id]['spilled'] = False
+            self._frames[dataset_id] = data
+            self._enforce_budget()
+            return data
+
+    def info(self, dataset_id):
+        """获取数据集元数据"""
+        with self._lock:
+            entry = self._entries.get(dataset_id)
+            return dict(entry) if entry is not None else None
+
+    def list_datasets(self):
+        """列出所有已注册的数据集"""
+        with self._lock:
+            return [dict(entry, in_memory=dataset_id in self._frames)
+                    for dataset_id, entry in self._entries.items()]
+
+    def persist(self, dataset_id):
+        """确保数据集已写入磁盘，返回其列式文件目录"""
+        with self._lock:
+            data_dir = self._data_dir(dataset_id)
+            if not self._is_persisted(dataset_id):
+                ColumnarCache.write_frame(self._frames[dataset_id], data_dir, key=dataset_id)
+                self._write_info(dataset_id)
+            return data_dir
+
+    def memory_usage(self):
+        """当前驻留内存的数据集占用字节数"""
+        with self._lock:
+            return sum(self._entries[dataset_id]['nbytes'] for dataset_id in self._frames)
+
+    def _enforce_budget(self):
+        # 至少保留最近使用的一个数据集在内存中
+        while len(self._frames) > 1 and self.memory_usage() > self.memory_budget:
+            dataset_id, data = next(iter(self._frames.items()))
+            if not self._is_persisted(dataset_id):
+                ColumnarCache.write_frame(data, self._data_dir(dataset_id), key=dataset_id)
+            self._entries[dataset_id]['spilled'] = True
+            self._write_info(dataset_id)
+            del self._frames[dataset_id]
+            print(f"数据集 {dataset_id} 超出内存预算，已溢写到磁盘")
+
+    def _is_persisted(self, dataset_id):
+        return ColumnarCache.is_fresh(self._data_dir(dataset_id), dataset_id)
+
+    def _data_dir(self, dataset_id):
+        return self.storage_dir / dataset_id
+
+    def _write_info(self, dataset_id):
+        with open(self.storage_dir / f'{dataset_id}{self.INFO_SUFFIX}', 'w', encoding='utf-8') as f:
+            json.dump(self._entries[dataset_id], f, ensure_ascii=False, default=str)
+
+    def _load_index(self):
+        """启动时索引之前溢写到磁盘的数据集，不加载数据本身"""
+        for info_path in self.storage_dir.glob(f'*{self.INFO_SUFFIX}'):
+            dataset_id = info_path.stem
+            if not self._is_persisted(dataset_id):
+                continue
+            try:
+                with open(info_path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            entry['spilled'] = True
+            self._entries[dataset_id] = entry
@@ -0,0 +1,453 @@
+import copy
+import numpy as np
+from functools import partial
+from itertools import islice
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.linear_model import Ridge
+from sklearn.metrics import mean_squared_error
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import LinearSVR
+from sklearn.utils import Bunch
+from .executor import core_budget, limit_n_jobs
+from .folds import FoldEngine
+
+
+# 原生支持二维y、一次拟合即可得到所有目标列预测的估计器
+MULTI_OUTPUT_ESTIMATORS = (
+    'LinearRegression',
+    'RandomForestRegressor',
+    'ExtraTreesRegressor',
+    'DecisionTreeRegressor',
+    'MLPRegressor',
+    'XGBRegressor'
+)
+
+
+# 可以在已拟合模型上继续训练的估计器: sklearn的森林/GBR/MLP用warm_start，XGBoost以原booster继续提升
+WARM_START_ESTIMATORS = (
+    'RandomForestRegressor',
+    'ExtraTreesRegressor',
+    'GradientBoostingRegressor',
+    'HistGradientBoostingRegressor',
+    'MLPRegressor',
+    'XGBRegressor'
+)
+
+
+# 可以用验证集提前停止的提升模型
+EARLY_STOPPING_ESTIMATORS = (
+    'GradientBoostingRegressor',
+    'HistGradientBoostingRegressor',
+    'XGBRegressor'
+)
+
+
+# 大数据集上自动替换的模型(各服务的模型注册表使用相同的键):
+# 原模型 -> (行数超过该值时替换, 替换后的模型, 参数名换算)
+LARGE_DATA_ROUTES = {
+    'GradientBoosting': (20000, 'HistGradientBoosting', {'n_estimators': 'max_iter'}),
+    'SVR': (10000, 'ApproximateSVR', {})
+}
+
+
+def large_data_model(model_name, n_rows):
+    """n_rows行数据上实际使用的模型名，不需要替换时返回原模型名"""
+    route = LARGE_DATA_ROUTES.get(model_name)
+    if route is None or n_rows <= route[0]:
+        return model_name
+    return route[1]
+
+
+def large_data_params(model_name, params):
+    """把原模型的参数名换算为替换后模型的参数名，替换后模型不支持的参数由调用方过滤"""
+    renames = LARGE_DATA_ROUTES[model_name][2]
+    return {renames.get(key, key): value for key, value in params.items()}
+
+
+def iteration_param(estimator):
+    """提升/森林模型表示树数(迭代次数)的参数名"""
+    cls = estimator if isinstance(estimator, type) else type(estimator)
+    return 'max_iter' if cls.__name__ == 'HistGradientBoostingRegressor' else 'n_estimators'
+
+
+def max_iterations(estimator):
+    """估计器的树数上限；XGBoost 2.0起n_estimators默认为None，表示库的默认值100"""
+    value = estimator.get_params()[iteration_param(estimator)]
+    return 100 if value is None else int(value)
+
+
+def supports_multi_output(estimator):
+    """估计器(类或实例)是否原生支持多目标输出"""
+    if isinstance(estimator, PerTargetRegressor):
+        return True
+    cls = estimator if isinstance(estimator, type) else type(estimator)
+    return cls.__name__ in MULTI_OUTPUT_ESTIMATORS
+
+
+class PerTargetRegressor(BaseEstimator, RegressorMixin):
+    """为每个目标列各拟合一个估计器副本，对外表现为一个多输出模型
+
+    用于SVR、GradientBoosting等不支持二维y的估计器。各目标列的拟合由共享的core_budget
+    并发执行，核心在目标列之间分配，估计器自身的n_jobs随之降低，不会超过核心预算。
+    predict()返回 (n_samples, n_targets) 的矩阵。
+    """
+
+    def __init__(self, estimator):
+        self.estimator = estimator
+
+    def fit(self, X, y):
+        Y = np.asarray(y)
+        if Y.ndim == 1:
+            Y = Y.reshape(-1, 1)
+        fitted = core_budget.map(
+            partial(_fit_estimator, self.estimator, X),
+            [Y[:, j] for j in range(Y.shape[1])]
+        )
+        self.estimators_ = [estimator for estimator, _ in fitted]
+        # 超参数搜索的试验记录(估计器为TPESearchCV时)，每个目标列一份
+        self.searches_ = [trials for _, trials in fitted]
+        return self
+
+    def predict(self, X):
+        return np.column_stack([estimator.predict(X) for estimator in self.estimators_])
+
+
+class ApproximateSVR(BaseEstimator, RegressorMixin):
+    """核SVR的近似: 核特征映射 + 线性模型，训练时间与行数成线性关系
+
+    SVR的训练复杂度为O(n²)~O(n³)，大数据集上无法在合理时间内完成。这里先把特征映射到
+    n_components维: method='nystroem'时用Nystroem(以n_components个样本点近似核矩阵，
+    支持rbf/poly/sigmoid核)，method='rff'时用随机傅里叶特征(仅rbf核)；再拟合
+    LinearSVR(与SVR相同的epsilon不敏感损失和C)，或regressor='ridge'时拟合Ridge(alpha=1/(2C))。
+    gamma的'scale'/'auto'与SVR含义相同；kernel='linear'时不做映射，直接拟合线性模型。
+    目标值先减去均值，与SVR一样不对截距做正则化。
+    """
+
+    def __init__(self, kernel='rbf', C=1.0, epsilon=0.1, gamma='scale', degree=3, coef0=0.0,
+                 n_components=500, method='nystroem', regressor='linear_svr', max_iter=2000, random_state=42):
+        self.kernel = kernel
+        self.C = C
+        self.epsilon = epsilon
+        self.gamma = gamma
+        self.degree = degree
+        self.coef0 = coef0
+        self.n_components = n_components
+        self.method = method
+        self.regressor = regressor
+        self.max_iter = max_iter
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64).ravel()
+        steps = []
+        if self.kernel != 'linear':
+            gamma = self._gamma(X)
+            if self.method == 'rff':
+                if self.kernel != 'rbf':
+                    raise ValueError('随机傅里叶特征只支持rbf核')
+                steps.append(RBFSampler(gamma=gamma, n_components=self.n_components, random_state=self.random_state))
+            else:
+                steps.append(Nystroem(kernel=self.kernel, gamma=gamma, degree=self.degree, coef0=self.coef0,
+                                      n_components=min(self.n_components, len(X)), random_state=self.random_state))
+        if self.regressor == 'ridge':
+            steps.append(Ridge(alpha=1.0 / (2.0 * self.C)))
+        else:
+            steps.append(LinearSVR(C=self.C, epsilon=self.epsilon, max_iter=self.max_iter,
+                                   random_state=self.random_state))
+
+        self.y_mean_ = float(y.mean())
+        self.pipeline_ = make_pipeline(*steps).fit(X, y - self.y_mean_)
+        return self
+
+    def predict(self, X):
+        return self.pipeline_.predict(np.asarray(X, dtype=np.float64)) + self.y_mean_
+
+    def _gamma(self, X):
+        if self.gamma == 'scale':
+            variance = X.var()
+            return 1.0 / (X.shape[1] * variance) if variance > 0 else 1.0
+        if self.gamma == 'auto':
+            return 1.0 / X.shape[1]
+        return float(self.gamma)
+
+
+class FoldStackingRegressor(BaseEstimator, RegressorMixin):
+    """基于折外预测的Stacking回归器
+
+    结构与sklearn的StackingRegressor(passthrough=False)相同: 基学习器的折外预测作为元学习器的输入。
+    基学习器的K折拟合和全量拟合由FoldEngine在一次并行调用中完成，元学习器的折外预测
+    (oof_predictions_)和每折MSE(cv_scores_)在训练时一并得到，报告CV分数时不需要再对整个
+    Stacking模型做外层交叉验证。
+    """
+
+    def __init__(self, estimators, final_estimator, cv=5, n_jobs=None, random_state=42):
+        self.estimators = estimators
+        self.final_estimator = final_estimator
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        y = np.asarray(y)
+        engine = FoldEngine(n_splits=self.cv, random_state=self.random_state)
+        base_oof, fitted = engine.fit_predict(
+            [estimator for _, estimator in self.estimators], X, y, n_jobs=self.n_jobs, refit=True
+        )
+        meta_features = np.column_stack(base_oof)
+
+        self.estimators_ = fitted
+        self.named_estimators_ = Bunch(**{name: estimator for (name, _), estimator in zip(self.estimators, fitted)})
+        self.final_estimator_ = clone(self.final_estimator).fit(meta_features, y)
+        # 元学习器在相同折上的折外预测，作为整个Stacking模型的交叉验证估计
+        self.oof_predictions_ = engine.oof_predict(self.final_estimator, meta_features, y)
+        self.cv_scores_ = engine.fold_scores(y, self.oof_predictions_)
+        return self
+
+    def transform(self, X):
+        """基学习器的预测，即元学习器的输入"""
+        return np.column_stack([estimator.predict(X) for estimator in self.estimators_])
+
+    def predict(self, X):
+        return self.final_estimator_.predict(self.transform(X))
+
+
+def _fit_estimator(estimator, X, y, n_jobs):
+    estimator = limit_n_jobs(estimator, n_jobs)
+    estimator.fit(X, y)
+    # 超参数搜索只保留最优模型和试验记录
+    return getattr(estimator, 'best_estimator_', estimator), getattr(estimator, 'trials_', None)
+
+
+def supports_early_stopping(estimator):
+    """估计器(类或实例，或按目标列拟合的包装)能否用验证集提前停止"""
+    if isinstance(estimator, PerTargetRegressor):
+        return supports_early_stopping(estimator.estimator)
+    cls = estimator if isinstance(estimator, type) else type(estimator)
+    return cls.__name__ in EARLY_STOPPING_ESTIMATORS
+
+
+def fit_early_stopping(estimator, X, y, X_val, y_val, rounds=10):
+    """用验证集监控提升模型的训练，连续rounds轮验证集误差没有改进时停止
+
+    estimator的n_estimators(HistGradientBoosting为max_iter)是树数上限。返回 (已拟合的模型,
+    提前停止信息)，该参数设为实际使用的树数: clone后在其他数据上拟合(交叉验证、继续训练)时
+    使用相同的树数，不需要验证集。
+    GBR用fit的monitor回调在每轮后计算验证集MSE，XGBoost用early_stopping_rounds和eval_set，
+    HistGradientBoosting用warm_start每次增加rounds轮并计算验证集MSE，再以最优轮数重新拟合，
+    三者都只保留到验证集误差最小的轮次。
+    按目标列拟合的模型由core_budget并发地对每个目标列分别提前停止，信息为每个目标列一份的列表。
+    """
+    if isinstance(estimator, PerTargetRegressor):
+        Y, Y_val = np.asarray(y), np.asarray(y_val)
+        if Y.ndim == 1:
+            Y, Y_val = Y.reshape(-1, 1), Y_val.reshape(-1, 1)
+        fitted = core_budget.map(
+            partial(_fit_early_stopping, estimator.estimator, X, X_val, rounds),
+            [(Y[:, j], Y_val[:, j]) for j in range(Y.shape[1])]
+        )
+        model = clone(estimator)
+        model.estimators_ = [estimator for estimator, _ in fitted]
+        model.searches_ = [None] * len(fitted)
+        return model, [info for _, info in fitted]
+    return _fit_early_stopping(estimator, X, X_val, rounds, (y, y_val), None)
+
+
+def _fit_early_stopping(estimator, X, X_val, rounds, task, n_jobs):
+    y, y_val = task
+    name = type(estimator).__name__
+    if name not in EARLY_STOPPING_ESTIMATORS:
+        raise ValueError(f'{name}不支持提前停止')
+    estimator = limit_n_jobs(estimator, n_jobs) if n_jobs is not None else clone(estimator)
+    max_estimators = max_iterations(estimator)
+
+    if name == 'XGBRegressor':
+        estimator.set_params(early_stopping_rounds=rounds)
+        estimator.fit(X, y, eval_set=[(X_val, y_val)], verbose=False)
+        # predict()按booster记录的best_iteration只使用最优轮次之前的树
+        best_iteration = int(estimator.best_iteration)
+        n_used = best_iteration + 1
+        estimator.set_params(early_stopping_rounds=None, n_estimators=n_used)
+    elif name == 'HistGradientBoostingRegressor':
+        best_iteration = _fit_hgb_early_stopping(estimator, X, y, X_val, y_val, rounds, max_estimators)
+        n_used = best_iteration + 1
+        # 关闭自带提前停止、random_state固定时拟合是确定的，重新拟合前n_used轮得到相同的树
+        estimator.set_params(max_iter=n_used).fit(X, y)
+    else:
+        monitor = _ValidationMonitor(X_val, y_val, rounds)
+        estimator.fit(X, y, monitor=monitor)
+        best_iteration = monitor.best_iteration
+        n_used = best_iteration + 1
+        _truncate_stages(estimator, n_used)
+
+    return estimator, {
+        'best_iteration': best_iteration,
+        'n_estimators': n_used,
+        'max_estimators': max_estimators,
+        'stopped_early': n_used < max_estimators
+    }
+
+
+class _ValidationMonitor:
+    """GradientBoostingRegressor.fit()的monitor: 逐轮累加验证集预测，计算验证集MSE"""
+
+    def __init__(self, X_val, y_val, rounds):
+        self.X_val = X_val
+        self.y_val = np.asarray(y_val, dtype=np.float64)
+        self.rounds = rounds
+        self.prediction = None
+        self.scores = []
+
+    @property
+    def best_iteration(self):
+        return int(np.argmin(self.scores))
+
+    def __call__(self, i, model, _):
+        if self.prediction is None:
+            if isinstance(model.init_, str):
+                self.prediction = np.zeros(len(self.y_val))
+            else:
+                self.prediction = np.asarray(model.init_.predict(self.X_val), dtype=np.float64)
+        self.prediction = self.prediction + model.learning_rate * model.estimators_[i, 0].predict(self.X_val)
+        self.scores.append(mean_squared_error(self.y_val, self.prediction))
+        # 返回True时GBR停止添加新的树
+        return i - self.best_iteration >= self.rounds
+
+
+def _fit_hgb_early_stopping(estimator, X, y, X_val, y_val, rounds, max_iter):
+    """HistGradientBoosting的提前停止拟合，返回验证集MSE最小的轮次
+
+    sklearn 1.7之前fit()不接受外部验证集，自带的提前停止只能从训练数据中再划分验证集。
+    这里关闭自带的提前停止，用warm_start每次增加rounds轮，由staged_predict得到每轮后的验证集MSE。
+    """
+    y_val = np.asarray(y_val, dtype=np.float64)
+    scores = []
+    estimator.set_params(early_stopping=False, warm_start=True)
+    while len(scores) < max_iter:
+        estimator.set_params(max_iter=min(len(scores) + rounds, max_iter))
+        estimator.fit(X, y)
+        scores += [mean_squared_error(y_val, prediction)
+                   for prediction in islice(estimator.staged_predict(X_val), len(scores), None)]
+        if len(scores) - 1 - int(np.argmin(scores)) >= rounds:
+            break
+    estimator.set_params(warm_start=False)
+    return int(np.argmin(scores))
+
+
+def _truncate_stages(estimator, n_stages):
+    """只保留GBR的前n_stages棵树(与sklearn自身提前停止后截断各阶段属性的方式相同)"""
+    estimator.estimators_ = estimator.estimators_[:n_stages]
+    estimator.train_score_ = estimator.train_score_[:n_stages]
+    if hasattr(estimator, 'oob_improvement_'):
+        estimator.oob_improvement_ = estimator.oob_improvement_[:n_stages]
+        estimator.oob_scores_ = estimator.oob_scores_[:n_stages]
+        estimator.oob_score_ = estimator.oob_scores_[-1]
+    estimator.n_estimators_ = n_stages
+    estimator.set_params(n_estimators=n_stages)
+
+
+def supports_warm_start(model):
+    """已拟合的模型能否继续训练"""
+    if isinstance(model, PerTargetRegressor):
+        return all(supports_warm_start(estimator) for estimator in getattr(model, 'estimators_', []))
+    return type(model).__name__ in WARM_START_ESTIMATORS
+
+
+def continue_fit(model, X, y, params=None):
+    """在已拟合模型的基础上继续训练，返回新的模型，原模型不变
+
+    森林和GBR: params中的n_estimators为新的总树数，warm_start只拟合增加的树；
+    HistGradientBoosting: 同上，总树数为max_iter；
+    MLP: warm_start从当前权重继续训练max_iter轮；
+    XGBoost: 以原booster为起点继续提升 n_estimators - 已有轮数 轮。
+    params中的其他参数(例如learning_rate)只作用于新增的树或轮次。
+    按目标列保存的模型由core_budget并发地继续训练每个目标列的估计器。
+    """
+    params = dict(params or {})
+    if isinstance(model, PerTargetRegressor):
+        Y = np.asarray(y)
+        if Y.ndim == 1:
+            Y = Y.reshape(-1, 1)
+        continued = copy.copy(model)
+        continued.estimators_ = core_budget.map(
+            partial(_continue_estimator, X, params),
+            [(estimator, Y[:, j]) for j, estimator in enumerate(model.estimators_)]
+        )
+        return continued
+    return _continue_estimator(X, params, (model, y), None)
+
+
+def _continue_estimator(X, params, task, n_jobs):
+    estimator, y = task
+    name = type(estimator).__name__
+    if name not in WARM_START_ESTIMATORS:
+        raise ValueError(f'{name}不支持继续训练')
+    # 值为None的参数保持原模型的设置
+    params = {key: value for key, value in params.items() if value is not None}
+
+    if name == 'XGBRegressor':
+        booster = estimator.get_booster()
+        if booster.attr('best_iteration') is not None:
+            # 提前停止的模型从最优轮次继续，丢弃验证集上没有改进的轮次
+            booster = booster[:int(booster.attr('best_iteration')) + 1]
+        done = booster.num_boosted_rounds()
+        total = int(params.pop('n_estimators', done))
+        if total <= done:
+            raise ValueError(f'继续训练需要增大n_estimators(当前已有{done}轮)')
+        continued = type(estimator)(**{**estimator.get_params(), **params, 'n_estimators': total - done,
+                                       'early_stopping_rounds': None})
+        if n_jobs is not None:
+            continued.set_params(n_jobs=n_jobs)
+        continued.fit(X, y, xgb_model=booster, verbose=False)
+        return continued.set_params(n_estimators=total)
+
+    if name != 'MLPRegressor':
+        param = iteration_param(estimator)
+        done = int(estimator.n_iter_) if name == 'HistGradientBoostingRegressor' else len(estimator.estimators_)
+        if int(params.get(param, done)) <= done:
+            raise ValueError(f'继续训练需要增大{param}(当前已有{done}棵树)')
+    continued = copy.deepcopy(estimator)
+    if n_jobs is not None and 'n_jobs' in continued.get_params():
+        params['n_jobs'] = n_jobs
+    continued.set_params(warm_start=True, **params)
+    continued.fit(X, y)
+    # 之后再调用fit()时重新训练，与普通模型一致
+    return continued.set_params(warm_start=False)
+
+
+def predict_targets(model, X, target_columns):
+    """对所有目标列预测，返回 {目标列: 一维预测数组}
+
+    兼容三种保存形式: 单目标模型、一次预测所有目标列的多输出模型、
+    按目标列保存的模型字典(值为估计器或包含'model'的字典)。
+    """
+    if isinstance(model, dict):
+        predictions = {}
+        for target_col in target_columns:
+            estimator = model[target_col]
+            if isinstance(estimator, dict):
+                estimator = estimator['model']
+            predictions[target_col] = np.asarray(estimator.predict(X)).ravel()
+        return predictions
+
+    Y = np.asarray(model.predict(X))
+    if Y.ndim == 1:
+        Y = Y.reshape(-1, 1)
+    return {target_col: Y[:, j] for j, target_col in enumerate(target_columns)}
+
+
+def target_estimator(model, target_columns, target_col):
+    """获取某个目标列对应的估计器，返回 (估计器, 输出序号)
+
+    多输出模型由所有目标列共享同一个估计器，输出序号为该目标列在输出中的位置；
+    其他情况输出序号为None。
+    """
+    if isinstance(model, dict):
+        estimator = model[target_col]
+        return (estimator['model'] if isinstance(estimator, dict) else estimator), None
+    if isinstance(model, PerTargetRegressor):
+        return model.estimators_[target_columns.index(target_col)], None
+    if len(target_columns) == 1:
+        return model, None
+    return model, target_columns.index(target_col)
@@ -0,0 +1,119 @@
+import os
+import threading
+from contextlib import contextmanager
+from joblib import Parallel, delayed, parallel_config
+from joblib.parallel import get_active_backend
+from sklearn.base import clone
+
+
+class CoreBudget:
+    """进程内共享的CPU核心预算，以及按目标列并发执行训练任务的执行器
+
+    map()先从预算中预留空闲核心，再在外层并发任务数和任务内部估计器的n_jobs之间分配:
+    外层并发数 = min(任务数, 核心数)，每个任务的n_jobs = 核心数 // 外层并发数，
+    任务进程中BLAS/OpenMP的线程数同样限制为n_jobs，外层 x 内层不会超过预算。
+    同一进程中并发的训练请求共用一份预算，核心被占满时后来的请求等待释放。
+    已经运行在joblib工作进程中时(例如交叉验证的某一折)不再向外展开，按顺序执行。
+    """
+
+    def __init__(self, total=None):
+        self.total = max(1, int(total or os.cpu_count() or 1))
+        self._available = self.total
+        self._condition = threading.Condition()
+
+    def configure(self, total):
+        """设置核心总数(例如异步任务子进程只使用任务管理器分给它的份额)"""
+        with self._condition:
+            in_use = self.total - self._available
+            self.total = max(1, int(total))
+            self._available = self.total - in_use
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, wanted=None):
+        """预留最多wanted个核心(默认全部)，没有空闲核心时等待"""
+        with self._condition:
+            while self._available <= 0:
+                self._condition.wait()
+            granted = min(wanted or self.total, self._available)
+            self._available -= granted
+        try:
+            yield granted
+        finally:
+            with self._condition:
+                self._available += granted
+                self._condition.notify_all()
+
+    def map(self, func, tasks, on_result=None):
+        """并发执行 func(task, n_jobs)，返回与tasks顺序一致的结果列表
+
+        n_jobs为分配给该任务内部估计器的核心数，任务中的估计器应通过limit_n_jobs()设置。
+        on_result(index, result)在当前进程中按任务顺序、随结果返回逐个调用，用于发送进度事件。
+        任务在子进程中执行，func、task和返回值需要可以pickle；大的numpy数组(包括
+        SharedFeatureStore的内存映射)由joblib以内存映射方式传递。
+        """
+        tasks = list(tasks)
+        results = [None] * len(tasks)
+        if not tasks:
+            return results
+
+        def collect(index, result):
+            results[index] = result
+            if on_result is not None:
+                on_result(index, result)
+
+        if _in_worker():
+            for i, task in enumerate(tasks):
+                collect(i, func(task, 1))
+            return results
+
+        with self.reserve() as cores:
+            n_outer = min(len(tasks), cores)
+            n_inner = max(1, cores // n_outer)
+            if n_outer == 1:
+                for i, task in enumerate(tasks):
+                    collect(i, func(task, n_inner))
+                return results
+
+            print(f"并发执行{len(tasks)}个任务: {n_outer}个并发 x 每个任务{n_inner}核")
+            with parallel_config(backend='loky', inner_max_num_threads=n_inner):
+                outputs = Parallel(n_jobs=n_outer, return_as='generator')(
+                    delayed(_run_indexed)(func, i, task, n_inner) for i, task in enumerate(tasks)
+                )
+                for i, result in outputs:
+                    collect(i, result)
+        return results
+
+
+def _run_indexed(func, index, task, n_jobs):
+    return index, func(task, n_jobs)
+
+
+def _in_worker():
+    """当前是否运行在joblib的并行任务中"""
+    backend, _ = get_active_backend()
+    return (getattr(backend, 'nesting_level', 0) or 0) > 0
+
+
+def limit_n_jobs(estimator, n_jobs):
+    """返回限制了并行度的估计器副本
+
+    顶层的n_jobs设为n_jobs；嵌套估计器(网格搜索的估计器、Stacking的基学习器等)以及
+    搜索参数网格中的n_jobs设为1，避免两层并行的线程数相乘。
+    """
+    estimator = clone(estimator)
+    params = estimator.get_params(deep=True)
+    nested_n_jobs = 1 if 'n_jobs' in params else n_jobs
+    updates = {}
+    for key, value in params.items():
+        if key == 'n_jobs':
+            updates[key] = n_jobs
+        elif key.endswith('__n_jobs'):
+            updates[key] = nested_n_jobs
+        elif key in ('param_grid', 'param_distributions') and isinstance(value, dict) and 'n_jobs' in value:
+            updates[key] = {**value, 'n_jobs': [nested_n_jobs]}
+    return estimator.set_params(**updates)
+
+
+# 进程内共享的核心预算
+core_budget = CoreBudget(os.environ.get('TRAINING_CORES'))
@@ -0,0 +1,187 @@
+import os
+import glob
+import uuid
+import weakref
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost as xgb
+
+
+# 库版本变化后缓存的估计器可能无法加载或结果不同，版本号作为所有键的一部分
+_VERSIONS = (sklearn.__version__, xgb.__version__, np.__version__)
+
+
+class FitCache:
+    """磁盘上的拟合结果缓存，由机器学习、Stacking和AutoML服务共用
+
+    键由以下部分的哈希组成: 训练数据的内容哈希(特征矩阵已经过预处理和类型转换，
+    预处理流水线或dtype不同时内容哈希随之不同)、特征列/目标列等上下文、估计器类和
+    参数(嵌套估计器递归展开，n_jobs不影响结果不参与)、折划分的折数和随机种子、
+    sklearn/xgboost/numpy版本。值(已拟合的估计器、折外预测、指标)用joblib写入
+    cache_dir下的文件，多个进程(包括异步任务子进程)共享同一目录。
+    总大小超过max_bytes时按最近使用时间淘汰最旧的文件。cache_dir为None时不缓存。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # 内容哈希按对象缓存，同一个矩阵在一次训练中只计算一次
+        self._digests = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # 随服务对象传给任务子进程时不携带哈希缓存
+        state = self.__dict__.copy()
+        state['_digests'] = {}
+        return state
+
+    @property
+    def enabled(self):
+        return self.cache_dir is not None
+
+    def key(self, *parts):
+        """由任意部分(数组、DataFrame、估计器、参数字典等)计算缓存键"""
+        return joblib.hash([_VERSIONS, [self._normalize(part) for part in parts]])
+
+    def fit_key(self, estimator, X, y, **context):
+        return self.key('fit', estimator, X, y, context)
+
+    def fit(self, estimator, X, y, **context):
+        """与estimator.fit(X, y)相同；相同数据、估计器和上下文已经拟合过时直接返回缓存的估计器"""
+        return self.fetch(self.fit_key(estimator, X, y, **context), lambda: estimator.fit(X, y))
+
+    def oof_predictions(self, engine, estimators, X, y, n_jobs=None, **context):
+        """与engine.fit_predict()的折外预测相同，键包含折数、是否打乱和随机种子"""
+        key = self.key('oof', estimators, X, y, engine.n_splits, engine.shuffle, engine.random_state, context)
+        return self.fetch(key, lambda: engine.fit_predict(estimators, X, y, n_jobs=n_jobs)[0])
+
+    def fetch(self, key, compute):
+        """返回key的缓存值，没有时调用compute()计算并写入缓存"""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def get(self, key):
+        """读取缓存值，不存在时返回None"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            value = joblib.load(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"拟合缓存读取失败，忽略该条目: {e}")
+            self._remove(path)
+            return None
+        try:
+            # 记录最近使用时间，淘汰时先删除最久未用的条目
+            os.utime(path)
+        except OSError:
+            pass
+        print(f"拟合缓存命中: {key[:12]}")
+        return value
+
+    def put(self, key, value):
+        """写入缓存值，先写临时文件再原子替换，并发写入同一个键时不会读到不完整的文件"""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            joblib.dump(value, temp_path)
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"拟合缓存写入失败: {e}")
+            self._remove(temp_path)
+            return
+        self._evict()
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'enabled': self.enabled,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes
+        }
+
+    def clear(self):
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.joblib')
+
+    def _entries(self):
+        """[(最近使用时间, 字节数, 路径), ...]"""
+        if not self.enabled:
+            return []
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.joblib')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _normalize(self, part):
+        """把键的组成部分转换成与对象身份无关、可以稳定哈希的形式"""
+        if isinstance(part, (np.ndarray, pd.DataFrame, pd.Series)):
+            return ('data', self._digest(part))
+        if isinstance(part, type) or callable(part) and not hasattr(part, 'get_params'):
+            return ('callable', getattr(part, '__module__', None), getattr(part, '__qualname__', repr(part)))
+        if hasattr(part, 'get_params'):
+            params = part.get_params(deep=False)
+            return ('estimator', type(part).__module__, type(part).__qualname__,
+                    {name: self._normalize(value) for name, value in sorted(params.items()) if name != 'n_jobs'})
+        if isinstance(part, dict):
+            return {str(name): self._normalize(value) for name, value in sorted(part.items(), key=lambda item: str(item[0]))}
+        if isinstance(part, (list, tuple)):
+            return [self._normalize(value) for value in part]
+        return part
+
+    def _digest(self, data):
+        """数据的内容哈希；Series与同样取值的数组哈希相同，不同服务之间可以共用缓存"""
+        entry = self._digests.get(id(data))
+        if entry is not None and entry[0]() is data:
+            return entry[1]
+
+        if isinstance(data, pd.DataFrame):
+            digest = joblib.hash([[str(col) for col in data.columns]] +
+                                 [joblib.hash(data.iloc[:, j].to_numpy()) for j in range(data.shape[1])])
+        elif isinstance(data, pd.Series):
+            digest = joblib.hash(data.to_numpy())
+        else:
+            digest = joblib.hash(np.asarray(data))
+
+        try:
+            reference = weakref.ref(data)
+        except TypeError:
+            return digest
+        # 清理已经释放的对象
+        self._digests = {key: value for key, value in self._digests.items() if value[0]() is not None}
+        self._digests[id(data)] = (reference, digest)
+        return digest
@@ -0,0 +1,115 @@
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.model_selection import KFold
+from sklearn.metrics import mean_squared_error
+from .executor import limit_n_jobs
+
+
+class FoldEngine:
+    """K折训练引擎
+
+    每个估计器在每一折上只拟合一次，得到覆盖全部样本的折外(out-of-fold)预测。折外预测
+    同时用作交叉验证指标、Stacking元学习器的输入和AutoML排行榜的分数，不再为了报告CV
+    分数对已经训练好的模型(或整个Stacking模型)再套一层cross_val_score。
+    同一个引擎对相同行数的数据总是使用相同的折划分，不同估计器的分数可以直接比较。
+    """
+
+    def __init__(self, n_splits=5, shuffle=True, random_state=42):
+        self.n_splits = n_splits
+        self.shuffle = shuffle
+        self.random_state = random_state
+        self._splits = {}
+
+    def split(self, n_samples):
+        """返回 [(训练行号, 验证行号), ...]，按行数缓存"""
+        if n_samples not in self._splits:
+            kfold = KFold(n_splits=self.n_splits, shuffle=self.shuffle,
+                          random_state=self.random_state if self.shuffle else None)
+            self._splits[n_samples] = list(kfold.split(np.empty((n_samples, 1))))
+        return self._splits[n_samples]
+
+    def fit_predict(self, estimators, X, y, n_jobs=None, refit=False):
+        """对每个估计器做K折拟合，返回 (折外预测列表, 全量拟合的估计器列表)
+
+        所有 估计器 x 折 的拟合(refit=True时再加上每个估计器在全部数据上的拟合)在同一次
+        joblib调用中并行执行，估计器自身的n_jobs按分到的核心数降低。refit=False时第二个
+        返回值为None。
+        """
+        folds = self.split(len(X))
+        y = np.asarray(y)
+        jobs = [(e, f) for e in range(len(estimators)) for f in range(len(folds))]
+        if refit:
+            jobs += [(e, None) for e in range(len(estimators))]
+
+        inner_n_jobs = max(1, effective_n_jobs(n_jobs) // len(jobs))
+        outputs = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_fold)(limit_n_jobs(estimators[e], inner_n_jobs), X, y,
+                               folds[f] if f is not None else None)
+            for e, f in jobs
+        )
+
+        oof = [np.zeros(y.shape, dtype=np.float64) for _ in estimators]
+        fitted = [None] * len(estimators)
+        for (e, f), output in zip(jobs, outputs):
+            if f is None:
+                fitted[e] = output
+            else:
+                oof[e][folds[f][1]] = np.asarray(output).reshape(oof[e][folds[f][1]].shape)
+        return oof, (fitted if refit else None)
+
+    def oof_predict(self, estimator, X, y, n_jobs=None):
+        """单个估计器的折外预测，形状与y相同"""
+        oof, _ = self.fit_predict([estimator], X, y, n_jobs=n_jobs)
+        return oof[0]
+
+    def fold_scores(self, y, oof, metric=mean_squared_error):
+        """每一折验证集上的分数；多目标时返回 (n_splits, n_targets) 的矩阵"""
+        y = np.asarray(y)
+        oof = np.asarray(oof)
+        folds = self.split(len(y))
+        if y.ndim == 1:
+            return np.array([metric(y[test], oof[test]) for _, test in folds])
+        return np.array([
+            [metric(y[test, j], oof[test, j]) for j in range(y.shape[1])]
+            for _, test in folds
+        ])
+
+
+def run_steps(steps, n_jobs=None):
+    """在当前进程中执行一个搜索步骤生成器，返回生成器的返回值
+
+    搜索(逐次减半、TPE、网格/随机搜索)写成生成器: 每一步yield (engine, 估计器列表, X, y)，
+    收到与估计器一一对应的折外预测列表(拟合失败的估计器为None)，结束时return搜索结果。
+    这里用engine.fit_predict逐批执行；AutoML的FitScheduler把各搜索的批次展开成单折拟合，
+    放进同一个任务队列执行。整批拟合失败时逐个重试，找出失败的估计器。
+    """
+    try:
+        request = next(steps)
+        while True:
+            engine, estimators, X, y = request
+            request = steps.send(_predict_batch(engine, estimators, X, y, n_jobs))
+    except StopIteration as stop:
+        return stop.value
+
+
+def _predict_batch(engine, estimators, X, y, n_jobs):
+    try:
+        oof, _ = engine.fit_predict(estimators, X, y, n_jobs=n_jobs)
+        return oof
+    except Exception:
+        if len(estimators) == 1:
+            return [None]
+        return [oof for estimator in estimators for oof in _predict_batch(engine, [estimator], X, y, n_jobs)]
+
+
+def _take(X, rows):
+    return X.iloc[rows] if hasattr(X, 'iloc') else X[rows]
+
+
+def _fit_fold(estimator, X, y, fold):
+    """在一折的训练部分上拟合并预测验证部分；fold为None时在全部数据上拟合并返回估计器"""
+    if fold is None:
+        return estimator.fit(X, y)
+    train, test = fold
+    estimator.fit(_take(X, train), y[train])
+    return estimator.predict(_take(X, test))
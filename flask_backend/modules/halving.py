@@ -0,0 +1,248 @@
+import math
+import time
+import numpy as np
+from scipy.stats import loguniform, randint, uniform
+from joblib import effective_n_jobs
+from sklearn.model_selection import ParameterSampler
+from sklearn.metrics import mean_squared_error
+from .folds import FoldEngine, run_steps
+
+
+# 逐次减半搜索的参数空间和资源类型
+# resource为 'n_samples' 时各轮增加训练行数，否则为表示树数的参数名('n_estimators'/'max_iter')，各轮增加树的数量
+SEARCH_SPACES = {
+    'LinearRegression': {
+        'resource': 'n_samples',
+        'params': {
+            'fit_intercept': [True, False]
+        }
+    },
+    'RandomForest': {
+        'resource': 'n_estimators',
+        'min_resource': 10,
+        'max_resource': 300,
+        'params': {
+            'max_depth': [None, 6, 10, 16, 24],
+            'min_samples_split': randint(2, 11),
+            'min_samples_leaf': randint(1, 6),
+            'max_features': [1.0, 'sqrt', 0.5],
+            'random_state': [42]
+        }
+    },
+    'GradientBoosting': {
+        'resource': 'n_estimators',
+        'min_resource': 10,
+        'max_resource': 300,
+        'params': {
+            'learning_rate': loguniform(0.01, 0.3),
+            'max_depth': randint(2, 7),
+            'subsample': uniform(0.6, 0.4),
+            'random_state': [42]
+        }
+    },
+    'HistGradientBoosting': {
+        'resource': 'max_iter',
+        'min_resource': 20,
+        'max_resource': 500,
+        'params': {
+            'learning_rate': loguniform(0.01, 0.3),
+            'max_leaf_nodes': randint(15, 128),
+            'min_samples_leaf': randint(5, 101),
+            'l2_regularization': loguniform(1e-4, 10),
+            # 树数由各轮的资源决定，不提前停止
+            'early_stopping': [False],
+            'random_state': [42]
+        }
+    },
+    'XGBoost': {
+        'resource': 'n_estimators',
+        'min_resource': 10,
+        'max_resource': 300,
+        'params': {
+            'learning_rate': loguniform(0.01, 0.3),
+            'max_depth': randint(2, 9),
+            'subsample': uniform(0.6, 0.4),
+            'colsample_bytree': uniform(0.5, 0.5),
+            'min_child_weight': loguniform(1, 10),
+            'tree_method': ['hist'],
+            'random_state': [42]
+        }
+    },
+    'SVR': {
+        'resource': 'n_samples',
+        'params': {
+            'C': loguniform(0.1, 100),
+            'epsilon': loguniform(0.01, 1),
+            'gamma': ['scale', 'auto'],
+            'kernel': ['rbf']
+        }
+    },
+    'ApproximateSVR': {
+        'resource': 'n_samples',
+        'params': {
+            'C': loguniform(0.1, 100),
+            'epsilon': loguniform(0.01, 1),
+            'gamma': ['scale', 'auto'],
+            'n_components': [300, 500, 1000]
+        }
+    },
+    'MLP': {
+        'resource': 'n_samples',
+        'params': {
+            'hidden_layer_sizes': [(50,), (100,), (100, 50)],
+            'alpha': loguniform(1e-5, 1e-2),
+            'learning_rate_init': loguniform(1e-4, 1e-2),
+            'max_iter': [300],
+            'early_stopping': [True],
+            'random_state': [42]
+        }
+    }
+}
+
+
+class SuccessiveHalvingSearch:
+    """逐次减半(successive halving)超参数搜索
+
+    第一轮用最少的资源(较少的树或较少的行)评估大量随机候选参数，每轮只保留分数最好的
+    1/factor，并把资源乘以factor，最后一轮在完整资源上评估。表现差的参数在早期
+    低成本的轮次就被淘汰，预算集中在有希望的参数上。
+
+    预算由max_fits(总拟合次数，每个候选参数每轮拟合cv_folds次)和deadline(绝对时间)
+    控制: 初始候选数按max_fits推算；有deadline时每轮最多使用剩余时间的相同份额，
+    超过deadline后不再进入下一轮，以已完成的最后一轮的最优参数作为结果。
+    每轮的K折评估由FoldEngine完成；AutoML通过steps()生成器把各轮拟合交给FitScheduler调度。
+    """
+
+    def __init__(self, estimator_class, space, cv_folds=5, factor=3, max_fits=100, deadline=None,
+                 metric=mean_squared_error, greater_is_better=False, min_samples=None, random_state=42):
+        self.estimator_class = estimator_class
+        self.space = space
+        self.cv_folds = cv_folds
+        self.factor = factor
+        self.max_fits = max_fits
+        self.deadline = deadline
+        self.metric = metric
+        self.greater_is_better = greater_is_better
+        # 按行数分配资源时第一轮的最少行数
+        self.min_samples = min_samples or max(cv_folds * 40, 500)
+        self.random_state = random_state
+
+    def run(self, X, y, n_jobs=None):
+        """执行搜索，返回最优参数、分数、折外预测和每轮的记录"""
+        batch_size = max(2, effective_n_jobs(n_jobs)) if self.deadline is not None else None
+        return run_steps(self.steps(X, y, batch_size), n_jobs)
+
+    def steps(self, X, y, batch_size=None):
+        """搜索步骤生成器(协议见folds.run_steps)
+
+        batch_size为每一步评估的候选数，默认整轮候选一次提交。拟合失败或超过deadline
+        未运行的候选(折外预测为None)不参与本轮排名。
+        """
+        y = np.asarray(y, dtype=np.float64)
+        resource = self.space['resource']
+        if resource == 'n_samples':
+            resources = self._schedule(min(self.min_samples, len(X)), len(X))
+            rows = np.random.default_rng(self.random_state).permutation(len(X))
+        else:
+            resources = self._schedule(self.space['min_resource'], self.space['max_resource'])
+
+        candidates = list(ParameterSampler(self.space['params'], self._n_candidates(len(resources)),
+                                           random_state=self.random_state))
+        engine = FoldEngine(n_splits=self.cv_folds, random_state=self.random_state)
+        rungs = []
+        n_fits = 0
+        best = None
+
+        for i, amount in enumerate(resources):
+            if rungs and self.deadline is not None and time.time() > self.deadline:
+                break
+            # 只剩一个候选时直接在完整资源上评估
+            if len(candidates) == 1:
+                amount = resources[-1]
+
+            if resource == 'n_samples':
+                X_rung, y_rung = X[np.sort(rows[:amount])], y[np.sort(rows[:amount])]
+            else:
+                X_rung, y_rung = X, y
+
+            # 有时间预算且分批评估时每轮分得剩余时间的相同份额，超时后本轮不再评估剩余候选
+            # (候选已按上一轮分数排序，先评估的是最有希望的)
+            if self.deadline is not None and batch_size is not None:
+                rung_deadline = time.time() + (self.deadline - time.time()) / (len(resources) - i)
+            else:
+                rung_deadline = None
+            size = batch_size or len(candidates)
+
+            evaluated, oof_predictions, fold_scores = [], [], []
+            for start in range(0, len(candidates), size):
+                if evaluated and rung_deadline is not None and time.time() > rung_deadline:
+                    break
+                batch = candidates[start:start + size]
+                if resource == 'n_samples':
+                    estimators = [self.estimator_class(**params) for params in batch]
+                else:
+                    estimators = [self.estimator_class(**params, **{resource: amount}) for params in batch]
+                batch_oof = yield engine, estimators, X_rung, y_rung
+                n_fits += len(estimators) * self.cv_folds
+                for params, oof in zip(batch, batch_oof):
+                    if oof is None:
+                        continue
+                    evaluated.append(params)
+                    oof_predictions.append(oof)
+                    fold_scores.append(engine.fold_scores(y_rung, oof, self.metric))
+
+            if not evaluated:
+                break
+
+            # 与sklearn的scoring一致: 分数越大越好
+            scores = np.array([s.mean() if self.greater_is_better else -s.mean() for s in fold_scores])
+            order = np.argsort(-scores, kind='stable')
+
+            top = order[0]
+            best_params = dict(evaluated[top])
+            if resource != 'n_samples':
+                best_params[resource] = amount
+            best = {
+                'best_params': best_params,
+                'best_score': float(scores[top]),
+                'fold_scores': fold_scores[top],
+                'oof': oof_predictions[top],
+                'y': y_rung
+            }
+            rungs.append({
+                'resource': resource,
+                'amount': int(amount),
+                'n_candidates': len(evaluated),
+                'best_score': float(scores[top])
+            })
+            print(f"    逐次减半第{i + 1}轮: {resource}={amount}, 候选数={len(evaluated)}, 最优分数={scores[top]:.4f}")
+
+            if amount == resources[-1]:
+                break
+            candidates = [evaluated[j] for j in order[:max(1, math.ceil(len(evaluated) / self.factor))]]
+
+        if best is None:
+            raise ValueError('没有完成评估的候选参数')
+        best.update({
+            'rungs': rungs,
+            'n_fits': n_fits,
+            'stopped_early': rungs[-1]['amount'] != resources[-1]
+        })
+        return best
+
+    def _schedule(self, min_resource, max_resource):
+        """各轮的资源量: min_resource * factor^i，最后一轮为max_resource"""
+        min_resource = max(1, min(int(min_resource), int(max_resource)))
+        n_rungs = 1 + int(math.floor(math.log(max_resource / min_resource, self.factor) + 1e-9))
+        resources = [min(int(min_resource * self.factor ** i), int(max_resource)) for i in range(n_rungs)]
+        resources[-1] = int(max_resource)
+        return resources
+
+    def _n_candidates(self, n_rungs):
+        """按拟合次数预算推算第一轮的候选数"""
+        fits_per_candidate = self.cv_folds * sum(self.factor ** -i for i in range(n_rungs))
+        n_candidates = max(1, int(self.max_fits / fits_per_candidate))
+        # 参数空间全部为离散列表时候选数不超过组合数
+        if all(isinstance(values, (list, tuple)) for values in self.space['params'].values()):
+            n_candidates = min(n_candidates, math.prod(len(values) for values in self.space['params'].values()))
+        return n_candidates
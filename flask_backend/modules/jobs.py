@@ -0,0 +1,288 @@
+import os
+import time
+import uuid
+import queue
+import threading
+import traceback
+import multiprocessing
+from datetime import datetime
+from pathlib import Path
+import joblib
+from .columnar_cache import ColumnarCache
+from .progress import ProgressReporter
+from .executor import core_budget
+
+
+class DatasetHandle:
+    """工作进程中按需加载的数据集引用
+
+    数据集先由注册表写成列式文件，工作进程只接收目录路径，再以内存映射方式读取，
+    避免把DataFrame pickle到子进程。
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = str(data_dir)
+
+    def load(self):
+        return ColumnarCache.read_frame(self.data_dir)
+
+
+def _run_job(func, args, result_path, events, cores=None):
+    """工作进程入口: 加载数据集、执行训练函数，并把结果写入结果文件
+
+    训练函数的进度事件经队列转发给主进程；cores为该任务可用的CPU核心数。
+    """
+    try:
+        if cores:
+            core_budget.configure(cores)
+        args = [arg.load() if isinstance(arg, DatasetHandle) else arg for arg in args]
+        events.put({'type': 'state', 'state': JobManager.RUNNING})
+        reporter = ProgressReporter(sink=lambda event: events.put({'type': 'progress', 'event': event}))
+        result = func(*args, reporter=reporter)
+        joblib.dump(result, result_path)
+        events.put({'type': 'state', 'state': JobManager.DONE})
+    except Exception as e:
+        events.put({'type': 'error', 'message': str(e), 'traceback': traceback.format_exc()})
+
+
+class JobManager:
+    """异步训练任务队列
+
+    每个任务在独立的子进程中运行，同时运行的任务数不超过max_concurrent，其余任务排队。
+    任务状态为 queued/running/done/failed/cancelled，运行中的任务可以取消(终止子进程)。
+    子进程完成后，结果在主进程中交给提交任务时指定的on_done回调处理。
+
+    子进程发来的进度事件按顺序编号保存(每个任务最多保留max_events条)，
+    wait_events()供SSE接口阻塞等待新事件。
+
+    cores为所有任务共用的CPU核心总数，每个任务子进程分得 cores // max_concurrent 个核心，
+    并发运行的任务之间不会争抢核心。
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, work_dir, max_concurrent=2, poll_interval=0.5, max_events=1000, cores=None):
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.cores_per_job = max(1, int(cores or os.cpu_count() or 1) // self.max_concurrent)
+        self.poll_interval = poll_interval
+        self.max_events = max_events
+        # spawn启动的子进程不继承父进程的线程和OpenMP状态
+        self._context = multiprocessing.get_context('spawn')
+        self._jobs = {}
+        self._pending = []
+        self._running = {}  # job_id -> (process, events)
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._dispatcher = None
+
+    def submit(self, kind, func, args, on_done=None, meta=None):
+        """提交任务，立即返回任务ID"""
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'kind': kind,
+                'state': self.QUEUED,
+                'progress': 0.0,
+                'message': '任务排队中',
+                'meta': meta or {},
+                'created_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'eta': None,
+                '_events': [],
+                '_event_offset': 0,  # 已丢弃的旧事件数
+                '_func': func,
+                '_args': args,
+                '_on_done': on_done
+            }
+            self._pending.append(job_id)
+            self._ensure_dispatcher()
+        self._wakeup.set()
+        print(f"任务 {job_id} ({kind}) 已提交")
+        return job_id
+
+    def status(self, job_id):
+        """任务状态(不含内部字段)，任务不存在时返回None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            info = {key: value for key, value in job.items() if not key.startswith('_')}
+            if job['started_at'] is not None:
+                end = job['_finished'] if job['finished_at'] else time.time()
+                info['elapsed'] = round(end - job['_started'], 1)
+            if job['state'] == self.QUEUED:
+                info['queue_position'] = self._pending.index(job_id) + 1
+            return info
+
+    def wait_events(self, job_id, since=0, timeout=15):
+        """返回编号>=since的事件列表和任务是否已结束；没有新事件时最多等待timeout秒
+
+        每个事件为 (编号, 事件字典)。任务不存在时返回 (None, True)。
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return None, True
+                start = max(since - job['_event_offset'], 0)
+                events = [(job['_event_offset'] + i, event)
+                          for i, event in enumerate(job['_events'][start:], start=start)]
+                finished = job['state'] not in (self.QUEUED, self.RUNNING)
+                remaining = deadline - time.time()
+                if events or finished or remaining <= 0:
+                    return events, finished
+                self._changed.wait(remaining)
+
+    def list_jobs(self):
+        with self._lock:
+            return [self.status(job_id) for job_id in self._jobs]
+
+    def cancel(self, job_id):
+        """取消排队或运行中的任务，返回是否取消成功"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['state'] not in (self.QUEUED, self.RUNNING):
+                return False
+            if job['state'] == self.QUEUED:
+                self._pending.remove(job_id)
+            elif job_id not in self._running:
+                # 子进程已结束，正在处理任务结果
+                return False
+            else:
+                process, _ = self._running.pop(job_id)
+                process.terminate()
+                process.join(timeout=5)
+            self._finish(job, self.CANCELLED, '任务已取消')
+        self._wakeup.set()
+        print(f"任务 {job_id} 已取消")
+        return True
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='job-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch_loop(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self._lock:
+                finished = self._collect()
+                while self._pending and len(self._running) < self.max_concurrent:
+                    self._start(self._pending.pop(0))
+            # 读取结果和执行回调(加载、保存大模型)可能很慢，在锁外进行，不阻塞状态查询和事件流
+            for job in finished:
+                self._complete(job)
+
+    def _start(self, job_id):
+        job = self._jobs[job_id]
+        events = self._context.Queue()
+        process = self._context.Process(
+            target=_run_job,
+            args=(job['_func'], job['_args'], self._result_path(job_id), events, self.cores_per_job),
+            # 不设为daemon: 训练中joblib需要再启动自己的工作进程
+            name=f'job-{job_id[:8]}'
+        )
+        process.start()
+        self._running[job_id] = (process, events)
+        job['state'] = self.RUNNING
+        job['message'] = '任务运行中'
+        job['started_at'] = datetime.now().isoformat()
+        job['_started'] = time.time()
+        self._add_event(job, {'phase': self.RUNNING, 'message': job['message'], 'state': self.RUNNING,
+                              'progress': 0.0, 'timestamp': job['started_at']})
+        print(f"任务 {job_id} 开始运行 (进程 {process.pid})")
+
+    def _collect(self):
+        """处理运行中任务发来的事件，回收已结束的子进程；返回正常结束、待读取结果的任务"""
+        finished = []
+        for job_id, (process, events) in list(self._running.items()):
+            job = self._jobs[job_id]
+            self._drain_events(job, events)
+            if process.is_alive():
+                continue
+
+            process.join()
+            self._drain_events(job, events)
+            del self._running[job_id]
+            if job.get('_error'):
+                self._finish(job, self.FAILED, job['_error'])
+            elif process.exitcode != 0 or not self._result_path(job_id).exists():
+                self._finish(job, self.FAILED, f'任务进程异常退出 (exit code {process.exitcode})')
+            else:
+                job['message'] = '正在处理任务结果'
+                finished.append(job)
+        return finished
+
+    def _drain_events(self, job, events):
+        while True:
+            try:
+                event = events.get_nowait()
+            except (queue.Empty, OSError, EOFError):
+                return
+            if event['type'] == 'error':
+                job['_error'] = event['message']
+                print(f"任务 {job['job_id']} 失败: {event['traceback']}")
+            elif event['type'] == 'progress':
+                progress = event['event']
+                if progress.get('progress') is not None:
+                    job['progress'] = progress['progress']
+                job['eta'] = progress.get('eta')
+                if progress.get('message'):
+                    job['message'] = progress['message'].strip()
+                self._add_event(job, progress)
+
+    def _complete(self, job):
+        """在主进程中读取结果并执行回调，不持有锁；只在更新任务状态时加锁"""
+        result_path = self._result_path(job['job_id'])
+        try:
+            result = joblib.load(result_path)
+            if job['_on_done'] is not None:
+                result = job['_on_done'](result)
+            if isinstance(result, dict) and result.get('success') is False:
+                state, message = self.FAILED, result.get('message', '任务失败')
+            else:
+                state, message = self.DONE, '任务完成'
+        except Exception as e:
+            state, message, result = self.FAILED, f'处理任务结果时出错: {str(e)}', None
+        finally:
+            if result_path.exists():
+                os.remove(result_path)
+        with self._lock:
+            self._finish(job, state, message, result)
+
+    def _add_event(self, job, event):
+        job['_events'].append(event)
+        overflow = len(job['_events']) - self.max_events
+        if overflow > 0:
+            del job['_events'][:overflow]
+            job['_event_offset'] += overflow
+        self._changed.notify_all()
+
+    def _finish(self, job, state, message, result=None):
+        job['state'] = state
+        job['message'] = message
+        job['result'] = result
+        job['finished_at'] = datetime.now().isoformat()
+        job['_finished'] = time.time()
+        job['eta'] = None
+        if state == self.DONE:
+            job['progress'] = 1.0
+        self._add_event(job, {'phase': state, 'message': message, 'state': state,
+                              'progress': job['progress'], 'timestamp': job['finished_at']})
+        # 释放任务参数和回调，避免长期持有数据集引用
+        job['_func'] = job['_args'] = job['_on_done'] = None
+
+    def _result_path(self, job_id):
+        return self.work_dir / f'{job_id}.pkl'
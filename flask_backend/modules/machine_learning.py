@@ -1,20 +1,30 @@
 import pandas as pd
 import numpy as np
-import joblib
 import uuid
 from datetime import datetime
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.svm import SVR
 from sklearn.neural_network import MLPRegressor
-from sklearn.model_selection import train_test_split, cross_val_score, GridSearchCV
+from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import xgboost as xgb
+from .shared_features import SharedFeatureStore, feature_dtype
+from .progress import ProgressReporter
+from .estimators import (PerTargetRegressor, supports_multi_output, supports_warm_start, continue_fit,
+                         supports_early_stopping, fit_early_stopping, iteration_param, predict_targets,
+                         target_estimator, ApproximateSVR, large_data_model, large_data_params)
+from .folds import FoldEngine
+from .tpe import TPE_SPACES, TPESearchCV
+from .fit_cache import FitCache
+from .sampling import sampler
 import warnings
 warnings.filterwarnings('ignore')
 
 class MachineLearningService:
-    def __init__(self):
+    def __init__(self, fit_cache=None):
+        # 拟合结果缓存，相同数据和参数再次训练时直接返回已拟合的模型
+        self.fit_cache = fit_cache or FitCache()
         self.models = {
             'LinearRegression': {
                 'name': '线性回归(LR)',
@@ -46,6 +56,17 @@ class MachineLearningService:
                     'subsample': [0.8, 0.9, 1.0]
                 }
             },
+            'HistGradientBoosting': {
+                # 特征分箱后按直方图分裂，原生支持缺失值，适合大数据集
+                'name': '直方图梯度提升(HGB)',
+                'class': HistGradientBoostingRegressor,
+                'params': {
+                    'max_iter': [100, 200, 500],
+                    'learning_rate': [0.05, 0.1, 0.2],
+                    'max_leaf_nodes': [15, 31, 63],
+                    'min_samples_leaf': [10, 20, 50]
+                }
+            },
             'XGBoost': {
                 'name': 'XGBR模型',
                 'class': xgb.XGBRegressor,
@@ -65,6 +86,16 @@ class MachineLearningService:
                     'kernel': ['rbf', 'linear', 'poly']
                 }
             },
+            'ApproximateSVR': {
+                # 核特征映射 + 线性SVR，训练时间与行数成线性关系，大数据集上代替SVR
+                'name': '近似核SVR',
+                'class': ApproximateSVR,
+                'params': {
+                    'C': [0.1, 1, 10, 100],
+                    'gamma': ['scale', 'auto', 0.01, 0.1],
+                    'n_components': [300, 1000]
+                }
+            },
             'MLP': {
                 'name': '人工神经网络(ANN)',
                 'class': MLPRegressor,
@@ -91,41 +122,46 @@ class MachineLearningService:
             ]
         }
     
-    def train_model(self, train_data, params):
-        """Train a machine learning model"""
+    def train_model(self, train_data, params, reporter=None):
+        """Train a machine learning model
+        
+        特征矩阵只转换一次并写入内存映射文件，网格搜索和交叉验证的所有并行任务共享该只读视图。
+        reporter为ProgressReporter，用于发送结构化的进度事件。
+        """
+        reporter = reporter or ProgressReporter()
+        store = SharedFeatureStore()
         try:
             model_type = params.get('model_type')
             if model_type not in self.models:
                 return {'success': False, 'message': f'不支持的模型类型: {model_type}'}
             
-            print(f"开始训练模型: {model_type}")
+            reporter.emit('start', f"开始训练模型: {model_type}", model=model_type)
             
             # Prepare data
             target_columns = params.get('target_columns', train_data.columns[-3:].tolist())
-            feature_columns = [col for col in train_data.columns if col not in target_columns]
+            # 未指定特征列时使用目标列以外的所有列
+            feature_columns = params.get('feature_columns') or [col for col in train_data.columns if col not in target_columns]
             
             X = train_data[feature_columns]
             y = train_data[target_columns]
             
-            # 对于大数据集，减少验证集比例以提高训练效率
-            data_size = len(train_data)
-            if data_size > 10000:
-                test_size = min(0.15, params.get('test_size', 0.2))  # 大数据集使用更小的验证集
-                print(f"大数据集检测到({data_size}条)，调整验证集比例为{test_size}")
-            else:
-                test_size = params.get('test_size', 0.2)
-            
             # Split data for validation
+            data_size = len(train_data)
             random_state = params.get('random_state', 42)
-            X_train, X_val, y_train, y_val = train_test_split(
-                X, y, test_size=test_size, random_state=random_state
-            )
+            # 大数据集上GBR自动改用直方图梯度提升，SVR改用近似核SVR
+            model_type, model_params = self._route_large_data(model_type, params.get('model_params', {}), data_size)
+            X_train, X_val, y_train, y_val = self._validation_split(X, y, params)
+            
+            # 训练和交叉验证各算一步
+            reporter.set_total(2)
+            reporter.emit('prepare', f"训练集大小: {X_train.shape}, 验证集大小: {X_val.shape}", model=model_type)
             
-            print(f"训练集大小: {X_train.shape}, 验证集大小: {X_val.shape}")
+            # 所有并行拟合共享同一个连续的只读特征矩阵
+            dtype = feature_dtype(self.models[model_type]['class'])
+            X_train = store.share(X_train, dtype, 'X_train')
             
             # Initialize model
             model_info = self.models[model_type]
-            model_params = params.get('model_params', {})
             
             # 验证并清理模型参数
             validated_params = self._validate_model_params(model_type, model_params)
@@ -137,45 +173,57 @@ class MachineLearningService:
             else:
                 print(f"验证后的模型参数: {validated_params}")
             
+            # 超参数搜索的试验记录，未搜索时为None
+            search_info = None
+            # 提升模型直接训练时用验证集提前停止，n_estimators为树数上限；early_stopping=False时训练全部的树
+            early_stopping_rounds = None
+            if (params.get('early_stopping', True) and not params.get('use_grid_search', False)
+                    and supports_early_stopping(model_info['class'])):
+                early_stopping_rounds = int(params.get('early_stopping_rounds', 10))
+            early_stopping_info = None
+            # 拟合缓存键的上下文
+            cache_context = {'feature_columns': feature_columns, 'target_columns': target_columns}
+            
             # Handle different target scenarios
             if len(target_columns) == 1:
                 # Single target
                 y_train_single = y_train.iloc[:, 0]
                 y_val_single = y_val.iloc[:, 0]
                 
-                print(f"开始训练单目标模型...")
+                fit_mode = 'single'
+                reporter.emit('fit', "开始训练单目标模型...", model=model_type,
+                              target=target_columns[0], target_index=1, n_targets=1)
                 
                 if params.get('use_grid_search', False):
-                    # Grid search for hyperparameter tuning
-                    print("使用网格搜索优化参数...")
-                    grid_params = self._get_grid_search_params(model_type, validated_params)
-                    
+                    # 超参数搜索: 默认TPE，search_method='grid'时使用完整网格
                     # 对大数据集减少CV折数
                     cv_folds = 3 if data_size > 15000 else 5
-                    print(f"使用{cv_folds}折交叉验证")
-                    
-                    model = GridSearchCV(
-                        model_info['class'](),
-                        grid_params,
-                        cv=cv_folds,
-                        scoring='neg_mean_squared_error',
-                        n_jobs=-1,
-                        verbose=1  # 显示进度
-                    )
-                    model.fit(X_train, y_train_single)
+                    model = self.fit_cache.fit(self._build_search(model_type, validated_params, params, cv_folds),
+                                               X_train, y_train_single, **cache_context)
                     best_model = model.best_estimator_
                     best_params = model.best_params_
-                    print("网格搜索完成")
+                    search_info = self._search_info(model)
+                    print("超参数搜索完成")
+                elif early_stopping_rounds:
+                    print(f"直接训练模型，验证集连续{early_stopping_rounds}轮没有改进时提前停止...")
+                    best_model, early_stopping_info = self._fit_early_stopping(
+                        model_info['class'](**validated_params), X_train, y_train_single, X_val, y_val_single,
+                        early_stopping_rounds, target_columns, cache_context
+                    )
+                    n_param = iteration_param(best_model)
+                    best_params = {**validated_params, n_param: best_model.get_params()[n_param]}
+                    print(f"模型训练完成，实际树数: {best_params[n_param]}")
                 else:
                     # Direct training with provided params
                     print("直接训练模型...")
-                    model = model_info['class'](**validated_params)
-                    model.fit(X_train, y_train_single)
+                    model = self.fit_cache.fit(model_info['class'](**validated_params), X_train, y_train_single,
+                                               **cache_context)
                     best_model = model
                     best_params = validated_params
                     print("模型训练完成")
                 
-                print("开始预测和计算指标...")
+                reporter.emit('fit_done', "开始预测和计算指标...", advance=True, model=model_type,
+                              target=target_columns[0], target_index=1, n_targets=1)
                 # Predictions
                 y_train_pred = best_model.predict(X_train)
                 y_val_pred = best_model.predict(X_val)
@@ -185,47 +233,55 @@ class MachineLearningService:
                 val_metrics = {target_columns[0]: self._calculate_metrics(y_val_single, y_val_pred)}
                 
             else:
-                # Multiple targets - train separate models for each target
-                print(f"开始训练多目标模型 ({len(target_columns)}个目标)...")
-                models = {}
-                train_metrics = {}
-                val_metrics = {}
+                # Multiple targets - 支持二维y的模型一次拟合所有目标列，其余模型按目标列并行拟合
+                fit_mode = 'multi_output' if supports_multi_output(model_info['class']) else 'per_target'
+                Y_train = y_train.to_numpy(dtype=np.float64)
+                reporter.emit('fit', f"开始训练多目标模型 ({len(target_columns)}个目标, "
+                                     f"{'原生多输出' if fit_mode == 'multi_output' else '按目标列并行'})...",
+                              model=model_type, n_targets=len(target_columns))
                 
-                for i, target_col in enumerate(target_columns):
-                    print(f"训练目标 {i+1}/{len(target_columns)}: {target_col}")
-                    y_train_single = y_train.iloc[:, i]
-                    y_val_single = y_val.iloc[:, i]
-                    
-                    if params.get('use_grid_search', False):
-                        print(f"为目标{target_col}使用网格搜索...")
-                        grid_params = self._get_grid_search_params(model_type, validated_params)
-                        cv_folds = 3 if data_size > 15000 else 5
-                        model = GridSearchCV(
-                            model_info['class'](),
-                            grid_params,
-                            cv=cv_folds,
-                            scoring='neg_mean_squared_error',
-                            n_jobs=-1,
-                            verbose=1
+                if params.get('use_grid_search', False):
+                    cv_folds = 3 if data_size > 15000 else 5
+                    search = self._build_search(model_type, validated_params, params, cv_folds)
+                    if fit_mode == 'multi_output':
+                        search = self.fit_cache.fit(search, X_train, Y_train, **cache_context)
+                        best_model = search.best_estimator_
+                        best_params = search.best_params_
+                        search_info = self._search_info(search)
+                    else:
+                        # 每个目标列各自搜索最优参数
+                        best_model = self.fit_cache.fit(PerTargetRegressor(search), X_train, Y_train, **cache_context)
+                        best_params = validated_params
+                        search_info = self._search_info(search, dict(zip(target_columns, best_model.searches_)))
+                else:
+                    estimator = model_info['class'](**validated_params)
+                    if fit_mode == 'per_target':
+                        estimator = PerTargetRegressor(estimator)
+                    if early_stopping_rounds:
+                        best_model, early_stopping_info = self._fit_early_stopping(
+                            estimator, X_train, Y_train, X_val, y_val, early_stopping_rounds, target_columns,
+                            cache_context
                         )
-                        model.fit(X_train, y_train_single)
-                        models[target_col] = model.best_estimator_
                     else:
-                        model = model_info['class'](**validated_params)
-                        model.fit(X_train, y_train_single)
-                        models[target_col] = model
-                    
-                    print(f"目标{target_col}训练完成，计算指标...")
-                    # Predictions for this target
-                    y_train_pred = models[target_col].predict(X_train)
-                    y_val_pred = models[target_col].predict(X_val)
-                    
-                    # Metrics for this target
-                    train_metrics[target_col] = self._calculate_metrics(y_train_single, y_train_pred)
-                    val_metrics[target_col] = self._calculate_metrics(y_val_single, y_val_pred)
+                        best_model = self.fit_cache.fit(estimator, X_train, Y_train, **cache_context)
+                    best_params = validated_params
+                    if early_stopping_rounds and fit_mode == 'multi_output':
+                        n_param = iteration_param(best_model)
+                        best_params = {**validated_params, n_param: best_model.get_params()[n_param]}
                 
-                best_model = models
-                best_params = validated_params
+                reporter.emit('fit_done', "多目标模型训练完成，计算指标...", advance=True, model=model_type,
+                              n_targets=len(target_columns))
+                # 一次predict得到所有目标列的预测
+                y_train_pred = predict_targets(best_model, X_train, target_columns)
+                y_val_pred = predict_targets(best_model, X_val, target_columns)
+                train_metrics = {
+                    target_col: self._calculate_metrics(y_train[target_col], y_train_pred[target_col])
+                    for target_col in target_columns
+                }
+                val_metrics = {
+                    target_col: self._calculate_metrics(y_val[target_col], y_val_pred[target_col])
+                    for target_col in target_columns
+                }
             
             print("开始交叉验证评分...")
             # Cross-validation score - 对大数据集进行优化
@@ -237,7 +293,8 @@ class MachineLearningService:
                     # 对超大数据集进行采样以加速CV
                     if data_size > 50000:
                         sample_size = min(10000, data_size // 2)
-                        sample_indices = np.random.choice(len(X), sample_size, replace=False)
+                        # 按目标值分层的可复现抽样，相同数据再次训练时使用相同的样本，可以命中拟合缓存
+                        sample_indices = sampler.indices(y.to_numpy(dtype=np.float64), sample_size)
                         X_cv = X.iloc[sample_indices]
                         y_cv = y.iloc[sample_indices]
                         print(f"超大数据集采样CV: 使用{sample_size}样本进行{cv_folds}折交叉验证")
@@ -250,26 +307,40 @@ class MachineLearningService:
                     X_cv = X
                     y_cv = y
                     print(f"标准CV: 使用{cv_folds}折交叉验证")
+                X_cv = store.share(X_cv, dtype, 'X_cv')
                 
-                for i, target_col in enumerate(target_columns):
-                    try:
-                        if len(target_columns) == 1:
-                            cv_score = cross_val_score(
-                                best_model, X_cv, y_cv.iloc[:, 0], 
-                                cv=cv_folds, scoring='neg_mean_squared_error',
-                                n_jobs=-1
-                            )
-                        else:
-                            cv_score = cross_val_score(
-                                best_model[target_col], X_cv, y_cv[target_col], 
-                                cv=cv_folds, scoring='neg_mean_squared_error',
-                                n_jobs=-1
-                            )
-                        cv_scores[target_col] = float(-cv_score.mean())
-                        print(f"目标{target_col}的CV分数: {cv_scores[target_col]:.4f}")
-                    except Exception as cv_error:
-                        print(f"目标{target_col}的CV计算失败: {cv_error}")
-                        cv_scores[target_col] = 0.0
+                # 各折的折外预测只计算一次，CV分数为各折验证集MSE的均值
+                engine = FoldEngine(n_splits=cv_folds)
+                # 按目标列搜索或提前停止的模型各目标列参数(树数)不同，逐目标列计算
+                per_target_params = params.get('use_grid_search', False) or early_stopping_info is not None
+                if len(target_columns) > 1 and not (fit_mode == 'per_target' and per_target_params):
+                    # 一次K折拟合同时得到所有目标列的折外预测
+                    Y_cv = y_cv.to_numpy(dtype=np.float64)
+                    oof = self.fit_cache.oof_predictions(engine, [best_model], X_cv, Y_cv, n_jobs=-1, **cache_context)[0]
+                    fold_mse = engine.fold_scores(Y_cv, oof)
+                    for j, target_col in enumerate(target_columns):
+                        cv_scores[target_col] = float(fold_mse[:, j].mean())
+                    reporter.emit('cv', f"各目标列的CV分数: {cv_scores}", advance=True, model=model_type,
+                                  n_targets=len(target_columns), n_folds=cv_folds, score=cv_scores)
+                else:
+                    # 单目标，或各目标列参数不同的按目标列模型
+                    for i, target_col in enumerate(target_columns):
+                        try:
+                            estimator, _ = target_estimator(best_model, target_columns, target_col)
+                            y_target_cv = y_cv[target_col].to_numpy(dtype=np.float64)
+                            oof = self.fit_cache.oof_predictions(engine, [estimator], X_cv, y_target_cv, n_jobs=-1,
+                                                                 feature_columns=feature_columns,
+                                                                 target_columns=[target_col])[0]
+                            cv_scores[target_col] = float(engine.fold_scores(y_target_cv, oof).mean())
+                            reporter.emit('cv', f"目标{target_col}的CV分数: {cv_scores[target_col]:.4f}",
+                                          model=model_type, target=target_col, target_index=i + 1,
+                                          n_targets=len(target_columns), n_folds=cv_folds, score=cv_scores[target_col])
+                        except Exception as cv_error:
+                            reporter.emit('cv', f"目标{target_col}的CV计算失败: {cv_error}",
+                                          model=model_type, target=target_col, target_index=i + 1,
+                                          n_targets=len(target_columns))
+                            cv_scores[target_col] = 0.0
+                    reporter.emit('cv_done', None, advance=True, model=model_type)
             except Exception as e:
                 print(f"交叉验证过程出错: {e}")
                 # 如果CV失败，使用验证集的MSE作为替代
@@ -288,6 +359,11 @@ class MachineLearningService:
                 'feature_columns': feature_columns,
                 'target_columns': target_columns,
                 'params': best_params,
+                'fit_mode': fit_mode,
+                'search': search_info,
+                'early_stopping': early_stopping_info,
+                # 验证集划分参数，继续训练时使用相同的划分
+                'split': {'test_size': params.get('test_size', 0.2), 'random_state': random_state},
                 'training_time': datetime.now().isoformat(),
                 'data_shape': train_data.shape
             }
@@ -304,6 +380,9 @@ class MachineLearningService:
                     'feature_columns': feature_columns,
                     'target_columns': target_columns,
                     'params': best_params,
+                    'fit_mode': fit_mode,
+                    'search': search_info,
+                    'early_stopping': early_stopping_info,
                     'training_time': datetime.now().isoformat(),
                     'data_shape': list(train_data.shape)
                 },
@@ -317,7 +396,7 @@ class MachineLearningService:
                 'best_params': best_params
             }
             
-            print(f"模型{model_id}训练完成，返回结果")
+            reporter.emit('done', f"模型{model_id}训练完成，返回结果", model=model_type)
             return result
             
         except Exception as e:
@@ -326,6 +405,114 @@ class MachineLearningService:
             print(f"训练异常: {error_msg}")
             print(f"详细错误: {traceback.format_exc()}")
             return {'success': False, 'message': error_msg}
+        finally:
+            store.close()
+    
+    def continue_training(self, model_info, train_data, params, reporter=None):
+        """在已有模型的基础上继续训练，结果作为新版本的模型返回(结构与train_model相同)
+        
+        随机森林、GBR、HGB和MLP使用warm_start，XGBoost以原booster继续提升，只计算新增的树或轮次。
+        params['model_params']中n_estimators为新的总树数(HGB为max_iter；MLP的max_iter为继续训练的轮数)。
+        train_data可以是追加了新行的数据集，先用原模型的预处理流水线变换，再按与训练时
+        相同的方式划分训练集和验证集。继续训练不重新做交叉验证，只计算训练集和验证集指标。
+        """
+        reporter = reporter or ProgressReporter()
+        store = SharedFeatureStore()
+        try:
+            model_type = model_info.get('model_type')
+            model = model_info['model']
+            if model_type not in self.models or not supports_warm_start(model):
+                return {'success': False, 'message': f'模型类型{model_type}不支持继续训练'}
+            
+            feature_columns = model_info['feature_columns']
+            target_columns = model_info['target_columns']
+            model_params = self._validate_model_params(model_type, params.get('model_params', {}))
+            reporter.set_total(1)
+            reporter.emit('start', f"继续训练模型: {model_type}, 参数: {model_params}", model=model_type)
+            
+            train_data = self.apply_preprocessing(model_info, train_data, params.get('applied_pipeline_id'))
+            X = train_data[feature_columns]
+            y = train_data[target_columns]
+            X_train, X_val, y_train, y_val = self._validation_split(X, y, model_info.get('split', params))
+            X_train = store.share(X_train, feature_dtype(self.models[model_type]['class']), 'X_train')
+            
+            if len(target_columns) == 1:
+                Y_train = y_train.iloc[:, 0].to_numpy(dtype=np.float64)
+            else:
+                Y_train = y_train.to_numpy(dtype=np.float64)
+            reporter.emit('fit', f"训练集大小: {X_train.shape}, 验证集大小: {X_val.shape}", model=model_type)
+            continued = continue_fit(model, X_train, Y_train, model_params)
+            reporter.emit('fit_done', "继续训练完成，计算指标...", advance=True, model=model_type)
+            
+            y_train_pred = predict_targets(continued, X_train, target_columns)
+            y_val_pred = predict_targets(continued, X_val, target_columns)
+            train_metrics = {
+                target_col: self._calculate_metrics(y_train[target_col], y_train_pred[target_col])
+                for target_col in target_columns
+            }
+            val_metrics = {
+                target_col: self._calculate_metrics(y_val[target_col], y_val_pred[target_col])
+                for target_col in target_columns
+            }
+            
+            model_id = str(uuid.uuid4())
+            best_params = {**(model_info.get('params') or {}), **model_params}
+            version = model_info.get('version', 1) + 1
+            lineage = {
+                'parent_model_id': params.get('model_id'),
+                'version': version,
+                'continued_params': model_params
+            }
+            model_info_storage = {
+                'model': continued,
+                'model_type': model_type,
+                'model_name': model_info['model_name'],
+                'feature_columns': feature_columns,
+                'target_columns': target_columns,
+                'params': best_params,
+                'fit_mode': model_info.get('fit_mode'),
+                'split': model_info.get('split'),
+                # 新版本沿用原模型的预处理流水线
+                'preprocessing': model_info.get('preprocessing'),
+                **lineage,
+                'training_time': datetime.now().isoformat(),
+                'data_shape': train_data.shape
+            }
+            result = {
+                'success': True,
+                'message': f'{model_info["model_name"]} 继续训练完成 (版本{version})',
+                'model_id': model_id,
+                'model': model_info_storage,  # 这个会在app.py中被移除
+                'model_info': {
+                    'model_type': model_type,
+                    'model_name': model_info['model_name'],
+                    'feature_columns': feature_columns,
+                    'target_columns': target_columns,
+                    'params': best_params,
+                    'fit_mode': model_info.get('fit_mode'),
+                    **lineage,
+                    'training_time': datetime.now().isoformat(),
+                    'data_shape': list(train_data.shape)
+                },
+                'metrics': {
+                    'train': train_metrics,
+                    'validation': val_metrics
+                },
+                'feature_columns': feature_columns,
+                'target_columns': target_columns,
+                'best_params': best_params
+            }
+            reporter.emit('done', f"模型{model_id}(版本{version})继续训练完成", model=model_type)
+            return result
+            
+        except Exception as e:
+            import traceback
+            error_msg = f'继续训练失败: {str(e)}'
+            print(f"继续训练异常: {error_msg}")
+            print(f"详细错误: {traceback.format_exc()}")
+            return {'success': False, 'message': error_msg}
+        finally:
+            store.close()
     
     def predict(self, model_info, test_data, params):
         """Make predictions with trained model"""
@@ -335,24 +522,14 @@ class MachineLearningService:
             target_columns = model_info['target_columns']
             
             # Prepare test data
+            test_data = self.apply_preprocessing(model_info, test_data, params.get('applied_pipeline_id'))
             X_test = test_data[feature_columns]
             
-            # Make predictions
-            if len(target_columns) == 1:
-                # Single target
-                predictions = model.predict(X_test)
-                predictions_df = pd.DataFrame(
-                    predictions,
-                    columns=[f'{target_columns[0]}_predicted']
-                )
-            else:
-                # Multiple targets
-                predictions_dict = {}
-                for target_col in target_columns:
-                    pred = model[target_col].predict(X_test)
-                    predictions_dict[f'{target_col}_predicted'] = pred
-                
-                predictions_df = pd.DataFrame(predictions_dict)
+            # Make predictions - 多输出模型一次predict得到所有目标列
+            predictions = predict_targets(model, X_test, target_columns)
+            predictions_df = pd.DataFrame({
+                f'{target_col}_predicted': predictions[target_col] for target_col in target_columns
+            })
             
             # Combine with original test data if requested
             if params.get('include_features', False):
@@ -381,25 +558,16 @@ class MachineLearningService:
             target_columns = model_info['target_columns']
             
             # Prepare test data
+            test_data = self.apply_preprocessing(model_info, test_data, params.get('applied_pipeline_id'))
             X_test = test_data[feature_columns]
             y_test = test_data[target_columns]
             
             # Make predictions
-            if len(target_columns) == 1:
-                # Single target
-                y_pred = model.predict(X_test)
-                metrics = self._calculate_metrics(y_test.iloc[:, 0], y_pred)
-                
-                evaluation_result = {
-                    target_columns[0]: metrics
-                }
-            else:
-                # Multiple targets
-                evaluation_result = {}
-                for target_col in target_columns:
-                    y_pred = model[target_col].predict(X_test)
-                    metrics = self._calculate_metrics(y_test[target_col], y_pred)
-                    evaluation_result[target_col] = metrics
+            predictions = predict_targets(model, X_test, target_columns)
+            evaluation_result = {
+                target_col: self._calculate_metrics(y_test[target_col], predictions[target_col])
+                for target_col in target_columns
+            }
             
             return {
                 'success': True,
@@ -417,21 +585,38 @@ class MachineLearningService:
         except Exception as e:
             return {'success': False, 'message': f'模型评估失败: {str(e)}'}
     
-    def save_model(self, model_info, file_path):
-        """Save trained model to file"""
-        try:
-            joblib.dump(model_info, file_path)
-            return {'success': True, 'message': f'模型已保存到 {file_path}'}
-        except Exception as e:
-            return {'success': False, 'message': f'保存模型失败: {str(e)}'}
+    def apply_preprocessing(self, model_info, data, applied_pipeline_id=None):
+        """用模型训练时的预处理流水线变换新数据(只重放，不重新拟合)"""
+        pipeline = model_info.get('preprocessing')
+        if pipeline is None:
+            return data
+        return pipeline.replay(data, applied_pipeline_id)
     
-    def load_model(self, file_path):
-        """Load trained model from file"""
-        try:
-            model_info = joblib.load(file_path)
-            return {'success': True, 'model': model_info, 'message': f'模型已从 {file_path} 加载'}
-        except Exception as e:
-            return {'success': False, 'message': f'加载模型失败: {str(e)}'}
+    def _fit_early_stopping(self, estimator, X_train, y_train, X_val, y_val, rounds, target_columns, cache_context):
+        """用验证集提前停止拟合提升模型，返回 (模型, {目标列: 提前停止信息})"""
+        # 验证集转换成与训练矩阵相同的类型，XGBoost要求两者的特征名一致
+        X_val = np.asarray(X_val, dtype=X_train.dtype)
+        y_val = np.asarray(y_val, dtype=np.float64)
+        key = self.fit_cache.fit_key(estimator, X_train, y_train, validation=[X_val, y_val],
+                                     early_stopping_rounds=rounds, **cache_context)
+        model, info = self.fit_cache.fetch(
+            key, lambda: fit_early_stopping(estimator, X_train, y_train, X_val, y_val, rounds)
+        )
+        if isinstance(info, list):
+            # 按目标列拟合时每个目标列各自停止
+            return model, dict(zip(target_columns, info))
+        return model, {target_col: info for target_col in target_columns}
+    
+    def _validation_split(self, X, y, params):
+        """按训练参数划分训练集和验证集；继续训练时使用相同的划分"""
+        # 对于大数据集，减少验证集比例以提高训练效率
+        data_size = len(X)
+        if data_size > 10000:
+            test_size = min(0.15, params.get('test_size', 0.2))  # 大数据集使用更小的验证集
+            print(f"大数据集检测到({data_size}条)，调整验证集比例为{test_size}")
+        else:
+            test_size = params.get('test_size', 0.2)
+        return train_test_split(X, y, test_size=test_size, random_state=params.get('random_state', 42))
     
     def _calculate_metrics(self, y_true, y_pred):
         """Calculate regression metrics"""
@@ -482,6 +667,58 @@ class MachineLearningService:
         
         return default_params
     
+    def _build_search(self, model_type, validated_params, params, cv_folds):
+        """创建超参数搜索: search_method为'grid'时展开完整参数网格，默认使用TPE
+        
+        TPE在TPE_SPACES的连续/对数尺度范围内搜索，用户指定的模型参数固定不搜索；
+        n_trials为试验次数上限，time_budget为时间预算(秒)。
+        """
+        model_class = self.models[model_type]['class']
+        if params.get('search_method', 'tpe') == 'grid':
+            print("使用网格搜索优化参数...")
+            print(f"使用{cv_folds}折交叉验证")
+            return GridSearchCV(
+                model_class(),
+                self._get_grid_search_params(model_type, validated_params),
+                cv=cv_folds,
+                scoring='neg_mean_squared_error',
+                n_jobs=-1,
+                verbose=1  # 显示进度
+            )
+        
+        search_space = {key: spec for key, spec in TPE_SPACES[model_type].items() if key not in validated_params}
+        n_trials = int(params.get('n_trials', 30))
+        time_budget = params.get('time_budget')
+        print(f"使用TPE优化参数: 最多{n_trials}次试验, 时间预算={time_budget}, {cv_folds}折交叉验证")
+        return TPESearchCV(
+            model_class(**validated_params),
+            search_space,
+            n_trials=n_trials,
+            time_budget=float(time_budget) if time_budget else None,
+            cv=cv_folds,
+            n_jobs=-1
+        )
+    
+    def _search_info(self, search, per_target_trials=None):
+        """超参数搜索的方式和试验记录，用于返回给前端"""
+        if isinstance(search, TPESearchCV):
+            info = {'method': 'tpe', 'n_trials': search.n_trials, 'time_budget': search.time_budget}
+            if per_target_trials is not None:
+                info['trials'] = per_target_trials
+            else:
+                info['trials'] = search.trials_
+                info['best_trial'] = search.best_index_ + 1
+            return info
+        return {'method': 'grid'}
+    
+    def _route_large_data(self, model_type, model_params, data_size):
+        """按LARGE_DATA_ROUTES替换大数据集上的模型并换算参数名，替换后模型不支持的参数在验证时忽略"""
+        routed_type = large_data_model(model_type, data_size)
+        if routed_type == model_type:
+            return model_type, model_params
+        print(f"大数据集检测到({data_size}条)，{model_type}改用{routed_type}")
+        return routed_type, large_data_params(model_type, model_params)
+    
     def _optimize_params_for_large_data(self, model_type, params, data_size):
         """优化大数据集的模型参数以提高训练效率"""
         optimized_params = params.copy()
@@ -495,36 +732,18 @@ class MachineLearningService:
                     optimized_params['max_depth'] = 15
                 optimized_params['n_jobs'] = -1  # 使用所有CPU核心
             
-        elif model_type == 'GradientBoosting':
-            # 梯度提升：减少估计器数量，增加学习率
-            if data_size > 20000:
-                if 'n_estimators' not in optimized_params or optimized_params['n_estimators'] > 50:
-                    optimized_params['n_estimators'] = 50
-                if 'learning_rate' not in optimized_params:
-                    optimized_params['learning_rate'] = 0.15  # 稍微增加学习率
-                if 'max_depth' not in optimized_params:
-                    optimized_params['max_depth'] = 5
-                    
         elif model_type == 'XGBoost':
-            # XGBoost：优化参数
+            # XGBoost：树数由验证集提前停止决定，只使用更快的直方图方法
             if data_size > 20000:
-                if 'n_estimators' not in optimized_params or optimized_params['n_estimators'] > 50:
-                    optimized_params['n_estimators'] = 50
-                if 'learning_rate' not in optimized_params:
-                    optimized_params['learning_rate'] = 0.15
                 if 'max_depth' not in optimized_params:
                     optimized_params['max_depth'] = 5
                 optimized_params['n_jobs'] = -1
                 optimized_params['tree_method'] = 'hist'  # 使用更快的直方图方法
                 
-        elif model_type == 'SVR':
-            # SVR：对大数据集添加缓存限制
-            if data_size > 20000:
-                optimized_params['cache_size'] = 2000  # 限制缓存大小
-                if 'C' not in optimized_params:
-                    optimized_params['C'] = 1.0  # 使用默认C值
-                if 'gamma' not in optimized_params:
-                    optimized_params['gamma'] = 'scale'
+        elif model_type == 'ApproximateSVR':
+            # 近似核SVR：超大数据集上使用更多的映射维度，仍与行数成线性关系
+            if data_size > 100000 and 'n_components' not in optimized_params:
+                optimized_params['n_components'] = 1000
                     
         elif model_type == 'MLP':
             # MLP：减少最大迭代次数，早停
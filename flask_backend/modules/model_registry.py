@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+import joblib
+
+
+class ModelRegistry:
+    """训练好的模型注册表
+
+    每个模型保存为 models/<model_id>.pkl，并附带同名的JSON元数据文件。启动时只读取元数据
+    建立索引，不反序列化模型；模型在第一次预测/评估时才从磁盘加载。驻留内存的模型按LRU
+    顺序管理，总大小(以模型文件大小估计)超过内存预算时卸载最久未使用的模型，下次访问时
+    再重新加载。模型列表直接由索引生成，模型数量很多时也不需要加载任何模型。
+    """
+
+    INFO_SUFFIX = '.json'
+    MODEL_SUFFIX = '.pkl'
+    # 元数据中保存的模型信息字段
+    INFO_FIELDS = ('model_name', 'model_type', 'training_time', 'feature_columns', 'target_columns',
+                   'dataset_id', 'parent_model_id', 'version')
+
+    def __init__(self, models_dir, memory_budget):
+        self.models_dir = Path(models_dir)
+        self.memory_budget = memory_budget
+        self.models_dir.mkdir(parents=True, exist_ok=True)
+        self._models = OrderedDict()  # model_id -> 模型信息(包含模型对象)，按最近使用排序
+        self._entries = {}  # model_id -> 元数据
+        self._lock = threading.RLock()
+        self._load_index()
+
+    def __contains__(self, model_id):
+        with self._lock:
+            return model_id in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def put(self, model_id, model_info):
+        """注册模型并保存到磁盘，返回模型文件路径
+
+        model_info包含模型对象和训练时使用的预处理流水线，整体保存在一个文件中。
+        模型先加入内存，保存失败时抛出异常，该模型留在内存中不会被卸载。
+        """
+        with self._lock:
+            entry = {field: model_info.get(field) for field in self.INFO_FIELDS}
+            entry.update({
+                'model_id': model_id,
+                'nbytes': 0,
+                'persisted': False,
+                'registered_at': datetime.now().isoformat()
+            })
+            self._entries[model_id] = entry
+            self._models[model_id] = model_info
+            self._models.move_to_end(model_id)
+
+            model_path = self.model_path(model_id)
+            joblib.dump(model_info, model_path)
+            entry['nbytes'] = os.path.getsize(model_path)
+            entry['persisted'] = True
+            self._write_info(model_id)
+            self._enforce_budget()
+            return str(model_path)
+
+    def get(self, model_id):
+        """获取模型信息(包含模型对象)，已卸载的模型从磁盘重新加载；不存在时返回None"""
+        with self._lock:
+            if model_id not in self._entries:
+                return None
+            if model_id in self._models:
+                self._models.move_to_end(model_id)
+                return self._models[model_id]
+
+            print(f"从磁盘加载模型: {model_id}")
+            model_info = joblib.load(self.model_path(model_id))
+            entry = self._entries[model_id]
+            if entry.get('model_type') is None:
+                # 没有元数据文件的旧模型文件，加载后补写元数据
+                entry.update({field: model_info[field] for field in self.INFO_FIELDS
+                              if model_info.get(field) is not None})
+                self._write_info(model_id)
+            self._models[model_id] = model_info
+            self._enforce_budget()
+            return model_info
+
+    def info(self, model_id):
+        """获取模型元数据，不加载模型"""
+        with self._lock:
+            entry = self._entries.get(model_id)
+            return dict(entry) if entry is not None else None
+
+    def list_models(self):
+        """列出所有已注册的模型，按训练时间从新到旧排序"""
+        with self._lock:
+            entries = [dict(entry, in_memory=model_id in self._models) for model_id, entry in self._entries.items()]
+        return sorted(entries, key=lambda entry: entry.get('training_time') or '', reverse=True)
+
+    def model_path(self, model_id):
+        return self.models_dir / f'{model_id}{self.MODEL_SUFFIX}'
+
+    def memory_usage(self):
+        """当前驻留内存的模型占用字节数(按模型文件大小估计)"""
+        with self._lock:
+            return sum(self._entries[model_id]['nbytes'] for model_id in self._models)
+
+    def _enforce_budget(self):
+        # 至少保留最近使用的一个模型在内存中，未能保存到磁盘的模型不卸载
+        for model_id in list(self._models)[:-1]:
+            if self.memory_usage() <= self.memory_budget:
+                break
+            if not self._entries[model_id]['persisted']:
+                continue
+            del self._models[model_id]
+            print(f"模型 {model_id} 超出内存预算，已从内存卸载")
+
+    def _write_info(self, model_id):
+        with open(self.models_dir / f'{model_id}{self.INFO_SUFFIX}', 'w', encoding='utf-8') as f:
+            json.dump(self._entries[model_id], f, ensure_ascii=False, default=str)
+
+    def _load_index(self):
+        """启动时索引models目录中的模型文件，只读取元数据，不加载模型"""
+        for model_path in self.models_dir.glob(f'*{self.MODEL_SUFFIX}'):
+            model_id = model_path.stem
+            stat = model_path.stat()
+            entry = None
+            info_path = self.models_dir / f'{model_id}{self.INFO_SUFFIX}'
+            if info_path.exists():
+                try:
+                    with open(info_path, 'r', encoding='utf-8') as f:
+                        entry = json.load(f)
+                except (OSError, ValueError):
+                    entry = None
+            if entry is None:
+                # 没有元数据文件的模型文件，第一次加载时补写元数据
+                entry = {field: None for field in self.INFO_FIELDS}
+                entry['training_time'] = datetime.fromtimestamp(stat.st_mtime).isoformat()
+            entry.update({'model_id': model_id, 'nbytes': stat.st_size, 'persisted': True})
+            self._entries[model_id] = entry
+        if self._entries:
+            print(f"模型注册表已索引 {len(self._entries)} 个模型")
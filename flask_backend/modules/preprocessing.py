@@ -0,0 +1,242 @@
+import pandas as pd
+import numpy as np
+import threading
+import uuid
+from pathlib import Path
+import joblib
+
+
+class PreprocessingPipeline:
+    """已拟合的预处理流水线
+
+    在训练数据上拟合一次，保存缺失值填充值、标准化/归一化参数和异常值截断边界。
+    标准化与归一化合并为一个仿射变换 X * scale + shift，应用时在一个float矩阵上
+    依次原地完成填充、缩放和截断，预测新数据时直接复用，不再重新拟合。
+    """
+
+    METHOD_FILL = '填充缺失值'
+    METHOD_STANDARDIZE = '特征标准化'
+    METHOD_NORMALIZE = '特征归一化'
+    METHOD_OUTLIERS = '异常值处理'
+
+    def __init__(self, methods=None, fill_method='均值填充', fixed_value=0.0, outlier_method='IQR', previous=None):
+        self.methods = list(methods or [])
+        self.fill_method = fill_method
+        self.fixed_value = fixed_value
+        self.outlier_method = outlier_method
+        # 链式预处理时，先应用上一次的流水线
+        self.previous = previous
+        self.pipeline_id = None
+
+    @classmethod
+    def from_params(cls, params, previous=None):
+        """由 /api/data/preprocess 的请求参数创建流水线"""
+        return cls(
+            methods=params.get('methods', []),
+            fill_method=params.get('fill_method', '均值填充'),
+            fixed_value=params.get('fixed_value', 0.0),
+            outlier_method=params.get('outlier_method', 'IQR'),
+            previous=previous
+        )
+
+    def fit(self, df):
+        """在训练数据上拟合各步骤的参数"""
+        self.numeric_columns = df.select_dtypes(include=[np.number]).columns.tolist()
+        self.other_columns = [col for col in df.columns if col not in self.numeric_columns]
+        X = df[self.numeric_columns].to_numpy(dtype=np.float64, copy=True)
+        n_cols = X.shape[1]
+
+        # 缺失值填充
+        self.fill_values = None
+        self.other_fill_values = {}
+        if self.METHOD_FILL in self.methods:
+            self.fill_values = self._fit_fill_values(df, X)
+            missing = np.isnan(X)
+            X[missing] = np.broadcast_to(self.fill_values, X.shape)[missing]
+            # 非数值列使用众数填充
+            for col in self.other_columns:
+                mode_value = df[col].mode()
+                if not mode_value.empty:
+                    self.other_fill_values[col] = mode_value[0]
+
+        # 标准化和归一化合并为仿射变换
+        self.scale = np.ones(n_cols)
+        self.shift = np.zeros(n_cols)
+        if self.METHOD_STANDARDIZE in self.methods:
+            mean = np.nanmean(X, axis=0) if len(X) else np.zeros(n_cols)
+            std = np.nanstd(X, axis=0) if len(X) else np.ones(n_cols)
+            std = np.where(std > 0, std, 1.0)  # 与StandardScaler一致，常数列不缩放
+            self._compose(1.0 / std, -mean / std)
+            X = X * self.scale + self.shift
+        if self.METHOD_NORMALIZE in self.methods:
+            data_min = np.nanmin(X, axis=0) if len(X) else np.zeros(n_cols)
+            data_range = (np.nanmax(X, axis=0) if len(X) else np.ones(n_cols)) - data_min
+            data_range = np.where(data_range > 0, data_range, 1.0)  # 与MinMaxScaler一致
+            self._compose(1.0 / data_range, -data_min / data_range)
+            X = (X - data_min) / data_range
+
+        # 异常值处理
+        self.clip_lower = None
+        self.clip_upper = None
+        self.zscore_mean = None
+        self.zscore_std = None
+        if self.METHOD_OUTLIERS in self.methods:
+            self._fit_outliers(X)
+
+        self.pipeline_id = str(uuid.uuid4())
+        return self
+
+    def transform(self, df, filter_rows=False, include_previous=True):
+        """应用流水线
+
+        filter_rows=True时按Z-Score删除异常行(仅用于预处理数据集，预测时不删行)；
+        include_previous=False时只应用本流水线自身的步骤。
+        """
+        if self.pipeline_id is None:
+            raise ValueError('预处理流水线尚未拟合')
+        if include_previous and self.previous is not None:
+            df = self.previous.transform(df, filter_rows=filter_rows)
+
+        missing_columns = [col for col in self.numeric_columns if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f'数据缺少预处理所需的列: {missing_columns}')
+
+        X = df[self.numeric_columns].to_numpy(dtype=np.float64, copy=True)
+
+        # 在同一个矩阵上原地完成填充、缩放和截断
+        if self.fill_values is not None:
+            np.copyto(X, np.broadcast_to(self.fill_values, X.shape), where=np.isnan(X))
+        X *= self.scale
+        X += self.shift
+        if self.clip_lower is not None:
+            np.clip(X, self.clip_lower, self.clip_upper, out=X)
+
+        # 用变换后的矩阵构造新的DataFrame，不修改传入的数据
+        transformed = pd.DataFrame(X, index=df.index, columns=self.numeric_columns)
+        others = df[[col for col in df.columns if col not in self.numeric_columns]]
+        result = pd.concat([transformed, others], axis=1)[list(df.columns)]
+        for col, value in self.other_fill_values.items():
+            if col in result.columns:
+                result[col] = result[col].fillna(value)
+
+        if filter_rows and self.zscore_mean is not None:
+            result = result[self._zscore_mask(X)]
+
+        return result
+
+    def replay(self, df, applied_pipeline_id=None):
+        """对新数据重放整条流水线链，跳过数据已经应用过的部分(applied_pipeline_id及之前)"""
+        chain = []
+        pipeline = self
+        while pipeline is not None:
+            chain.insert(0, pipeline)
+            pipeline = pipeline.previous
+
+        pipeline_ids = [pipeline.pipeline_id for pipeline in chain]
+        start = pipeline_ids.index(applied_pipeline_id) + 1 if applied_pipeline_id in pipeline_ids else 0
+        for pipeline in chain[start:]:
+            df = pipeline.transform(df, include_previous=False)
+        return df
+
+    def to_dict(self):
+        """JSON可序列化的流水线描述"""
+        info = {
+            'pipeline_id': self.pipeline_id,
+            'methods': self.methods,
+            'fill_method': self.fill_method,
+            'outlier_method': self.outlier_method,
+            'numeric_columns': [str(col) for col in getattr(self, 'numeric_columns', [])]
+        }
+        if self.previous is not None:
+            info['previous'] = self.previous.to_dict()
+        return info
+
+    def _compose(self, scale, shift):
+        # 在已有仿射变换之后再叠加 X * scale + shift
+        self.scale = self.scale * scale
+        self.shift = self.shift * scale + shift
+
+    def _fit_fill_values(self, df, X):
+        n_cols = X.shape[1]
+        if self.fill_method == '均值填充':
+            values = np.nanmean(X, axis=0) if len(X) else np.zeros(n_cols)
+        elif self.fill_method == '中位数填充':
+            values = np.nanmedian(X, axis=0) if len(X) else np.zeros(n_cols)
+        elif self.fill_method == '众数填充':
+            values = np.full(n_cols, np.nan)
+            for j, col in enumerate(self.numeric_columns):
+                mode_value = df[col].mode()
+                if not mode_value.empty:
+                    values[j] = mode_value[0]
+        elif self.fill_method == '固定值填充':
+            values = np.full(n_cols, float(self.fixed_value))
+        else:
+            values = np.full(n_cols, np.nan)
+        # 全为缺失的列无法计算填充值，保持缺失
+        return values
+
+    def _fit_outliers(self, X):
+        """根据处理方法拟合截断边界或Z-Score统计量，所有列一次计算"""
+        if self.outlier_method == 'IQR':
+            q1, q3 = _column_quantiles(X, [0.25, 0.75])
+            iqr = q3 - q1
+            self.clip_lower = q1 - 1.5 * iqr
+            self.clip_upper = q3 + 1.5 * iqr
+        elif self.outlier_method == 'Percentile':
+            self.clip_lower, self.clip_upper = _column_quantiles(X, [0.05, 0.95])
+        elif self.outlier_method == 'Z-Score':
+            self.zscore_mean = np.nanmean(X, axis=0)
+            self.zscore_std = np.nanstd(X, axis=0, ddof=1)
+
+    def _zscore_mask(self, X):
+        """所有列的|z|<3条件合并成一个行掩码；常数列(std=0)不参与过滤"""
+        std = self.zscore_std
+        valid = std > 0
+        z_scores = np.abs(X[:, valid] - self.zscore_mean[valid])
+        z_scores /= std[valid]
+        return (z_scores < 3).all(axis=1)
+
+
+def _column_quantiles(X, quantiles):
+    """按列计算分位数；没有缺失值时使用np.quantile在整个矩阵上一次分区完成"""
+    if len(X) == 0:
+        return np.full((len(quantiles), X.shape[1]), np.nan)
+    if np.isnan(X).any():
+        return np.nanquantile(X, quantiles, axis=0)
+    return np.quantile(X, quantiles, axis=0)
+
+
+class PipelineStore:
+    """派生数据集ID -> 生成该数据集的已拟合预处理流水线
+
+    流水线写入storage_dir，按需加载。派生数据集重启后由数据集注册表重新索引，
+    对应的流水线也随之恢复，复用已有的预处理结果训练时模型仍能带上流水线。
+    """
+
+    def __init__(self, storage_dir):
+        self.storage_dir = Path(storage_dir)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self._pipelines = {}
+        self._lock = threading.Lock()
+
+    def __setitem__(self, dataset_id, pipeline):
+        with self._lock:
+            joblib.dump(pipeline, self._path(dataset_id))
+            self._pipelines[dataset_id] = pipeline
+
+    def __contains__(self, dataset_id):
+        return self.get(dataset_id) is not None
+
+    def get(self, dataset_id, default=None):
+        if not dataset_id:
+            return default
+        with self._lock:
+            if dataset_id not in self._pipelines:
+                path = self._path(dataset_id)
+                if not path.exists():
+                    return default
+                self._pipelines[dataset_id] = joblib.load(path)
+            return self._pipelines[dataset_id]
+
+    def _path(self, dataset_id):
+        return self.storage_dir / f'{dataset_id}.pkl'
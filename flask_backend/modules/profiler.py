@@ -0,0 +1,231 @@
+import numpy as np
+import threading
+from collections import OrderedDict
+
+
+class DataProfiler:
+    """列统计计算器
+
+    将所有数值列拷贝到一个按列连续(Fortran顺序)的float64矩阵中，一次排序即可得到
+    count/min/max/分位数，同一矩阵上再算均值和标准差，避免对DataFrame反复调用
+    describe()/isnull()。结果按数据集版本号(dataset_id)缓存，重复预览和生成报表直接复用。
+
+    每个统计结果还保存可合并的中间量(计数、均值、二阶中心矩、极值和行样本)，追加数据时
+    只需统计新增的行再与原结果合并，不必重新扫描历史数据。行样本只在最近使用的max_samples个
+    版本中保留，追加得到新版本后基础版本的样本即丢弃；没有样本的版本追加数据时重新完整计算。
+    """
+
+    QUANTILES = (0.25, 0.5, 0.75)
+    STAT_NAMES = ('count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max')
+    # 用于合并后估计分位数的行样本大小，总行数不超过该值时分位数是精确的
+    SAMPLE_SIZE = 20000
+
+    def __init__(self, max_entries=32, max_samples=4):
+        self.max_entries = max_entries
+        self.max_samples = max_samples
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(0)
+
+    def profile(self, data, version=None):
+        """获取数据集的列统计，version相同时直接返回缓存结果"""
+        if version is not None:
+            with self._lock:
+                if version in self._cache:
+                    self._cache.move_to_end(version)
+                    return self._cache[version]
+
+        profile = self._compute(data)
+        self._store(version, profile)
+        return profile
+
+    def extend(self, base_data, base_version, new_rows, version, dtypes=None):
+        """追加数据后增量更新统计：只统计new_rows，再与base_version的结果合并"""
+        base = self.profile(base_data, base_version)
+        if base['_state']['sample'] is None:
+            # 行样本已释放，无法合并分位数，退回到完整计算
+            return None
+        new = self._compute(new_rows)
+        if new['numeric_columns'] != base['numeric_columns']:
+            # 数值列不一致时无法合并，退回到完整计算
+            return None
+
+        base_state, new_state = base['_state'], new['_state']
+        count = base_state['count'] + new_state['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = new_state['mean'] - base_state['mean']
+            weight = np.where(count > 0, new_state['count'] / np.maximum(count, 1), 0.0)
+            mean = np.where(base_state['count'] > 0,
+                            np.where(new_state['count'] > 0, base_state['mean'] + delta * weight, base_state['mean']),
+                            new_state['mean'])
+            m2 = (np.nan_to_num(base_state['m2']) + np.nan_to_num(new_state['m2'])
+                  + np.nan_to_num(delta) ** 2 * base_state['count'] * new_state['count'] / np.maximum(count, 1))
+
+        state = {
+            'count': count,
+            'mean': mean,
+            'm2': m2,
+            'min': np.fmin(base_state['min'], new_state['min']),
+            'max': np.fmax(base_state['max'], new_state['max']),
+            'n_rows': base['n_rows'] + new['n_rows'],
+            'sample': self._merge_samples(base_state, new_state)
+        }
+
+        profile = {
+            'n_rows': state['n_rows'],
+            'columns': base['columns'],
+            'numeric_columns': base['numeric_columns'],
+            'dtypes': dtypes if dtypes is not None else base['dtypes'],
+            'description': self._describe(base['numeric_columns'], state),
+            'missing_values': {
+                col: base['missing_values'][col] + new['missing_values'].get(col, 0)
+                for col in base['columns']
+            },
+            '_state': state
+        }
+        # 同一数据集后续只会在新版本上继续追加，基础版本不再需要行样本
+        base['_state']['sample'] = None
+        self._store(version, profile)
+        return profile
+
+    def invalidate(self, version):
+        """移除某个版本的缓存"""
+        with self._lock:
+            self._cache.pop(version, None)
+
+    def _store(self, version, profile):
+        if version is None:
+            return
+        with self._lock:
+            self._cache[version] = profile
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            # 行样本(最多SAMPLE_SIZE行 x 全部数值列)只保留在最近使用的max_samples个版本中
+            sampled = [cached for cached in self._cache.values() if cached['_state']['sample'] is not None]
+            for cached in sampled[:-self.max_samples]:
+                cached['_state']['sample'] = None
+
+    def _compute(self, data):
+        n_rows = len(data)
+        numeric_columns = data.select_dtypes(include=[np.number]).columns.tolist()
+
+        block = np.empty((n_rows, len(numeric_columns)), dtype=np.float64, order='F')
+        for j, col in enumerate(numeric_columns):
+            block[:, j] = data[col].to_numpy(dtype=np.float64, na_value=np.nan)
+
+        stats = self._numeric_stats(block)
+
+        if n_rows > self.SAMPLE_SIZE:
+            sample = block[np.sort(self._rng.choice(n_rows, self.SAMPLE_SIZE, replace=False))]
+        else:
+            sample = block.copy()
+        state = {
+            'count': stats['count'],
+            'mean': stats['mean'],
+            'm2': stats['m2'],
+            'min': stats['min'],
+            'max': stats['max'],
+            'n_rows': n_rows,
+            'sample': sample,
+            'quantiles': {name: stats[name] for name in self._quantile_names()}
+        }
+
+        missing_values = {}
+        numeric_positions = {col: j for j, col in enumerate(numeric_columns)}
+        for col in data.columns:
+            if col in numeric_positions:
+                missing_values[col] = int(n_rows - stats['count'][numeric_positions[col]])
+            else:
+                missing_values[col] = int(data[col].isna().sum())
+
+        return {
+            'n_rows': n_rows,
+            'columns': data.columns.tolist(),
+            'numeric_columns': numeric_columns,
+            'dtypes': {col: str(dtype) for col, dtype in data.dtypes.items()},
+            'description': self._describe(numeric_columns, state),
+            'missing_values': missing_values,
+            '_state': state
+        }
+
+    def _describe(self, numeric_columns, state):
+        """由中间量生成与DataFrame.describe()相同结构的统计结果"""
+        count = state['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.where(count > 1, np.sqrt(state['m2'] / (count - 1)), np.nan)
+        quantiles = state.get('quantiles')
+        if quantiles is None:
+            # 合并后的分位数由行样本估计
+            sample_stats = self._numeric_stats(state['sample'])
+            quantiles = {name: sample_stats[name] for name in self._quantile_names()}
+
+        stats = {
+            'count': count.astype(np.float64),
+            'mean': state['mean'],
+            'std': std,
+            'min': state['min'],
+            'max': state['max'],
+            **quantiles
+        }
+        return {
+            col: {name: float(stats[name][j]) for name in self.STAT_NAMES}
+            for j, col in enumerate(numeric_columns)
+        }
+
+    def _merge_samples(self, base_state, new_state):
+        """按两部分的行数比例合并行样本"""
+        n_base, n_new = base_state['n_rows'], new_state['n_rows']
+        base_sample, new_sample = base_state['sample'], new_state['sample']
+        total = n_base + n_new
+        if total <= self.SAMPLE_SIZE:
+            return np.concatenate([base_sample, new_sample])
+
+        take_base = min(len(base_sample), int(round(self.SAMPLE_SIZE * n_base / total)))
+        take_new = min(len(new_sample), self.SAMPLE_SIZE - take_base)
+        parts = [
+            sample[np.sort(self._rng.choice(len(sample), take, replace=False))]
+            for sample, take in ((base_sample, take_base), (new_sample, take_new))
+        ]
+        return np.concatenate(parts)
+
+    @classmethod
+    def _quantile_names(cls):
+        return [f'{int(q * 100)}%' for q in cls.QUANTILES]
+
+    @classmethod
+    def _numeric_stats(cls, block):
+        """在连续的float64矩阵上按列计算统计量，NaN视为缺失"""
+        n_rows, n_cols = block.shape
+        # np.sort将NaN排到末尾，前count个元素即为有效值
+        sorted_block = np.sort(block, axis=0)
+        count = n_rows - np.isnan(block).sum(axis=0)
+        has_values = count > 0
+        last = np.maximum(count - 1, 0)
+        cols = np.arange(n_cols)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sums = np.nansum(block, axis=0)
+            mean = np.where(has_values, sums / np.maximum(count, 1), np.nan)
+            centered = np.where(np.isnan(block), 0.0, block - mean)
+            m2 = (centered * centered).sum(axis=0)
+
+        stats = {
+            'count': count,
+            'mean': mean,
+            'm2': m2,
+            'min': np.where(has_values, sorted_block[0, cols] if n_rows else np.nan, np.nan),
+            'max': np.where(has_values, sorted_block[last, cols] if n_rows else np.nan, np.nan)
+        }
+
+        for q, name in zip(cls.QUANTILES, cls._quantile_names()):
+            # 与pandas一致的线性插值
+            position = last * q
+            lower = np.floor(position).astype(np.int64)
+            upper = np.ceil(position).astype(np.int64)
+            if n_rows:
+                value = sorted_block[lower, cols] + (sorted_block[upper, cols] - sorted_block[lower, cols]) * (position - lower)
+            else:
+                value = np.full(n_cols, np.nan)
+            stats[name] = np.where(has_values, value, np.nan)
+
+        return stats
@@ -0,0 +1,49 @@
+import time
+from datetime import datetime
+
+
+class ProgressReporter:
+    """训练进度事件
+
+    训练服务在各阶段调用emit()，生成包含阶段、目标列序号、模型名、折数、已用时间和
+    预计剩余时间(ETA)的结构化事件。事件同时打印到标准输出，并交给sink回调(异步任务中
+    由任务管理器转发到SSE接口)。set_total()设置总工作量后，advance=True的事件推进进度。
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.total = None
+        self.completed = 0
+        self.started = time.time()
+
+    def set_total(self, total):
+        """设置总工作量(例如 目标列数 x 模型数)"""
+        self.total = max(int(total), 1)
+        self.completed = 0
+
+    def emit(self, phase, message=None, advance=False, **fields):
+        """发送进度事件；fields可包含target/target_index/n_targets/model/fold/n_folds等"""
+        if advance:
+            self.completed += 1
+        elapsed = time.time() - self.started
+        progress = min(self.completed / self.total, 1.0) if self.total else None
+
+        event = {
+            'phase': phase,
+            'message': message,
+            'elapsed': round(elapsed, 2),
+            'progress': round(progress, 4) if progress is not None else None,
+            # 按已完成工作量的平均耗时估计剩余时间
+            'eta': round(elapsed * (1 - progress) / progress, 2) if progress else None,
+            'timestamp': datetime.now().isoformat()
+        }
+        event.update({key: value for key, value in fields.items() if value is not None})
+
+        if message:
+            print(message)
+        if self.sink is not None:
+            try:
+                self.sink(event)
+            except Exception as e:
+                print(f"进度事件发送失败: {e}")
+        return event
@@ -15,16 +15,20 @@ from reportlab.lib.units import inch
 import matplotlib.pyplot as plt
 import seaborn as sns
 import base64
+from .profiler import DataProfiler
 import warnings
 warnings.filterwarnings('ignore')
 
 class ReportService:
-    def __init__(self):
+    def __init__(self, profiler=None):
         self.reports_folder = 'reports'
+        # 列统计计算器，与数据处理服务共享时可复用数据预览已计算的统计结果
+        self.profiler = profiler or DataProfiler()
         os.makedirs(self.reports_folder, exist_ok=True)
         self.generated_reports = {}
     
-    def generate_report(self, train_data, test_data, model_info, training_history, params):
+    def generate_report(self, train_data, test_data, model_info, training_history, params,
+                        train_version=None, test_version=None):
         """Generate analysis report"""
         try:
             report_type = params.get('report_type', 'comprehensive')
@@ -37,7 +41,8 @@ class ReportService:
             
             # Collect report data
             report_data = self._collect_report_data(
-                train_data, test_data, model_info, training_history, params
+                train_data, test_data, model_info, training_history, params,
+                train_version=train_version, test_version=test_version
             )
             
             # Generate report content
@@ -119,7 +124,8 @@ class ReportService:
             'reports': sorted(reports, key=lambda x: x['timestamp'], reverse=True)
         }
     
-    def _collect_report_data(self, train_data, test_data, model_info, training_history, params):
+    def _collect_report_data(self, train_data, test_data, model_info, training_history, params,
+                             train_version=None, test_version=None):
         """Collect data for report generation"""
         data = {
             'timestamp': datetime.now().isoformat(),
@@ -137,20 +143,22 @@ class ReportService:
         
         # Data information
         if train_data is not None:
+            train_profile = self.profiler.profile(train_data, train_version)
             data['data_info']['train'] = {
                 'shape': train_data.shape,
-                'columns': train_data.columns.tolist(),
-                'numeric_columns': train_data.select_dtypes(include=[np.number]).columns.tolist(),
-                'missing_values': train_data.isnull().sum().to_dict(),
-                'basic_stats': train_data.describe().to_dict()
+                'columns': train_profile['columns'],
+                'numeric_columns': train_profile['numeric_columns'],
+                'missing_values': train_profile['missing_values'],
+                'basic_stats': train_profile['description']
             }
         
         if test_data is not None:
+            test_profile = self.profiler.profile(test_data, test_version)
             data['data_info']['test'] = {
                 'shape': test_data.shape,
-                'columns': test_data.columns.tolist(),
-                'numeric_columns': test_data.select_dtypes(include=[np.number]).columns.tolist(),
-                'missing_values': test_data.isnull().sum().to_dict()
+                'columns': test_profile['columns'],
+                'numeric_columns': test_profile['numeric_columns'],
+                'missing_values': test_profile['missing_values']
             }
         
         # Model information
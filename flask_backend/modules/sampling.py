@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+import joblib
+import numpy as np
+from sklearn.base import clone
+from .scheduler import estimate_fit_cost
+
+
+class StratifiedSampler:
+    """按目标值分位数分层的可复现抽样
+
+    AutoML的超参数搜索、机器学习训练的交叉验证评分、Stacking/AutoML的训练指标评估共用。
+    目标值按分位数分成n_strata层，各层按行数比例分配样本，层内用固定随机种子无放回抽样:
+    分数可以复现，目标分布稀疏的尾部也有足够的代表。多目标时按各目标列分位秩的均值分层。
+    抽样索引按目标值的内容哈希缓存在进程内，同一数据集上重复训练使用相同的样本，
+    相应的拟合也能命中拟合缓存。
+    """
+
+    def __init__(self, n_strata=10, random_state=42, max_entries=64):
+        self.n_strata = n_strata
+        self.random_state = random_state
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def indices(self, y, size):
+        """返回排好序的size个行号；size不小于行数时返回全部行"""
+        y = np.asarray(y, dtype=np.float64)
+        size = int(size)
+        if size >= len(y):
+            return np.arange(len(y))
+
+        key = (joblib.hash(y), size, self.n_strata, self.random_state)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        indices = self._draw(y, size)
+        with self._lock:
+            self._cache[key] = indices
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return indices
+
+    def size_for_budget(self, estimators, X, y, time_budget, n_workers=1, min_size=1000, max_size=None,
+                        probe_size=1000):
+        """在time_budget秒内能完成全部拟合的最大样本量
+
+        estimators为 [(估计器, 拟合次数), ...]。每个估计器先在probe_size行的分层样本上拟合一次计时，
+        再按estimate_fit_cost()随行数的增长外推(SVR约为平方增长，树模型约为 n·log n)，
+        二分查找 Σ 拟合次数 x 外推耗时 / n_workers 不超过time_budget的最大样本量。
+        """
+        n_rows = len(y)
+        max_size = min(int(max_size or n_rows), n_rows)
+        min_size = min(int(min_size), max_size)
+        probe = self.indices(y, min(probe_size, n_rows))
+        X_probe, y_probe = X[probe], np.asarray(y, dtype=np.float64)[probe]
+
+        rates = []
+        for estimator, n_fits in estimators:
+            started = time.time()
+            clone(estimator).fit(X_probe, y_probe)
+            seconds = time.time() - started
+            rates.append((estimator, n_fits, seconds / max(estimate_fit_cost(estimator, len(probe), X.shape[1]), 1e-12)))
+
+        def total_seconds(size):
+            return sum(n_fits * rate * estimate_fit_cost(estimator, size, X.shape[1])
+                       for estimator, n_fits, rate in rates) / max(n_workers, 1)
+
+        if total_seconds(max_size) <= time_budget:
+            return max_size
+        low, high = min_size, max_size
+        while low < high:
+            middle = (low + high + 1) // 2
+            if total_seconds(middle) <= time_budget:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def _draw(self, y, size):
+        if y.ndim == 1:
+            score = y
+        else:
+            # 多目标: 各目标列的分位秩取均值
+            score = np.mean([np.argsort(np.argsort(y[:, j], kind='stable'), kind='stable')
+                             for j in range(y.shape[1])], axis=0)
+        order = np.argsort(score, kind='stable')
+        strata = np.array_split(order, min(self.n_strata, size))
+
+        # 按层的行数比例分配样本量，最大余数法保证总数正好为size
+        quota = np.array([len(stratum) for stratum in strata]) * size / len(y)
+        allocation = np.floor(quota).astype(int)
+        remainder = size - allocation.sum()
+        allocation[np.argsort(-(quota - allocation), kind='stable')[:remainder]] += 1
+
+        rng = np.random.default_rng(self.random_state)
+        chosen = [rng.choice(stratum, count, replace=False) for stratum, count in zip(strata, allocation) if count > 0]
+        return np.sort(np.concatenate(chosen))
+
+
+# 进程内共享的抽样器，抽样索引缓存在各服务之间共用
+sampler = StratifiedSampler()
@@ -0,0 +1,276 @@
+import heapq
+import itertools
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from functools import partial
+import numpy as np
+from joblib.executor import get_memmapping_executor
+from .executor import core_budget, limit_n_jobs, _in_worker
+from .folds import _fit_fold
+
+
+# 调度器的每个worker只运行单线程拟合，BLAS/OpenMP线程数限制为1，进程数 x 线程数不超过预算
+_SINGLE_THREAD_ENV = {
+    name: '1' for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                           'VECLIB_MAXIMUM_THREADS', 'NUMBA_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+}
+
+
+def estimate_fit_cost(estimator, n_rows, n_features):
+    """估计一次拟合的相对成本，只用于排序
+
+    按各类算法的训练复杂度粗略估计，常数并不准确；FitScheduler会按每类模型实际的
+    拟合耗时校正。
+    """
+    name = type(estimator).__name__
+    params = estimator.get_params()
+    n = max(int(n_rows), 2)
+    p = max(int(n_features), 1)
+
+    if name in ('LinearRegression', 'Ridge', 'Lasso', 'ElasticNet'):
+        return n * p * p + p ** 3
+    if name in ('RandomForestRegressor', 'ExtraTreesRegressor'):
+        max_features = params.get('max_features')
+        if max_features == 'sqrt':
+            p_split = math.sqrt(p)
+        elif max_features == 'log2':
+            p_split = math.log2(p) + 1
+        elif isinstance(max_features, float):
+            p_split = max_features * p
+        elif isinstance(max_features, int):
+            p_split = max_features
+        else:
+            p_split = p
+        return (params.get('n_estimators') or 100) * n * math.log2(n) * max(p_split, 1)
+    if name == 'GradientBoostingRegressor':
+        return (params.get('n_estimators') or 100) * n * math.log2(n) * p * (params.get('subsample') or 1.0)
+    if name == 'HistGradientBoostingRegressor':
+        # 特征先分箱，每次迭代的直方图成本与 行数 x 特征数 成正比
+        return (params.get('max_iter') or 100) * n * p
+    if name == 'XGBRegressor':
+        # hist算法每棵树的成本约与 行数 x 特征数 成正比
+        return (params.get('n_estimators') or 100) * n * p * (params.get('max_depth') or 6) / 4
+    if name == 'SVR':
+        return n * n * p
+    if name == 'ApproximateSVR':
+        # 核特征映射 O(n·m·p) + 线性SVR在m维特征上的坐标下降
+        m = min(params.get('n_components') or 500, n)
+        return n * m * (p + 10)
+    if name == 'MLPRegressor':
+        layers = [p, *(params.get('hidden_layer_sizes') or (100,)), 1]
+        weights = sum(a * b for a, b in zip(layers, layers[1:]))
+        return (params.get('max_iter') or 200) * n * weights / 10
+    return n * p * 100
+
+
+class FitScheduler:
+    """AutoML的跨模型拟合调度器
+
+    各个 目标列 x 候选模型 的超参数搜索以步骤生成器(协议见folds.run_steps)的形式加入。
+    搜索每一步提交的 候选参数 x 折 被展开成单折拟合任务，与其他搜索的拟合、搜索结束后
+    最优参数的全量拟合放进同一个按估计成本排序的队列，由进程池从便宜到昂贵依次执行。
+    进程数为从core_budget预留的核心数，每个拟合单线程运行: 昂贵的SVR/MLP搜索不再独占
+    核心，便宜模型的搜索先完成，排行榜尽早可用。
+
+    估计成本由estimate_fit_cost()给出，并按每类模型已完成拟合的实际耗时(秒/成本)校正。
+    超过deadline后不再启动新的搜索拟合，未运行的候选视为未评估，搜索以已完成的部分
+    给出结果；已经开始的候选仍然完成其余各折(避免浪费已完成的拟合)，已完成搜索的全量
+    拟合也仍然执行，保证排行榜上的模型都可用。
+    """
+
+    def __init__(self, deadline=None, store=None):
+        self.deadline = deadline
+        # 搜索中途产生的非内存映射矩阵(例如逐次减半按行数截取的子集)通过store共享给worker
+        self.store = store
+        self.n_fits = 0
+        self.n_dropped = 0
+        self._queue = []
+        self._counter = itertools.count()
+        self._rates = {}
+        self._shared = {}
+
+    def add_search(self, steps, on_complete):
+        """加入一个搜索生成器；搜索结束时调用on_complete(result, error)
+
+        on_complete中可以调用submit()加入后续任务(例如最优参数的全量拟合)。
+        """
+        self._advance(_Search(steps, on_complete), None)
+
+    def submit(self, func, args, estimator, n_rows, n_features, on_done, droppable=False, on_start=None):
+        """加入一个任务func(*args)，完成后调用on_done(output, error)
+
+        estimator用于估计成本；droppable(布尔值或无参函数)为真的任务在超过deadline后
+        不再运行，on_done收到TimeoutError。on_start在任务开始运行时调用。
+        """
+        task = _Task(func, args, type(estimator).__name__, estimate_fit_cost(estimator, n_rows, n_features),
+                     on_done, droppable, on_start)
+        heapq.heappush(self._queue, (self._priority(task), next(self._counter), task))
+
+    def run(self):
+        """执行队列中的所有任务(包括执行过程中加入的任务)，直到队列为空"""
+        if not self._queue:
+            return
+        started = time.time()
+        if _in_worker():
+            self._run_serial()
+        else:
+            with core_budget.reserve() as cores:
+                if cores == 1:
+                    self._run_serial()
+                else:
+                    self._run_pool(cores)
+        print(f"调度器完成{self.n_fits}次拟合，跳过{self.n_dropped}次，用时{time.time() - started:.1f}秒")
+
+    def _run_serial(self):
+        while self._queue:
+            task = self._pop()
+            if task is None:
+                continue
+            try:
+                output, seconds = _timed(task.func, task.args)
+            except Exception as e:
+                self._finish(task, None, e)
+            else:
+                self._finish(task, output, None, seconds)
+
+    def _run_pool(self, cores):
+        print(f"调度器使用{cores}个进程，每个拟合单线程运行")
+        executor = get_memmapping_executor(cores, env=_SINGLE_THREAD_ENV)
+        running = {}
+        while self._queue or running:
+            while self._queue and len(running) < cores:
+                task = self._pop()
+                if task is not None:
+                    running[executor.submit(_timed, task.func, task.args)] = task
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    output, seconds = future.result()
+                except Exception as e:
+                    self._finish(task, None, e)
+                else:
+                    self._finish(task, output, None, seconds)
+
+    def _pop(self):
+        """取出估计耗时最少的任务；超过deadline的可跳过任务直接以TimeoutError结束"""
+        _, _, task = heapq.heappop(self._queue)
+        if self.deadline is not None and time.time() > self.deadline:
+            droppable = task.droppable() if callable(task.droppable) else task.droppable
+            if droppable:
+                self.n_dropped += 1
+                task.on_done(None, TimeoutError('超过AutoML时间预算，未运行'))
+                return None
+        if task.on_start is not None:
+            task.on_start()
+        return task
+
+    def _finish(self, task, output, error, seconds=None):
+        if error is None:
+            self.n_fits += 1
+            self._record(task, seconds)
+        task.on_done(output, error)
+
+    def _priority(self, task):
+        """估计耗时(秒): 成本 x 该类模型的 秒/成本；还没有该类模型的记录时使用已知比率的中位数"""
+        if task.family in self._rates:
+            return task.cost * self._rates[task.family]
+        if self._rates:
+            return task.cost * float(np.median(list(self._rates.values())))
+        return task.cost
+
+    def _record(self, task, seconds):
+        rate = seconds / max(task.cost, 1e-12)
+        first = task.family not in self._rates
+        self._rates[task.family] = rate if first else 0.5 * self._rates[task.family] + 0.5 * rate
+        if first:
+            # 第一次得到该类模型的实际耗时，队列中的优先级统一换算成秒
+            self._queue = [(self._priority(item), seq, item) for _, seq, item in self._queue]
+            heapq.heapify(self._queue)
+
+    def _advance(self, search, oof_predictions):
+        """把上一步的折外预测交给搜索生成器，并把下一步的 候选 x 折 拟合加入队列"""
+        try:
+            if oof_predictions is None:
+                request = next(search.steps)
+            else:
+                request = search.steps.send(oof_predictions)
+        except StopIteration as stop:
+            search.on_complete(stop.value, None)
+            return
+        except Exception as e:
+            search.on_complete(None, e)
+            return
+
+        engine, estimators, X, y = request
+        if not estimators:
+            self._advance(search, [])
+            return
+        X = self._share(X)
+        y = np.asarray(y)
+        folds = engine.split(len(X))
+        batch = _Batch(search, len(estimators), len(folds), y.shape)
+        for e, estimator in enumerate(estimators):
+            estimator = limit_n_jobs(estimator, 1)
+            for f, fold in enumerate(folds):
+                self.submit(_fit_fold, (estimator, X, y, fold), estimator, len(fold[0]), X.shape[1],
+                            partial(self._fold_done, batch, e, fold[1]),
+                            droppable=partial(batch.not_started, e), on_start=partial(batch.started.add, e))
+
+    def _fold_done(self, batch, e, test, output, error):
+        if error is None:
+            batch.oof[e][test] = np.asarray(output).reshape(batch.oof[e][test].shape)
+        else:
+            batch.failed.add(e)
+        batch.pending -= 1
+        if batch.pending == 0:
+            self._advance(batch.search, [None if e in batch.failed else oof for e, oof in enumerate(batch.oof)])
+
+    def _share(self, X):
+        if self.store is None or isinstance(X, np.memmap) or not isinstance(X, np.ndarray):
+            return X
+        key = id(X)
+        if key not in self._shared:
+            # 同时保存原矩阵的引用，避免id被回收后复用
+            self._shared[key] = (X, self.store.share(X, X.dtype, 'X_search'))
+        return self._shared[key][1]
+
+
+class _Search:
+    def __init__(self, steps, on_complete):
+        self.steps = steps
+        self.on_complete = on_complete
+
+
+class _Batch:
+    """搜索一步中提交的 候选 x 折 拟合，全部完成后组装成每个候选的折外预测"""
+
+    def __init__(self, search, n_estimators, n_folds, y_shape):
+        self.search = search
+        self.pending = n_estimators * n_folds
+        self.oof = [np.zeros(y_shape, dtype=np.float64) for _ in range(n_estimators)]
+        self.failed = set()
+        self.started = set()
+
+    def not_started(self, e):
+        return e not in self.started
+
+
+class _Task:
+    def __init__(self, func, args, family, cost, on_done, droppable, on_start):
+        self.func = func
+        self.args = args
+        self.family = family
+        self.cost = cost
+        self.on_done = on_done
+        self.droppable = droppable
+        self.on_start = on_start
+
+
+def _timed(func, args):
+    started = time.time()
+    output = func(*args)
+    return output, time.time() - started
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+# 这些估计器内部按float32训练，使用float32特征矩阵可避免worker中再做一次类型转换
+FLOAT32_ESTIMATORS = ('RandomForestRegressor', 'ExtraTreesRegressor', 'DecisionTreeRegressor', 'XGBRegressor')
+
+
+def feature_dtype(*estimators):
+    """所有估计器都以float32训练时返回float32，否则返回float64"""
+    names = [type(estimator).__name__ if not isinstance(estimator, type) else estimator.__name__
+             for estimator in estimators]
+    if names and all(name in FLOAT32_ESTIMATORS for name in names):
+        return np.float32
+    return np.float64
+
+
+class SharedFeatureStore:
+    """训练期间共享的特征矩阵
+
+    将DataFrame特征块按列写入临时目录中的连续.npy文件，再以只读内存映射方式打开。
+    joblib向worker分发np.memmap时只传递文件路径，GridSearchCV/cross_val_score/
+    StackingRegressor的各个并行任务共享同一份页缓存，不再逐个worker、逐个目标列pickle特征矩阵。
+    用作上下文管理器，退出时删除临时文件。
+    """
+
+    def __init__(self, temp_dir=None, min_bytes=1024 * 1024):
+        self.base_dir = temp_dir
+        # 小于该大小的矩阵直接留在内存中，pickle开销可以忽略
+        self.min_bytes = min_bytes
+        self.temp_dir = None
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def share(self, X, dtype=np.float64, name='X'):
+        """返回X的连续只读视图(np.memmap)"""
+        n_rows, n_cols = X.shape
+        dtype = np.dtype(dtype)
+        if n_rows * n_cols * dtype.itemsize < self.min_bytes:
+            if isinstance(X, pd.DataFrame):
+                return X.to_numpy(dtype=dtype)
+            return np.ascontiguousarray(X, dtype=dtype)
+
+        if self.temp_dir is None:
+            self.temp_dir = tempfile.mkdtemp(prefix='shared_features_', dir=self.base_dir)
+        path = os.path.join(self.temp_dir, f'{name}_{self._count}.npy')
+        self._count += 1
+
+        matrix = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n_rows, n_cols))
+        # 逐列写入，避免先在内存中构造一份完整的副本
+        if isinstance(X, pd.DataFrame):
+            for j in range(n_cols):
+                matrix[:, j] = X.iloc[:, j].to_numpy(dtype=dtype, na_value=np.nan)
+        else:
+            matrix[:] = X
+        matrix.flush()
+        del matrix
+
+        return np.load(path, mmap_mode='r')
+
+    def close(self):
+        """删除临时文件；已打开的内存映射在Linux上仍然有效直到被释放"""
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
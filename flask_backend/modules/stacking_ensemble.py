@@ -1,20 +1,28 @@
 import pandas as pd
 import numpy as np
 import uuid
+from functools import partial
 from datetime import datetime
-from sklearn.ensemble import StackingRegressor
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.svm import SVR
 from sklearn.neural_network import MLPRegressor
-from sklearn.model_selection import cross_val_score, KFold
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import xgboost as xgb
+from .shared_features import SharedFeatureStore, feature_dtype
+from .executor import core_budget, limit_n_jobs
+from .estimators import FoldStackingRegressor, ApproximateSVR, large_data_model
+from .folds import FoldEngine
+from .progress import ProgressReporter
+from .fit_cache import FitCache
+from .sampling import sampler
 import warnings
 warnings.filterwarnings('ignore')
 
 class StackingEnsembleService:
-    def __init__(self):
+    def __init__(self, fit_cache=None):
+        # 拟合结果缓存，与机器学习、AutoML服务共用
+        self.fit_cache = fit_cache or FitCache()
         # 与机器学习服务保持一致的模型配置
         self.base_models = {
             'LinearRegression': {
@@ -29,6 +37,10 @@ class StackingEnsembleService:
                 'name': 'GBR模型',
                 'model': GradientBoostingRegressor(n_estimators=100, random_state=42)
             },
+            'HistGradientBoosting': {
+                'name': '直方图梯度提升(HGB)',
+                'model': HistGradientBoostingRegressor(max_iter=200, random_state=42)
+            },
             'XGBoost': {
                 'name': 'XGBR模型',
                 'model': xgb.XGBRegressor(n_estimators=100, random_state=42)
@@ -37,6 +49,10 @@ class StackingEnsembleService:
                 'name': '支持向量机(SVR)',
                 'model': SVR(C=1.0, kernel='rbf')
             },
+            'ApproximateSVR': {
+                'name': '近似核SVR',
+                'model': ApproximateSVR(C=1.0, kernel='rbf')
+            },
             'MLP': {
                 'name': '人工神经网络(ANN)',
                 'model': MLPRegressor(hidden_layer_sizes=(100,), random_state=42, max_iter=500)
@@ -57,6 +73,10 @@ class StackingEnsembleService:
                 'name': 'GBR模型',
                 'model': GradientBoostingRegressor(n_estimators=50, random_state=42)
             },
+            'HistGradientBoosting': {
+                'name': '直方图梯度提升',
+                'model': HistGradientBoostingRegressor(max_iter=100, random_state=42)
+            },
             'XGBoost': {
                 'name': 'XGBR模型',
                 'model': xgb.XGBRegressor(n_estimators=50, random_state=42)
@@ -65,6 +85,10 @@ class StackingEnsembleService:
                 'name': '支持向量机',
                 'model': SVR(C=1.0, kernel='rbf')
             },
+            'ApproximateSVR': {
+                'name': '近似核SVR',
+                'model': ApproximateSVR(C=1.0, kernel='rbf', n_components=300)
+            },
             'MLP': {
                 'name': '人工神经网络',
                 'model': MLPRegressor(hidden_layer_sizes=(50,), random_state=42, max_iter=300)
@@ -91,14 +115,22 @@ class StackingEnsembleService:
             ]
         }
     
-    def train_stacking_ensemble(self, train_data, params):
-        """Train stacking ensemble model"""
+    def train_stacking_ensemble(self, train_data, params, reporter=None):
+        """Train stacking ensemble model
+        
+        特征矩阵在训练开始时转换一次并写入内存映射文件，所有目标列的Stacking拟合和
+        交叉验证共享该只读视图。各目标列通过core_budget并发训练。
+        reporter为ProgressReporter，用于发送结构化的进度事件。
+        """
+        reporter = reporter or ProgressReporter()
+        store = SharedFeatureStore()
         try:
-            print("开始Stacking集成训练...")
+            reporter.emit('start', "开始Stacking集成训练...", model='StackingEnsemble')
             
             # Prepare data
             target_columns = params.get('target_columns', train_data.columns[-3:].tolist())
-            feature_columns = [col for col in train_data.columns if col not in target_columns]
+            # 未指定特征列时使用目标列以外的所有列
+            feature_columns = params.get('feature_columns') or [col for col in train_data.columns if col not in target_columns]
             
             X = train_data[feature_columns]
             y = train_data[target_columns]
@@ -112,6 +144,12 @@ class StackingEnsembleService:
             meta_model_type = params.get('meta_model', 'LinearRegression')
             selected_base_models = params.get('base_models', ['LinearRegression'])
             
+            # 大数据集上GBR改用直方图梯度提升，SVR改用近似核SVR(基学习器和元学习器都在全部行上训练)
+            selected_base_models = list(dict.fromkeys(
+                large_data_model(name, data_size) for name in selected_base_models
+            ))
+            meta_model_type = large_data_model(meta_model_type, data_size)
+            
             # 对大数据集优化参数
             if data_size > 15000:
                 cv_folds = min(cv_folds, 3)  # 减少交叉验证折数
@@ -134,91 +172,47 @@ class StackingEnsembleService:
                 if name in optimized_base_models
             ]
             
-            print(f"构建了 {len(base_estimators)} 个基学习器")
+            # 每个目标列的Stacking拟合和交叉验证各算一步
+            reporter.set_total(2 * len(target_columns))
+            reporter.emit('prepare', f"构建了 {len(base_estimators)} 个基学习器", model='StackingEnsemble')
+            
+            # 所有目标列、所有并行拟合共享同一个连续的只读特征矩阵
+            X = store.share(X, feature_dtype(*[estimator for _, estimator in base_estimators], optimized_meta_model), 'X')
             
             results = {}
             models = {}
             
-            # Train stacking model for each target
+            # 各目标列的Stacking模型由共享执行器并发训练，核心在目标列之间分配
             for i, target_col in enumerate(target_columns):
-                print(f"训练目标 {i+1}/{len(target_columns)}: {target_col}")
-                
-                y_target = y[target_col] if len(target_columns) > 1 else y.iloc[:, 0]
-                
-                # Create stacking regressor with optimized parameters
-                stacking_model = StackingRegressor(
-                    estimators=base_estimators,
-                    final_estimator=optimized_meta_model,
-                    cv=cv_folds,
-                    n_jobs=-1,  # 使用所有CPU核心
-                    passthrough=False  # 不传递原始特征，减少计算量
-                )
-                
-                print(f"开始训练{target_col}的Stacking模型...")
-                # Train the model
-                stacking_model.fit(X, y_target)
+                reporter.emit('fit', f"训练目标 {i+1}/{len(target_columns)}: {target_col}", model='StackingEnsemble',
+                              target=target_col, target_index=i + 1, n_targets=len(target_columns), n_folds=cv_folds)
+            
+            def on_result(i, result):
+                target_col = target_columns[i]
+                stacking_model, metrics, cv_error = result
                 models[target_col] = stacking_model
-                print(f"{target_col}模型训练完成")
-                
-                print(f"开始{target_col}的交叉验证评估...")
-                # Cross-validation evaluation - 对大数据集进行优化
-                try:
-                    if data_size > 20000:
-                        # 对超大数据集进行采样评估
-                        sample_size = min(10000, data_size // 2)
-                        sample_indices = np.random.choice(len(X), sample_size, replace=False)
-                        X_sample = X.iloc[sample_indices]
-                        y_sample = y_target.iloc[sample_indices]
-                        print(f"大数据集采样评估: 使用{sample_size}样本")
-                        
-                        cv_scores = cross_val_score(
-                            stacking_model, X_sample, y_sample, 
-                            cv=cv_folds, scoring='neg_mean_squared_error',
-                            n_jobs=-1
-                        )
-                    else:
-                        cv_scores = cross_val_score(
-                            stacking_model, X, y_target, 
-                            cv=cv_folds, scoring='neg_mean_squared_error',
-                            n_jobs=-1
-                        )
-                    
-                    cv_score_mean = float(-cv_scores.mean())
-                    cv_score_std = float(cv_scores.std())
-                    print(f"{target_col}交叉验证完成，CV分数: {cv_score_mean:.4f}")
-                    
-                except Exception as cv_error:
-                    print(f"{target_col}交叉验证失败: {cv_error}")
-                    cv_score_mean = 0.0
-                    cv_score_std = 0.0
-                
-                print(f"计算{target_col}的训练指标...")
-                # Get predictions for training data - 对大数据集优化
-                if data_size > 30000:
-                    # 对超大数据集使用采样预测
-                    sample_size = min(5000, data_size // 4)
-                    sample_indices = np.random.choice(len(X), sample_size, replace=False)
-                    X_pred = X.iloc[sample_indices]
-                    y_true = y_target.iloc[sample_indices]
-                    y_pred = stacking_model.predict(X_pred)
-                    print(f"使用{sample_size}样本计算训练指标")
-                else:
-                    y_pred = stacking_model.predict(X)
-                    y_true = y_target
-                
-                # Calculate metrics
-                metrics = {
-                    'mse': float(mean_squared_error(y_true, y_pred)),
-                    'rmse': float(np.sqrt(mean_squared_error(y_true, y_pred))),
-                    'mae': float(mean_absolute_error(y_true, y_pred)),
-                    'r2': float(r2_score(y_true, y_pred)),
-                    'cv_score': cv_score_mean,
-                    'cv_std': cv_score_std
-                }
-                
                 results[target_col] = metrics
+                reporter.emit('fit_done', f"{target_col}模型训练完成", advance=True, model='StackingEnsemble',
+                              target=target_col, target_index=i + 1, n_targets=len(target_columns))
+                if cv_error is None:
+                    reporter.emit('cv', f"{target_col}交叉验证完成，CV分数: {metrics['cv_score']:.4f}", advance=True,
+                                  model='StackingEnsemble', target=target_col, target_index=i + 1,
+                                  n_targets=len(target_columns), n_folds=cv_folds, score=metrics['cv_score'])
+                else:
+                    reporter.emit('cv', f"{target_col}交叉验证失败: {cv_error}", advance=True,
+                                  model='StackingEnsemble', target=target_col, target_index=i + 1,
+                                  n_targets=len(target_columns))
                 print(f"{target_col}指标计算完成: R²={metrics['r2']:.4f}")
             
+            core_budget.map(
+                partial(self._fit_target, X, feature_columns, base_estimators, optimized_meta_model, cv_folds),
+                [(target_col, y[target_col] if len(target_columns) > 1 else y.iloc[:, 0]) for target_col in target_columns],
+                on_result=on_result
+            )
+            # 保持目标列顺序
+            models = {target_col: models[target_col] for target_col in target_columns}
+            results = {target_col: results[target_col] for target_col in target_columns}
+            
             print("生成模型结果...")
             # Generate unique model ID
             model_id = str(uuid.uuid4())
@@ -259,7 +253,7 @@ class StackingEnsembleService:
                 'target_columns': target_columns
             }
             
-            print(f"Stacking模型{model_id}训练完成")
+            reporter.emit('done', f"Stacking模型{model_id}训练完成", model='StackingEnsemble')
             return result
             
         except Exception as e:
@@ -268,45 +262,95 @@ class StackingEnsembleService:
             print(f"Stacking训练异常: {error_msg}")
             print(f"详细错误: {traceback.format_exc()}")
             return {'success': False, 'message': error_msg}
+        finally:
+            store.close()
+    
+    def _fit_target(self, X, feature_columns, base_estimators, meta_model, cv_folds, task, n_jobs):
+        """训练单个目标列的Stacking模型并计算交叉验证分数和训练指标
+        
+        由core_budget.map()调用，n_jobs为分配给该目标列的核心数。交叉验证分数来自训练时
+        元学习器的折外预测，不再对整个Stacking模型做外层交叉验证。
+        返回 (模型, 指标, 交叉验证错误信息)。
+        """
+        target_col, y_target = task
+        data_size = len(X)
+        
+        # 基学习器的K折拟合只做一次，元学习器的折外预测直接给出交叉验证分数
+        stacking_model = limit_n_jobs(FoldStackingRegressor(
+            estimators=base_estimators,
+            final_estimator=meta_model,
+            cv=cv_folds,
+            n_jobs=-1
+        ), n_jobs)
+        
+        print(f"开始训练{target_col}的Stacking模型...")
+        # Train the model(相同数据和配置训练过时直接使用缓存的模型)
+        stacking_model = self.fit_cache.fit(stacking_model, X, y_target,
+                                            feature_columns=feature_columns, target_columns=[target_col])
+        
+        cv_error = None
+        try:
+            cv_score_mean = float(stacking_model.cv_scores_.mean())
+            cv_score_std = float(stacking_model.cv_scores_.std())
+        except Exception as e:
+            cv_error = str(e)
+            cv_score_mean = 0.0
+            cv_score_std = 0.0
+        
+        print(f"计算{target_col}的训练指标...")
+        # Get predictions for training data - 对大数据集优化
+        if data_size > 30000:
+            # 对超大数据集使用采样预测
+            sample_size = min(5000, data_size // 4)
+            # 按目标值分层的可复现抽样，每次训练的指标可以比较
+            sample_indices = sampler.indices(y_target, sample_size)
+            X_pred = X[sample_indices]
+            y_true = y_target.iloc[sample_indices]
+            y_pred = stacking_model.predict(X_pred)
+            print(f"使用{sample_size}样本计算训练指标")
+        else:
+            y_pred = stacking_model.predict(X)
+            y_true = y_target
+        
+        # Calculate metrics
+        metrics = {
+            'mse': float(mean_squared_error(y_true, y_pred)),
+            'rmse': float(np.sqrt(mean_squared_error(y_true, y_pred))),
+            'mae': float(mean_absolute_error(y_true, y_pred)),
+            'r2': float(r2_score(y_true, y_pred)),
+            'cv_score': cv_score_mean,
+            'cv_std': cv_score_std
+        }
+        return stacking_model, metrics, cv_error
     
     def get_base_model_predictions(self, train_data, params):
         """Get individual base model predictions for analysis"""
         try:
             target_columns = params.get('target_columns', train_data.columns[-3:].tolist())
-            feature_columns = [col for col in train_data.columns if col not in target_columns]
+            # 未指定特征列时使用目标列以外的所有列
+            feature_columns = params.get('feature_columns') or [col for col in train_data.columns if col not in target_columns]
             
             X = train_data[feature_columns]
             y = train_data[target_columns]
             
             cv_folds = params.get('cv_folds', 5)
-            kf = KFold(n_splits=cv_folds, shuffle=True, random_state=42)
+            engine = FoldEngine(n_splits=cv_folds)
             
             results = {}
             
             for target_col in target_columns:
-                y_target = y[target_col] if len(target_columns) > 1 else y.iloc[:, 0]
+                y_target = (y[target_col] if len(target_columns) > 1 else y.iloc[:, 0]).to_numpy(dtype=np.float64)
                 target_results = {}
                 
-                for model_name, model_info in self.base_models.items():
-                    cv_predictions = np.zeros(len(X))
-                    cv_scores = []
-                    
-                    for train_idx, val_idx in kf.split(X):
-                        X_train_cv, X_val_cv = X.iloc[train_idx], X.iloc[val_idx]
-                        y_train_cv, y_val_cv = y_target.iloc[train_idx], y_target.iloc[val_idx]
-                        
-                        # Train model on CV fold
-                        model = model_info['model']
-                        model_copy = type(model)(**model.get_params())
-                        model_copy.fit(X_train_cv, y_train_cv)
-                        
-                        # Predict on validation set
-                        val_pred = model_copy.predict(X_val_cv)
-                        cv_predictions[val_idx] = val_pred
-                        
-                        # Calculate fold score
-                        fold_score = r2_score(y_val_cv, val_pred)
-                        cv_scores.append(fold_score)
+                # 所有基学习器的K折拟合在一次并行调用中完成
+                model_names = list(self.base_models)
+                oof_predictions = self.fit_cache.oof_predictions(
+                    engine, [self.base_models[name]['model'] for name in model_names], X, y_target, n_jobs=-1,
+                    feature_columns=feature_columns, target_columns=[target_col]
+                )
+                
+                for model_name, cv_predictions in zip(model_names, oof_predictions):
+                    cv_scores = engine.fold_scores(y_target, cv_predictions, metric=r2_score)
                     
                     # Calculate overall metrics
                     metrics = {
@@ -364,6 +408,15 @@ class StackingEnsembleService:
                     random_state=42
                 )
                 
+            elif model_name == 'HistGradientBoosting':
+                # 直方图梯度提升：不限制树数，由验证集提前停止决定
+                optimized_models[model_name] = HistGradientBoostingRegressor(
+                    max_iter=500 if data_size > 20000 else 300,
+                    learning_rate=0.1,
+                    early_stopping=True,
+                    random_state=42
+                )
+                
             elif model_name == 'XGBoost':
                 # XGBoost优化
                 n_estimators = 30 if data_size > 20000 else 50
@@ -377,12 +430,12 @@ class StackingEnsembleService:
                     tree_method='hist'  # 更快的训练方法
                 )
                 
-            elif model_name == 'SVR':
-                # SVR优化
-                optimized_models[model_name] = SVR(
-                    C=1.0, 
+            elif model_name == 'ApproximateSVR':
+                # 近似核SVR：训练时间与行数成线性关系
+                optimized_models[model_name] = ApproximateSVR(
+                    C=1.0,
                     kernel='rbf',
-                    cache_size=2000  # 限制缓存大小
+                    n_components=1000 if data_size > 100000 else 500
                 )
                 
             elif model_name == 'MLP':
@@ -427,6 +480,14 @@ class StackingEnsembleService:
                 random_state=42
             )
             
+        elif meta_model_type == 'HistGradientBoosting':
+            return HistGradientBoostingRegressor(
+                max_iter=100,
+                max_leaf_nodes=15,
+                early_stopping=True,
+                random_state=42
+            )
+            
         elif meta_model_type == 'XGBoost':
             n_estimators = 20 if data_size > 20000 else 30
             return xgb.XGBRegressor(
@@ -438,8 +499,8 @@ class StackingEnsembleService:
                 tree_method='hist'
             )
             
-        elif meta_model_type == 'SVR':
-            return SVR(C=1.0, kernel='rbf', cache_size=1000)
+        elif meta_model_type == 'ApproximateSVR':
+            return ApproximateSVR(C=1.0, kernel='rbf', n_components=300)
             
         elif meta_model_type == 'MLP':
             return MLPRegressor(
@@ -0,0 +1,268 @@
+import math
+import time
+import numpy as np
+from joblib import effective_n_jobs
+from sklearn.base import BaseEstimator, clone
+from sklearn.metrics import mean_squared_error
+from .folds import FoldEngine, run_steps
+
+
+# TPE搜索空间，覆盖MachineLearningService.models中的所有模型(AutoML使用相同的模型名)
+# ('float', 下界, 上界, 是否对数尺度) / ('int', 下界, 上界, 是否对数尺度) / ('choice', [候选值])
+TPE_SPACES = {
+    'LinearRegression': {
+        'fit_intercept': ('choice', [True, False]),
+        'positive': ('choice', [False, True])
+    },
+    'RandomForest': {
+        'n_estimators': ('int', 50, 400, True),
+        'max_depth': ('choice', [None, 6, 10, 16, 24, 32]),
+        'min_samples_split': ('int', 2, 20, True),
+        'min_samples_leaf': ('int', 1, 10, True),
+        'max_features': ('float', 0.3, 1.0, False)
+    },
+    'GradientBoosting': {
+        'n_estimators': ('int', 50, 400, True),
+        'learning_rate': ('float', 0.01, 0.3, True),
+        'max_depth': ('int', 2, 8, False),
+        'subsample': ('float', 0.6, 1.0, False)
+    },
+    'HistGradientBoosting': {
+        'max_iter': ('int', 50, 500, True),
+        'learning_rate': ('float', 0.01, 0.3, True),
+        'max_leaf_nodes': ('int', 15, 127, True),
+        'min_samples_leaf': ('int', 5, 100, True),
+        'l2_regularization': ('float', 1e-4, 10.0, True)
+    },
+    'XGBoost': {
+        'n_estimators': ('int', 50, 400, True),
+        'learning_rate': ('float', 0.01, 0.3, True),
+        'max_depth': ('int', 2, 10, False),
+        'subsample': ('float', 0.6, 1.0, False),
+        'colsample_bytree': ('float', 0.5, 1.0, False),
+        'min_child_weight': ('float', 1.0, 10.0, True),
+        'reg_lambda': ('float', 1e-3, 10.0, True)
+    },
+    'SVR': {
+        'C': ('float', 0.01, 1000.0, True),
+        'gamma': ('float', 1e-4, 1.0, True),
+        'epsilon': ('float', 1e-3, 1.0, True),
+        'kernel': ('choice', ['rbf', 'linear'])
+    },
+    'ApproximateSVR': {
+        'C': ('float', 0.01, 1000.0, True),
+        'gamma': ('float', 1e-4, 1.0, True),
+        'epsilon': ('float', 1e-3, 1.0, True),
+        'n_components': ('int', 100, 2000, True)
+    },
+    'MLP': {
+        'hidden_layer_sizes': ('choice', [(50,), (100,), (50, 50), (100, 50)]),
+        'activation': ('choice', ['relu', 'tanh']),
+        'alpha': ('float', 1e-5, 1e-1, True),
+        'learning_rate_init': ('float', 1e-4, 1e-2, True)
+    }
+}
+
+
+class TPESearchCV(BaseEstimator):
+    """基于TPE(Tree-structured Parzen Estimator)的超参数搜索，用法与GridSearchCV相同
+
+    前n_startup次试验随机采样，之后按已完成试验的分数把参数分为好(前gamma比例)和差两组，
+    分别用Parzen估计器(数值参数在[0,1]归一化尺度上的高斯核混合，类别参数为平滑后的频率)
+    建模，从好组的分布中采样候选并选择 l(x)/g(x) 最大的参数作为下一次试验。
+
+    每次试验的分数由FoldEngine的K折折外预测计算。每批同时提出多个试验，批内所有
+    试验 x 折 在同一个进程池调用中并行拟合(steps()把搜索写成生成器，AutoML用FitScheduler
+    调度同样的拟合)。超过time_budget(秒)后不再提出新的试验。
+    每次试验都记录在trials_中。search_space中没有的参数取estimator自身的值。
+    """
+
+    def __init__(self, estimator, search_space, n_trials=30, time_budget=None, cv=5, n_jobs=None,
+                 metric=mean_squared_error, greater_is_better=False, n_startup=None, gamma=0.25,
+                 n_ei_candidates=24, refit=True, random_state=42):
+        self.estimator = estimator
+        self.search_space = search_space
+        self.n_trials = n_trials
+        self.time_budget = time_budget
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.metric = metric
+        self.greater_is_better = greater_is_better
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.n_ei_candidates = n_ei_candidates
+        self.refit = refit
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        # 每批试验数使 试验数 x 折数 大致填满可用核心
+        batch_size = max(1, math.ceil(effective_n_jobs(self.n_jobs) / self.cv))
+        outcome = run_steps(self.steps(X, y, batch_size), self.n_jobs)
+        self.trials_ = outcome['trials']
+        self.best_params_ = outcome['best_params']
+        self.best_score_ = outcome['best_score']
+        self.best_index_ = outcome['best_index']
+        self.best_fold_scores_ = outcome['fold_scores']
+        self.best_oof_ = outcome['oof']
+        if self.refit:
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def steps(self, X, y, batch_size=1):
+        """搜索步骤生成器(协议见folds.run_steps)，每一步提出batch_size次试验
+
+        返回包含trials、best_params、best_score、best_index、fold_scores和oof的字典。
+        """
+        y = np.asarray(y, dtype=np.float64)
+        started = time.time()
+        rng = np.random.default_rng(self.random_state)
+        engine = FoldEngine(n_splits=self.cv, random_state=self.random_state)
+        n_startup = self.n_startup if self.n_startup is not None else min(10, max(2, self.n_trials // 3))
+
+        trials = []
+        best = None
+        while len(trials) < self.n_trials:
+            if trials and self.time_budget is not None and time.time() - started > self.time_budget:
+                print(f"TPE搜索达到时间预算，完成{len(trials)}次试验")
+                break
+            size = min(batch_size, self.n_trials - len(trials))
+            if len(trials) < n_startup:
+                batch = [self._sample_prior(rng) for _ in range(size)]
+            else:
+                batch = self._suggest(rng, size, trials)
+
+            batch_started = time.time()
+            oof_predictions = yield engine, [clone(self.estimator).set_params(**params) for params in batch], X, y
+            duration = (time.time() - batch_started) / len(batch)
+            for params, oof in zip(batch, oof_predictions):
+                outcome = self._score(engine, y, oof)
+                trial = {
+                    'trial': len(trials) + 1,
+                    'params': params,
+                    'score': outcome['score'],
+                    'cv_std': outcome['cv_std'],
+                    'duration': round(duration, 3),
+                    'state': outcome['state']
+                }
+                trials.append(trial)
+                if outcome['state'] == 'ok' and (best is None or outcome['score'] > best[0]['score']):
+                    best = (trial, outcome)
+
+        if best is None:
+            raise ValueError('所有TPE试验均失败')
+
+        best_trial, best_outcome = best
+        print(f"TPE搜索完成: {len(trials)}次试验，最优分数={best_trial['score']:.4f}，"
+              f"用时{time.time() - started:.1f}秒")
+        return {
+            'trials': trials,
+            'best_params': best_trial['params'],
+            'best_score': best_trial['score'],
+            'best_index': best_trial['trial'] - 1,
+            'fold_scores': best_outcome['fold_scores'],
+            'oof': best_outcome['oof']
+        }
+
+    def _score(self, engine, y, oof):
+        """由一次试验的折外预测计算分数；oof为None表示拟合失败(或超过截止时间未运行)"""
+        if oof is None:
+            return {'score': None, 'cv_std': None, 'state': 'failed'}
+        fold_scores = engine.fold_scores(y, oof, self.metric)
+        return {
+            'score': float(fold_scores.mean() if self.greater_is_better else -fold_scores.mean()),
+            'cv_std': float(fold_scores.std()),
+            'state': 'ok',
+            'fold_scores': fold_scores,
+            'oof': oof
+        }
+
+    def _sample_prior(self, rng):
+        return {name: self._from_unit(spec, rng.random()) if spec[0] != 'choice' else spec[1][rng.integers(len(spec[1]))]
+                for name, spec in self.search_space.items()}
+
+    def _suggest(self, rng, size, trials):
+        """从好组的Parzen分布中采样候选，返回 l(x)/g(x) 最大的size组参数"""
+        finished = list(trials)
+        # 失败的试验视为最差
+        losses = np.array([-trial['score'] if trial['state'] == 'ok' else np.inf for trial in finished])
+        order = np.argsort(losses, kind='stable')
+        n_good = max(1, int(math.ceil(self.gamma * len(finished))))
+        good = [finished[i]['params'] for i in order[:n_good]]
+        bad = [finished[i]['params'] for i in order[n_good:]] or good
+
+        n_candidates = self.n_ei_candidates * size
+        candidates = [{} for _ in range(n_candidates)]
+        log_ratio = np.zeros(n_candidates)
+        for name, spec in self.search_space.items():
+            if spec[0] == 'choice':
+                choices = spec[1]
+                good_weights = self._choice_weights(choices, [params[name] for params in good])
+                bad_weights = self._choice_weights(choices, [params[name] for params in bad])
+                picks = rng.choice(len(choices), size=n_candidates, p=good_weights)
+                for candidate, pick in zip(candidates, picks):
+                    candidate[name] = choices[pick]
+                log_ratio += np.log(good_weights[picks]) - np.log(bad_weights[picks])
+            else:
+                good_units = np.array([self._to_unit(spec, params[name]) for params in good])
+                bad_units = np.array([self._to_unit(spec, params[name]) for params in bad])
+                units = self._sample_parzen(rng, good_units, n_candidates)
+                for candidate, unit in zip(candidates, units):
+                    candidate[name] = self._from_unit(spec, unit)
+                log_ratio += np.log(self._parzen_density(units, good_units)) - np.log(self._parzen_density(units, bad_units))
+
+        suggestions = []
+        seen = [trial['params'] for trial in finished]
+        for index in np.argsort(-log_ratio, kind='stable'):
+            if candidates[index] not in seen:
+                suggestions.append(candidates[index])
+                seen.append(candidates[index])
+            if len(suggestions) == size:
+                break
+        # 离散空间已经穷尽时用随机参数补足
+        while len(suggestions) < size:
+            suggestions.append(self._sample_prior(rng))
+        return suggestions
+
+    @staticmethod
+    def _choice_weights(choices, values):
+        counts = np.array([sum(1 for value in values if value == choice) for choice in choices], dtype=np.float64)
+        return (counts + 1.0) / (counts.sum() + len(choices))
+
+    @staticmethod
+    def _bandwidth(n_points):
+        return max(0.03, 0.5 / math.sqrt(n_points + 1))
+
+    def _sample_parzen(self, rng, points, size):
+        """从 均匀先验 + 以points为中心的高斯核 的混合分布中采样，截断到[0,1]"""
+        sigma = self._bandwidth(len(points))
+        components = rng.integers(len(points) + 1, size=size)
+        samples = rng.random(size)
+        from_kernel = components < len(points)
+        samples[from_kernel] = rng.normal(points[components[from_kernel]], sigma)
+        return np.clip(samples, 0.0, 1.0)
+
+    def _parzen_density(self, x, points):
+        sigma = self._bandwidth(len(points))
+        kernels = np.exp(-0.5 * ((x[:, None] - points[None, :]) / sigma) ** 2) / (sigma * math.sqrt(2 * math.pi))
+        return (1.0 + kernels.sum(axis=1)) / (len(points) + 1)
+
+    @staticmethod
+    def _to_unit(spec, value):
+        kind, low, high, log = spec
+        if log:
+            return (math.log(value) - math.log(low)) / (math.log(high) - math.log(low))
+        return (value - low) / (high - low)
+
+    @staticmethod
+    def _from_unit(spec, unit):
+        kind, low, high, log = spec
+        if log:
+            value = math.exp(math.log(low) + unit * (math.log(high) - math.log(low)))
+        else:
+            value = low + unit * (high - low)
+        if kind == 'int':
+            return int(min(max(round(value), low), high))
+        return float(min(max(value, low), high))
@@ -9,6 +9,7 @@ import seaborn as sns
 import base64
 import io
 import json
+from .estimators import predict_targets, target_estimator
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -293,14 +294,12 @@ class VisualizationService:
             print(f"特征矩阵形状: {X.shape}, 目标矩阵形状: {y_actual.shape}")
             
             results = {}
+            # 多输出模型一次predict得到所有目标列
+            predictions = predict_targets(model, X, target_columns)
             
             for target_col in target_columns:
-                if len(target_columns) == 1:
-                    y_pred = model.predict(X)
-                    y_true = y_actual.iloc[:, 0]
-                else:
-                    y_pred = model[target_col].predict(X)
-                    y_true = y_actual[target_col]
+                y_pred = predictions[target_col]
+                y_true = y_actual[target_col]
                 
                 # Matplotlib version
                 plt.figure(figsize=(8, 6))
@@ -350,14 +349,12 @@ class VisualizationService:
             y_actual = train_data[target_columns]
             
             results = {}
+            # 多输出模型一次predict得到所有目标列
+            predictions = predict_targets(model, X, target_columns)
             
             for target_col in target_columns:
-                if len(target_columns) == 1:
-                    y_pred = model.predict(X)
-                    y_true = y_actual.iloc[:, 0]
-                else:
-                    y_pred = model[target_col].predict(X)
-                    y_true = y_actual[target_col]
+                y_pred = predictions[target_col]
+                y_true = y_actual[target_col]
                 
                 residuals = y_true - y_pred
                 
@@ -409,7 +406,7 @@ class VisualizationService:
             results = {}
             
             for target_col in target_columns:
-                current_model = model if len(target_columns) == 1 else model[target_col]
+                current_model, output_index = target_estimator(model, target_columns, target_col)
                 
                 # Check if model has feature importance
                 print(f"检查模型 {target_col} 是否支持特征重要性...")
@@ -423,8 +420,10 @@ class VisualizationService:
                     elif hasattr(current_model, 'coef_'):
                         print(f"找到coef_属性")
                         importance = np.abs(current_model.coef_)
-                        # 确保1维数组
-                        if importance.ndim > 1:
+                        # 确保1维数组；多输出模型取该目标列对应的系数
+                        if importance.ndim > 1 and output_index is not None:
+                            importance = importance[output_index]
+                        elif importance.ndim > 1:
                             importance = importance.sum(axis=0)
                         has_importances = True
                     else:
@@ -506,8 +505,8 @@ class VisualizationService:
             results = {}
             
             for target_col in target_columns:
-                current_model = model if len(target_columns) == 1 else model[target_col]
-                y_target = y_actual.iloc[:, 0] if len(target_columns) == 1 else y_actual[target_col]
+                current_model, _ = target_estimator(model, target_columns, target_col)
+                y_target = y_actual[target_col]
                 
                 # Clone the model to avoid modifying the original
                 model_clone = clone(current_model)
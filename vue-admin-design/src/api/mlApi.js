@@ -130,6 +130,18 @@ export const trainModel = (params) => {
   })
 }
 
+export const continueTraining = (params) => {
+  return request({
+    url: '/api/ml/continue',
+    method: 'post',
+    data: params
+  })
+  .catch(error => {
+    console.error('继续训练失败:', error);
+    return { success: false, message: error.message || '继续训练失败' };
+  })
+}
+
 export const predictModel = (params) => {
   return request({
     url: '/api/ml/predict',